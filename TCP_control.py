@@ -4,35 +4,69 @@
 # - PC IP: 192.168.106.186
 # - Pi IP: 192.168.106.245
 
+import asyncio
 import socket
+import sys
 import threading
-from queue import Queue
+import time
+
+import metrics
+from framing import FramingError, encode_response, new_decoder
+from ingest_queue import IngestQueue
+from udp_sender import WINDOW, ResponseSender
+
+METRICS_PORT = 9102  # Prometheus text on http://127.0.0.1:9102/metrics
+
+TCP_PACKETS = metrics.counter("tcp_packets_total", "TCP packets received from the PC")
+TCP_BYTES = metrics.counter("tcp_bytes_total", "TCP bytes received from the PC")
+TCP_COMMANDS = metrics.counter("tcp_commands_total", "Commands decoded from the TCP stream")
+FRAMING_ERRORS = metrics.counter("tcp_framing_errors_total", "Connections closed on a bad record")
+TCP_CONNECTIONS = metrics.gauge("tcp_connections", "Open PC connections")
+HANDLER_LATENCY = metrics.histogram("tcp_handler_seconds", "TCP recv -> command handled")
+RESPONSE_LATENCY = metrics.histogram("tcp_to_udp_seconds", "TCP recv -> UDP response queued")
 
 class PiCommunicationSystem:
-    def __init__(self):
+    def __init__(self, pc_ip='192.168.106.186', recv_port=8080, send_port=8800,
+                 local_send_port=8090, backlog=5, verbose=True, framing='raw',
+                 queue_size=1024, overflow='drop_oldest', consumer=None,
+                 response_window=WINDOW, response_seq=False):
         # Updated network configuration
-        self.pc_ip = '192.168.106.186'    # PC's new IP address
-        self.recv_from_pc_port = 8080     # Port to receive data from PC (TCP)
-        self.send_to_pc_port = 8800       # Port where PC listens for responses
-        self.local_send_port = 8090       # Local port for sending data (UDP)
+        self.pc_ip = pc_ip                      # PC's new IP address
+        self.recv_from_pc_port = recv_port      # Port to receive data from PC (TCP)
+        self.send_to_pc_port = send_port        # Port where PC listens for responses
+        self.local_send_port = local_send_port  # Local port for sending data (UDP)
+        self.verbose = verbose                  # Print every packet and response
+        self.backlog = backlog
+        # 'raw': one recv() is one command (legacy PC client)
+        # 'fixed': 3-byte [cmd][param1][param2] records, 'length': 2-byte length prefix
+        self.framing = framing
+        new_decoder(framing)  # reject unknown names early
         
         # Create TCP socket for receiving data
         self.recv_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         self.recv_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
         self.recv_socket.bind(('0.0.0.0', self.recv_from_pc_port))
-        self.recv_socket.listen(5)  # Allow up to 5 queued connections
+        self.recv_socket.listen(backlog)  # Allow up to `backlog` queued connections
         
-        # Create UDP socket for sending data
+        # Create UDP socket for sending data, connected to the PC by the sender;
+        # responses within response_window seconds go out in one batch,
+        # response_seq prefixes each datagram with a 32-bit sequence number
         self.send_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
         self.send_socket.bind(('0.0.0.0', self.local_send_port))
+        self.sender = ResponseSender(self.send_socket, (self.pc_ip, self.send_to_pc_port),
+                                     window=response_window, sequence=response_seq,
+                                     verbose=verbose)
         
-        # Data queue for received messages
-        self.data_queue = Queue()
+        # Bounded queue for received messages, drained by consumer(list of commands)
+        # overflow: 'drop_oldest', 'drop_newest' or 'block' (stalls the sender)
+        self.data_queue = IngestQueue(queue_size, overflow, consumer, name="tcp_commands")
         self.running = False
         
     def start(self):
         """Start the communication system"""
         self.running = True
+        self.data_queue.start()
+        self.sender.start()
         print(f"Pi Communication System started")
         print(f"Listening for PC commands on port {self.recv_from_pc_port}")
         print(f"Sending responses to {self.pc_ip}:{self.send_to_pc_port}")
@@ -46,7 +80,9 @@ class PiCommunicationSystem:
         """Stop the communication system"""
         self.running = False
         self.recv_socket.close()
+        self.sender.stop()
         self.send_socket.close()
+        self.data_queue.stop()
         print("Communication system stopped")
         
     def _handle_connections(self):
@@ -54,7 +90,8 @@ class PiCommunicationSystem:
         while self.running:
             try:
                 conn, addr = self.recv_socket.accept()
-                print(f"Connection established from {addr}")
+                if self.verbose:
+                    print(f"Connection established from {addr}")
                 
                 # Handle each client in a separate thread
                 client_thread = threading.Thread(
@@ -71,25 +108,53 @@ class PiCommunicationSystem:
     
     def _handle_client(self, conn):
         """Handle communication with a single client"""
+        TCP_CONNECTIONS.inc()
+        decoder = new_decoder(self.framing)
         try:
             while self.running:
                 data = conn.recv(1024)  # Receive up to 1024 bytes
                 if not data:
                     break
-                
-                print(f"Received data: {data.hex()}")
-                self.data_queue.put(data)
-                
-                # Process the received data
-                response = self._process_data(data)
-                if response:
-                    self._send_response(response)
+                self._on_packet(data, decoder)
                     
         except ConnectionResetError:
             print("Client disconnected unexpectedly")
+        except FramingError as e:
+            FRAMING_ERRORS.inc()
+            print(f"Closing connection: {e}")
         finally:
+            TCP_CONNECTIONS.dec()
             conn.close()
     
+    def _on_packet(self, data, decoder=None):
+        """Queue, process and answer one received packet
+
+        With a decoder the packet may hold several pipelined commands or part
+        of one; each response goes back as its own datagram, in command order.
+        """
+        received = time.perf_counter()
+        TCP_PACKETS.inc()
+        TCP_BYTES.inc(len(data))
+        
+        if self.verbose:
+            print(f"Received data: {data.hex()}")
+        records = decoder.feed(data) if decoder else [data]
+        if not records:
+            return  # command continues in the next packet
+        TCP_COMMANDS.inc(len(records))
+        
+        # Process the received commands
+        responses = []
+        for record in records:
+            self.data_queue.put(record)
+            response = self._process_data(record)
+            if response:
+                responses.append(response)
+        HANDLER_LATENCY.since(received)
+        if responses:
+            self._send_responses([encode_response(self.framing, r) for r in responses])
+            RESPONSE_LATENCY.since(received)
+    
     def _process_data(self, data):
         """Process received data and generate response"""
         try:
@@ -119,7 +184,8 @@ class PiCommunicationSystem:
         if len(data) >= 3:
             display_num = data[1]
             action = data[2]
-            print(f"Display {display_num} command: {'ON' if action == 0x01 else 'OFF'}")
+            if self.verbose:
+                print(f"Display {display_num} command: {'ON' if action == 0x01 else 'OFF'}")
             return bytes([0x01, 0x00])  # Success response
         return bytes([0x01, 0xFF])  # Invalid command
     
@@ -133,21 +199,126 @@ class PiCommunicationSystem:
         # Implement LED control logic here
         return bytes([0x03, 0x00])  # Success response
     
-    def _send_response(self, data):
-        """Send response data to PC via UDP"""
+    def _send_responses(self, datagrams):
+        """Send response datagrams to PC via UDP (queued on the batching sender)"""
+        self.sender.send_many(datagrams)
+
+
+class AsyncPiCommunicationSystem(PiCommunicationSystem):
+    """Same system served by one asyncio event loop instead of a thread per client
+
+    All connections and the command handlers run on a single loop thread
+    (responses still go through the sender thread); start()/stop() behave
+    like the threaded version. serve()/aclose() run it on an existing loop.
+    With overflow='block' a full queue stalls the loop, i.e. every client.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._loop = None
+        self._loop_thread = None
+        self._server = None
+        self._clients = {}   # task -> StreamWriter
+
+    def start(self):
+        """Start the communication system on its own loop thread
+
+        Raises what serve() raised (e.g. the listening socket is unusable);
+        stop() then releases the sockets.
+        """
+        self._loop = asyncio.new_event_loop()
+        ready = threading.Event()
+        failure = []
+        self._loop_thread = threading.Thread(target=self._run_loop, args=(ready, failure), daemon=True)
+        self._loop_thread.start()
+        ready.wait()
+        if failure:
+            self._loop_thread.join()
+            self._loop_thread = None
+            raise failure[0]
+
+    def stop(self):
+        """Stop the communication system"""
+        if not self._loop_thread:
+            super().stop()
+            return
+        asyncio.run_coroutine_threadsafe(self.aclose(), self._loop).result(timeout=5)
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._loop_thread.join()
+        self._loop_thread = None
+
+    def _run_loop(self, ready, failure):
+        asyncio.set_event_loop(self._loop)
         try:
-            self.send_socket.sendto(data, (self.pc_ip, self.send_to_pc_port))
-            print(f"Sent response to {self.pc_ip}:{self.send_to_pc_port}")
-        except Exception as e:
-            print(f"Failed to send response: {str(e)}")
+            self._loop.run_until_complete(self.serve())
+        except BaseException as e:
+            failure.append(e)
+            self._loop.close()
+            return
+        finally:
+            ready.set()   # never leave start() waiting
+        self._loop.run_forever()
+        self._loop.close()
+
+    async def serve(self):
+        """Start serving on the running event loop"""
+        self.running = True
+        self._loop = asyncio.get_running_loop()
+        self.data_queue.start()
+        self.sender.start()
+        print(f"Pi Communication System started (asyncio)")
+        print(f"Listening for PC commands on port {self.recv_from_pc_port}")
+        print(f"Sending responses to {self.pc_ip}:{self.send_to_pc_port}")
+        self._server = await asyncio.start_server(self._serve_client, sock=self.recv_socket,
+                                                  backlog=self.backlog)
+
+    async def aclose(self):
+        """Stop serving; counterpart of serve(), called on the same loop"""
+        self.running = False
+        self._server.close()
+        for writer in self._clients.values():
+            writer.close()  # the client's read() returns EOF
+        await asyncio.gather(*self._clients, return_exceptions=True)
+        PiCommunicationSystem.stop(self)
+
+    async def _serve_client(self, reader, writer):
+        """Handle communication with a single client"""
+        task = asyncio.current_task()
+        self._clients[task] = writer
+        TCP_CONNECTIONS.inc()
+        if self.verbose:
+            print(f"Connection established from {writer.get_extra_info('peername')}")
+        decoder = new_decoder(self.framing)
+        try:
+            while self.running:
+                data = await reader.read(1024)  # Whatever arrived, up to 1024 bytes
+                if not data:
+                    break
+                self._on_packet(data, decoder)
+        except ConnectionResetError:
+            print("Client disconnected unexpectedly")
+        except FramingError as e:
+            FRAMING_ERRORS.inc()
+            print(f"Closing connection: {e}")
+        finally:
+            TCP_CONNECTIONS.dec()
+            self._clients.pop(task, None)
+            writer.close()
 
 if __name__ == "__main__":
-    pi_system = PiCommunicationSystem()
+    # --framing raw|fixed|length selects how commands are cut from the TCP stream
+    mode = sys.argv[sys.argv.index("--framing") + 1] if "--framing" in sys.argv else "raw"
+    if "--async" in sys.argv:
+        pi_system = AsyncPiCommunicationSystem(framing=mode)
+    else:
+        pi_system = PiCommunicationSystem(framing=mode)
+    metrics.serve_http(METRICS_PORT)
+    metrics.start_log_reporter()
     try:
         pi_system.start()
-        # Keep main thread alive
+        # Keep main thread alive (sleeping, not spinning)
         while True:
-            pass
+            time.sleep(1)
     except KeyboardInterrupt:
         print("\nShutting down...")
     finally:
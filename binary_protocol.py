@@ -0,0 +1,197 @@
+# binary_protocol.py
+# Optional compact binary framing for the motor board serial link.
+#
+#   [0xA5][type][payload][crc16]      crc16 = CRC-CCITT over sync..payload
+#
+# Motor commands and $MTEP/$MSPD telemetry carry 4 x int16, $MAll carries
+# 4 x int32 (cumulative encoder counts outgrow int16). Command speeds go out
+# in the same units as the ASCII "$spd"/"$pwm" values, clamped to int16;
+# only $MSPD telemetry is scaled, to 0.1 mm/s. The mode is negotiated at
+# startup with the ASCII frame
+# "$proto:1#"; a board that answers "$PROTO:1#" switches to binary in both
+# directions, anything else keeps the ASCII "$spd:...#" protocol.
+
+import binascii
+import os
+import select
+import struct
+import time
+
+from frame_parser import FrameParser
+
+SYNC = 0xA5
+NEGOTIATE_REQUEST = b"$proto:1#"
+NEGOTIATE_REPLY = b"$PROTO:1#"
+NEGOTIATE_TIMEOUT = 0.1   # s to wait for the board's reply
+
+# host -> board
+MSG_SPD = 0x01
+MSG_PWM = 0x02
+# board -> host
+MSG_MALL = 0x81
+MSG_MTEP = 0x82
+MSG_MSPD = 0x83
+
+SPEED_SCALE = 10  # MSPD units per mm/s
+INT16_MIN, INT16_MAX = -0x8000, 0x7FFF
+
+_BODY = {
+    MSG_SPD: struct.Struct("<BB4h"),
+    MSG_PWM: struct.Struct("<BB4h"),
+    MSG_MALL: struct.Struct("<BB4i"),
+    MSG_MTEP: struct.Struct("<BB4h"),
+    MSG_MSPD: struct.Struct("<BB4h"),
+}
+_CRC = struct.Struct("<H")
+
+# telemetry message type <-> TelemetryStore kind
+TELEMETRY_KINDS = {MSG_MALL: "MAll", MSG_MTEP: "MTEP", MSG_MSPD: "MSPD"}
+
+
+def frame_size(msg_type):
+    return _BODY[msg_type].size + _CRC.size
+
+
+def encode(msg_type, values):
+    """Pack one binary frame"""
+    body = _BODY[msg_type].pack(SYNC, msg_type, *values)
+    return body + _CRC.pack(binascii.crc_hqx(body, 0xFFFF))
+
+
+def _int16(value):
+    return max(INT16_MIN, min(INT16_MAX, int(value)))
+
+
+def encode_motor(speeds, motor_type=1):
+    """Binary equivalent of motor_engine.format_motor_frame()
+
+    Values outside int16 are clamped: a struct.error here would stop the
+    motor engine thread.
+    """
+    if motor_type == 4:
+        return encode(MSG_PWM, [_int16(s * 2) for s in speeds])
+    return encode(MSG_SPD, [_int16(s) for s in speeds])
+
+
+def encode_telemetry(kind, values):
+    if kind == "MAll":
+        return encode(MSG_MALL, [int(v) for v in values])
+    if kind == "MTEP":
+        return encode(MSG_MTEP, [int(v) for v in values])
+    return encode(MSG_MSPD, [int(round(v * SPEED_SCALE)) for v in values])
+
+
+class BinaryFrameParser:
+    """Incremental decoder for binary frames, resyncs on the next sync byte"""
+
+    def __init__(self):
+        self.buffer = bytearray()
+        self.frames = 0
+        self.dropped_bytes = 0
+        self.crc_errors = 0
+
+    def feed(self, data):
+        """Append received bytes and return a list of (msg_type, values)"""
+        buf = self.buffer
+        buf += data
+        frames = []
+        pos = 0
+        size = len(buf)
+        while True:
+            start = buf.find(SYNC, pos)
+            if start < 0:
+                self.dropped_bytes += size - pos
+                pos = size
+                break
+            self.dropped_bytes += start - pos
+            pos = start
+            if size - start < 2:
+                break
+            body = _BODY.get(buf[start + 1])
+            if body is None:
+                self.dropped_bytes += 1
+                pos = start + 1
+                continue
+            end = start + body.size + _CRC.size
+            if end > size:
+                break
+            crc = _CRC.unpack_from(buf, start + body.size)[0]
+            if crc != binascii.crc_hqx(memoryview(buf)[start:start + body.size], 0xFFFF):
+                self.crc_errors += 1
+                self.dropped_bytes += 1
+                pos = start + 1
+                continue
+            fields = body.unpack_from(buf, start)
+            frames.append((fields[1], fields[2:]))
+            pos = end
+        del buf[:pos]
+        self.frames += len(frames)
+        return frames
+
+    def stats(self):
+        return {"frames": self.frames, "dropped_bytes": self.dropped_bytes,
+                "crc_errors": self.crc_errors}
+
+
+def decode_telemetry(msg_type, values):
+    """(kind, values) as the ASCII telemetry would give them, or None"""
+    kind = TELEMETRY_KINDS.get(msg_type)
+    if kind is None:
+        return None
+    if msg_type == MSG_MSPD:
+        values = [v / SPEED_SCALE for v in values]
+    return kind, values
+
+
+def negotiate(port, timeout=NEGOTIATE_TIMEOUT):
+    """Offer binary mode to the board; True if it accepted
+
+    Run before the engine starts reading the port. ASCII telemetry that
+    arrives while waiting is discarded.
+    """
+    port.write(NEGOTIATE_REQUEST)
+    parser = FrameParser()
+    fd = port.fileno()
+    deadline = time.monotonic() + timeout
+    while True:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return False
+        readable, _, _ = select.select([fd], [], [], remaining)
+        if readable and NEGOTIATE_REPLY in parser.feed(os.read(fd, 4096)):
+            return True
+
+
+def _benchmark(count=100000, baudrate=115200):
+    from motor_engine import format_motor_frame
+    from telemetry import decode_frame
+
+    speeds = [1000, -1000, 1000, -1000]
+    ascii_frame = format_motor_frame(speeds, 1).encode()
+    binary_frame = encode_motor(speeds)
+    ascii_tel = b"$MSPD:105.50,-104.20,106.00,-105.10#"
+    binary_tel = encode_telemetry("MSPD", [105.5, -104.2, 106.0, -105.1])
+
+    def timed(func):
+        start = time.perf_counter()
+        for _ in range(count):
+            func()
+        return (time.perf_counter() - start) / count * 1e6
+
+    ascii_parser = FrameParser()
+    parser = BinaryFrameParser()
+    rows = [
+        ("command encode", timed(lambda: format_motor_frame(speeds, 1).encode()),
+         timed(lambda: encode_motor(speeds)), len(ascii_frame), len(binary_frame)),
+        ("telemetry decode", timed(lambda: [decode_frame(f) for f in ascii_parser.feed(ascii_tel)]),
+         timed(lambda: [decode_telemetry(*f) for f in parser.feed(binary_tel)]),
+         len(ascii_tel), len(binary_tel)),
+    ]
+    bytes_per_s = baudrate / 10  # 8N1
+    for name, ascii_us, binary_us, ascii_len, binary_len in rows:
+        print(f"{name:<17} ascii {ascii_us:5.2f} us {ascii_len:3d} B ({bytes_per_s / ascii_len:4.0f} frames/s max)"
+              f" | binary {binary_us:5.2f} us {binary_len:3d} B ({bytes_per_s / binary_len:4.0f} frames/s max)")
+
+
+if __name__ == "__main__":
+    _benchmark()
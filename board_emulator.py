@@ -0,0 +1,261 @@
+# board_emulator.py
+# Firmware emulator for the 4-channel motor controller board.
+# Serves the board side of a pty: accepts $spd/$pwm/$mtype/$deadzone/$mline/
+# $mphase/$wdiameter/$upload frames and streams $MAll/$MTEP/$MSPD telemetry
+# at a configurable rate, with optional first-order wheel dynamics.
+# Answers "$proto:1#" and then speaks binary_protocol (unless binary=False).
+# Lets the serial path and the control loop be load-tested on any Linux box.
+#
+#   python board_emulator.py          # serve a pty, print its path
+#   python board_emulator.py --bench  # drive MotorEngine against it
+#   python board_emulator.py --bench --binary
+
+import math
+import os
+import selectors
+import sys
+import threading
+import time
+
+import binary_protocol
+from frame_parser import FrameParser
+from transport import PtyTransport
+
+TELEMETRY_RATE = 50.0   # telemetry frames per second (per enabled type)
+TIME_CONSTANT = 0.15    # wheel speed response time constant (s)
+PWM_FULL_SPEED = 1000.0 # mm/s reached at the maximum PWM of 3600
+
+
+class BoardEmulator:
+    def __init__(self, fd, telemetry_rate=TELEMETRY_RATE, dynamics=True,
+                 time_constant=TIME_CONSTANT, binary=True):
+        self.fd = fd
+        self.supports_binary = binary
+        self.binary = False                # switched on by "$proto:1#"
+        self.telemetry_rate = telemetry_rate
+        self.dynamics = dynamics
+        self.time_constant = time_constant
+
+        # board configuration, changed by the config frames
+        self.config = {"mtype": 1, "deadzone": 1600, "mline": 11,
+                       "mphase": 30, "wdiameter": 67.0}
+        self.upload = [0, 0, 0]            # MAll, MTEP, MSPD enabled
+        self.target = [0.0] * 4            # mm/s
+        self.speed = [0.0] * 4             # mm/s
+        self.encoder = [0.0] * 4           # total counts
+        self.period_counts = [0.0] * 4     # counts in the last telemetry period
+
+        self.parser = FrameParser()
+        self.binary_parser = binary_protocol.BinaryFrameParser()
+        self.commands = 0
+        self.unknown = 0
+        self.telemetry_frames = 0
+        self.telemetry_bytes = 0
+        self.last_command = None           # (monotonic receive time, frame)
+        self.on_command = None             # optional callback(frame, receive_time)
+        self.running = False
+        self._thread = None
+        self._wake_r, self._wake_w = os.pipe()
+
+    # ----- lifecycle -----
+    def start(self):
+        self.running = True
+        self._thread = threading.Thread(target=self.run, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.running = False
+        os.write(self._wake_w, b"\x00")
+        if self._thread:
+            self._thread.join()
+        os.close(self._wake_r)
+        os.close(self._wake_w)
+
+    def run(self):
+        sel = selectors.DefaultSelector()
+        sel.register(self.fd, selectors.EVENT_READ, "serial")
+        sel.register(self._wake_r, selectors.EVENT_READ, "wake")
+        self.running = True
+        interval = 1.0 / self.telemetry_rate
+        last_step = time.monotonic()
+        next_upload = last_step + interval
+        try:
+            while self.running:
+                for key, _ in sel.select(max(0.0, next_upload - time.monotonic())):
+                    if key.data == "serial":
+                        self._read()
+                now = time.monotonic()
+                if now >= next_upload:
+                    self._step(now - last_step)
+                    last_step = now
+                    self._upload()
+                    next_upload = max(next_upload + interval, now)
+        except OSError:
+            pass  # host side of the pty went away
+        finally:
+            sel.close()
+
+    # ----- host -> board -----
+    def _read(self):
+        now = time.monotonic()
+        data = os.read(self.fd, 4096)
+        if self.binary:
+            for msg_type, values in self.binary_parser.feed(data):
+                self.commands += 1
+                self.handle_binary(msg_type, values, now)
+            return
+        for frame in self.parser.feed(data):
+            self.commands += 1
+            self.handle_frame(frame.decode(errors="replace"), now)
+
+    def handle_binary(self, msg_type, values, received=None):
+        if msg_type == binary_protocol.MSG_SPD:
+            frame = "$spd:{},{},{},{}#".format(*values)
+        elif msg_type == binary_protocol.MSG_PWM:
+            frame = "$pwm:{},{},{},{}#".format(*values)
+        else:
+            self.unknown += 1
+            return
+        self.handle_frame(frame, received)
+
+    def handle_frame(self, frame, received=None):
+        received = time.monotonic() if received is None else received
+        name, _, args = frame[1:-1].partition(":")
+        values = args.split(",") if args else []
+        if name in ("spd", "pwm"):
+            speeds = [float(v) for v in values[:4]]
+            if name == "pwm":
+                speeds = [v / 3600.0 * PWM_FULL_SPEED for v in speeds]
+            self.target = speeds + [0.0] * (4 - len(speeds))
+            if not self.dynamics:
+                self.speed = list(self.target)
+            self.last_command = (received, frame)
+        elif name == "upload":
+            self.upload = [int(v) for v in values[:3]]
+        elif name == "proto":
+            if not (self.supports_binary and values == ["1"]):
+                self.unknown += 1
+                return
+            os.write(self.fd, binary_protocol.NEGOTIATE_REPLY)
+            self.binary = True
+        elif name in self.config:
+            self.config[name] = float(values[0]) if name == "wdiameter" else int(values[0])
+        else:
+            self.unknown += 1
+            return
+        if self.on_command:
+            self.on_command(frame, received)
+
+    # ----- simulation -----
+    def counts_per_mm(self):
+        pulses_per_rev = self.config["mline"] * self.config["mphase"] * 4
+        return pulses_per_rev / (math.pi * self.config["wdiameter"])
+
+    def _step(self, dt):
+        alpha = 1.0 - math.exp(-dt / self.time_constant) if self.dynamics else 1.0
+        scale = self.counts_per_mm()
+        for i in range(4):
+            self.speed[i] += (self.target[i] - self.speed[i]) * alpha
+            self.period_counts[i] = self.speed[i] * dt * scale
+            self.encoder[i] += self.period_counts[i]
+
+    def telemetry_values(self):
+        """(kind, values) of the telemetry enabled by the upload flags"""
+        values = []
+        if self.upload[0]:
+            values.append(("MAll", [int(v) for v in self.encoder]))
+        if self.upload[1]:
+            values.append(("MTEP", [int(v) for v in self.period_counts]))
+        if self.upload[2]:
+            values.append(("MSPD", list(self.speed)))
+        return values
+
+    def telemetry(self):
+        """The ASCII frames one upload period produces with the current flags"""
+        frames = []
+        if self.upload[0]:
+            frames.append("$MAll:{},{},{},{}#".format(*[int(v) for v in self.encoder]))
+        if self.upload[1]:
+            frames.append("$MTEP:{},{},{},{}#".format(*[int(v) for v in self.period_counts]))
+        if self.upload[2]:
+            frames.append("$MSPD:{:.2f},{:.2f},{:.2f},{:.2f}#".format(*self.speed))
+        return frames
+
+    def _upload(self):
+        if self.binary:
+            frames = [binary_protocol.encode_telemetry(kind, values)
+                      for kind, values in self.telemetry_values()]
+            data = b"".join(frames)
+        else:
+            frames = self.telemetry()
+            data = "".join(frames).encode()
+        if frames:
+            os.write(self.fd, data)
+            self.telemetry_frames += len(frames)
+            self.telemetry_bytes += len(data)
+
+
+def serve_pty(**kwargs):
+    """Start an emulator on a fresh pty; returns (host transport, emulator)"""
+    transport = PtyTransport()
+    emulator = BoardEmulator(transport.board_fd, **kwargs).start()
+    return transport, emulator
+
+
+def _benchmark(duration=5.0, command_rate=100.0, telemetry_rate=200.0, binary=False):
+    """Load-test MotorEngine against the emulator"""
+    from motor_engine import MotorEngine
+
+    transport, board = serve_pty(telemetry_rate=telemetry_rate)
+    latencies = []
+    submitted = {}
+    board.on_command = lambda frame, t: (
+        latencies.append(t - submitted.pop(frame)) if frame in submitted else None)
+
+    transport.write(b"$upload:1,1,1#")
+    binary = binary and binary_protocol.negotiate(transport)
+    received = [0]
+    count = lambda *args: received.__setitem__(0, received[0] + 1)
+    engine = MotorEngine(transport, on_receive=count, on_telemetry=count, binary=binary)
+    thread = threading.Thread(target=engine.run, daemon=True)
+    thread.start()
+
+    start = time.monotonic()
+    i = 0
+    while time.monotonic() - start < duration:
+        i += 1
+        speed = i % 1000
+        submitted["$spd:{0},{0},{0},{0}#".format(speed)] = time.monotonic()
+        engine.submit([speed] * 4)
+        time.sleep(1.0 / command_rate)
+    time.sleep(0.1)
+    engine.stop()
+    thread.join()
+    engine.close()
+    board.stop()
+    transport.close()
+
+    latencies.sort()
+    pick = lambda q: latencies[min(len(latencies) - 1, int(q * len(latencies)))] * 1e6
+    mode = "binary" if binary else "ascii"
+    print(f"[{mode}] {i} commands at {command_rate:.0f}/s, {len(latencies)} seen by the board: "
+          f"p50 {pick(0.5):.0f} us, p99 {pick(0.99):.0f} us, {engine.writer.bytes_sent} bytes sent")
+    print(f"[{mode}] telemetry: {board.telemetry_frames} frames / {board.telemetry_bytes} bytes sent, "
+          f"{received[0]} received by the host")
+
+
+if __name__ == "__main__":
+    if "--bench" in sys.argv:
+        _benchmark(binary="--binary" in sys.argv)
+    else:
+        transport, board = serve_pty()
+        print(f"Motor board emulator on {transport.name} (Ctrl+C to stop)")
+        try:
+            while True:
+                time.sleep(1)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            board.stop()
+            transport.close()
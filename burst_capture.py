@@ -0,0 +1,276 @@
+# burst_capture.py
+# Burst / timelapse stills with the JPEG encoding spread over all cores.
+# The capture thread takes a frame from the running camera at a fixed
+# cadence, copies it into one slot of a preallocated pool of shared-memory
+# frame buffers, gives the camera buffer straight back and submits the slot
+# to a process pool that encodes and writes the JPEG. The pool is the
+# bounded queue: when every slot is still waiting for an encoder the frame
+# is dropped and counted, the cadence is never stretched. Late ticks (the
+# camera could not deliver in time) are skipped and counted as well.
+#
+#   burst = BurstCapture(picam2, (4608, 2592), "/home/Documents/photo").start()
+#   burst.run(count=20, interval=0.1)     # burst: 20 frames at 10 fps
+#   burst.run(interval=3.0)               # timelapse until burst.cancel()
+#   burst.stop()
+#
+#   python burst_capture.py --bench [frames]   # stills/s with 1..N encoder processes
+
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context, shared_memory
+
+import metrics
+
+POOL_SIZE = 6          # frame buffers; with 4608x2592 RGB888 ~36 MB each
+QUALITY = 90           # JPEG quality
+WORKERS = os.cpu_count() or 1
+
+CAPTURED = metrics.counter("burst_frames_captured_total", "Frames copied into the buffer pool")
+ENCODED = metrics.counter("burst_frames_encoded_total", "Frames written as JPEG")
+ERRORS = metrics.counter("burst_encode_errors_total", "Frames whose encode or write failed")
+LATE = metrics.counter("burst_ticks_late_total", "Cadence ticks skipped because capture fell behind")
+IN_USE = metrics.gauge("burst_pool_in_use", "Pool slots waiting for or being encoded")
+ENCODE = metrics.histogram("burst_encode_seconds", "JPEG encode + write in a worker process")
+TO_FILE = metrics.histogram("burst_capture_to_file_seconds", "Frame captured -> JPEG on disk")
+
+
+def _dropped(reason):
+    return metrics.counter("burst_frames_dropped_total", "Frames lost before encoding", {"reason": reason})
+
+
+# ----- worker process side -----
+_attached = {}   # shared memory name -> SharedMemory, per worker process
+
+
+def _slot(name):
+    shm = _attached.get(name)
+    if shm is None:
+        # forkserver workers share the parent's resource tracker, which unlinks
+        # the block once, when the parent does
+        shm = _attached[name] = shared_memory.SharedMemory(name)
+    return shm
+
+
+def encode_jpeg(buffer, width, height, stride, path, quality=QUALITY):
+    """Encode one BGR888 frame (Picamera2 "RGB888") with simplejpeg or Pillow"""
+    try:
+        import numpy as np
+        import simplejpeg
+        array = np.ndarray((height, width, 3), np.uint8, buffer, strides=(stride, 3, 1))
+        data = simplejpeg.encode_jpeg(array, quality=quality, colorspace="BGR")
+        with open(path, 'wb') as f:
+            f.write(data)
+    except ImportError:
+        from PIL import Image
+        image = Image.frombuffer("RGB", (width, height), bytes(buffer[:stride * height]),
+                                 "raw", "BGR", stride, 1)
+        image.save(path, quality=quality)
+
+
+def _encode_slot(encoder, name, width, height, stride, path, quality):
+    start = time.perf_counter()
+    encoder(_slot(name).buf, width, height, stride, path + ".tmp", quality)
+    os.replace(path + ".tmp", path)   # readers never see a half-written JPEG
+    return time.perf_counter() - start
+
+
+class BurstCapture:
+    def __init__(self, camera, size, directory, pool=POOL_SIZE, workers=WORKERS,
+                 quality=QUALITY, encoder=encode_jpeg, configure=True, on_saved=None):
+        self.camera = camera
+        self.size = size
+        self.directory = directory
+        self.pool_size = pool
+        self.workers = workers
+        self.quality = quality
+        self.encoder = encoder           # module-level function, runs in the workers
+        self.configure = configure       # False: the camera is already set up and started
+        self.on_saved = on_saved         # callable(path, capture time ns) per written JPEG
+        self.slots = []
+        self.free = []                   # indexes of unused slots
+        self.stride = None
+        self.seq = 0
+        self.running = False
+        self._cancel = threading.Event()
+        self._cond = threading.Condition()
+        self._executor = None
+        IN_USE.fn = lambda: len(self.slots) - len(self.free)
+
+    def start(self):
+        if self.configure:
+            config = self.camera.create_still_configuration(
+                main={"size": self.size, "format": "RGB888"}, buffer_count=2)
+            self.camera.configure(config)
+            self.camera.start()
+        self.stride = self.camera.stream_configuration("main")["stride"]
+        frame_bytes = self.stride * self.size[1]
+        self.slots = [shared_memory.SharedMemory(create=True, size=frame_bytes)
+                      for _ in range(self.pool_size)]
+        self.free = list(range(self.pool_size))
+        # forkserver: workers do not inherit the camera or this process's threads
+        self._executor = ProcessPoolExecutor(self.workers, mp_context=get_context("forkserver"))
+        self.running = True
+        return self
+
+    def stop(self):
+        """Finish the encodes already queued, then free the pool"""
+        self.cancel()
+        self.running = False
+        if self._executor:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+        for shm in self.slots:
+            shm.close()
+            shm.unlink()
+        self.slots, self.free = [], []
+        if self.configure:
+            self.camera.stop()
+
+    def cancel(self):
+        """End a running burst or timelapse after the current frame"""
+        self._cancel.set()
+
+    # ----- capture side -----
+    def run(self, count=None, interval=0.0):
+        """Capture count frames (None: until cancel()) every interval seconds
+
+        Returns (captured, dropped) for this run; encoding may still be going on.
+        """
+        self._cancel.clear()
+        captured = dropped = 0
+        next_tick = time.perf_counter()
+        while self.running and not self._cancel.is_set() and (count is None or captured + dropped < count):
+            delay = next_tick - time.perf_counter()
+            if delay > 0 and self._cancel.wait(delay):
+                break
+            if self._grab():
+                captured += 1
+            else:
+                dropped += 1
+            next_tick += interval
+            behind = time.perf_counter() - next_tick
+            if interval and behind >= interval:
+                # keep the cadence: skip the ticks that are already gone
+                missed = int(behind / interval)
+                LATE.inc(missed)
+                next_tick += missed * interval
+        return captured, dropped
+
+    def _grab(self):
+        request = self.camera.capture_request()
+        taken = time.perf_counter()
+        taken_ns = time.time_ns()
+        try:
+            with self._cond:
+                index = self.free.pop() if self.free else None
+            if index is None:
+                _dropped("pool_full").inc()
+                return False
+            buffer = request.make_buffer("main")
+            self.slots[index].buf[:len(buffer)] = buffer
+        finally:
+            request.release()   # the camera gets its buffer back before the encode starts
+        CAPTURED.inc()
+        self.seq += 1
+        path = os.path.join(self.directory, f"burst_{time.strftime('%Y%m%d_%H%M%S')}_{self.seq:05d}.jpg")
+        try:
+            future = self._executor.submit(_encode_slot, self.encoder, self.slots[index].name,
+                                           self.size[0], self.size[1], self.stride, path, self.quality)
+        except RuntimeError:   # executor shut down under us
+            self._release(index)
+            _dropped("stopped").inc()
+            return False
+        future.add_done_callback(lambda f: self._encoded(f, index, path, taken, taken_ns))
+        return True
+
+    def _encoded(self, future, index, path, taken, taken_ns):
+        self._release(index)
+        try:
+            ENCODE.observe(future.result())
+        except Exception as e:
+            ERRORS.inc()
+            print(f"Encoding {path} failed: {e}")
+            return
+        ENCODED.inc()
+        TO_FILE.since(taken)
+        if self.on_saved:
+            try:
+                self.on_saved(path, taken_ns)
+            except Exception as e:
+                print(f"on_saved for {path} failed: {e}")
+
+    def _release(self, index):
+        with self._cond:
+            self.free.append(index)
+            self._cond.notify_all()
+
+    def wait_idle(self, timeout=None):
+        """Block until every captured frame has been encoded"""
+        with self._cond:
+            return self._cond.wait_for(lambda: len(self.free) == len(self.slots), timeout)
+
+
+# ----- benchmark -----
+def _zlib_encoder(buffer, width, height, stride, path, quality=QUALITY):
+    """CPU-bound stand-in for encode_jpeg where no JPEG library is installed"""
+    import zlib
+    with open(path, 'wb') as f:
+        f.write(zlib.compress(buffer[:stride * height], 6))
+
+
+class _SyntheticCamera:
+    """A camera delivering the same noisy frame at a fixed frame rate"""
+
+    def __init__(self, size, fps=30.0):
+        self.size = size
+        self.interval = 1.0 / fps
+        self.frame = (os.urandom(4096) + bytes(4096)) * (size[0] * size[1] * 3 // 8192 + 1)
+        self.frame = self.frame[:size[0] * size[1] * 3]
+        self.next = time.perf_counter()
+
+    def stream_configuration(self, name):
+        return {"stride": self.size[0] * 3}
+
+    def capture_request(self):
+        self.next = max(self.next + self.interval, time.perf_counter())
+        time.sleep(max(0.0, self.next - time.perf_counter()))
+        return self
+
+    def make_buffer(self, name):
+        return self.frame
+
+    def release(self):
+        pass
+
+
+def _benchmark(frames=60, size=(2304, 1296)):
+    import tempfile
+    try:
+        encode_jpeg(memoryview(bytes(48)), 4, 4, 12, os.devnull)
+        encoder, label = encode_jpeg, "JPEG"
+    except ImportError:
+        encoder, label = _zlib_encoder, "zlib stand-in (no simplejpeg/Pillow)"
+    print(f"{frames} frames of {size[0]}x{size[1]} at 30 fps, encoder: {label}, {WORKERS} core(s)")
+    for workers in sorted({1, max(1, WORKERS // 2), WORKERS}):
+        with tempfile.TemporaryDirectory() as tmp:
+            burst = BurstCapture(_SyntheticCamera(size), size, tmp, workers=workers,
+                                 encoder=encoder, configure=False).start()
+            burst._executor.submit(int).result()   # workers up before timing
+            encoded = ENCODED.value
+            start = time.perf_counter()
+            captured, dropped = burst.run(count=frames, interval=1 / 30)
+            burst.wait_idle()
+            elapsed = time.perf_counter() - start
+            burst.stop()
+            print(f"  {workers} worker(s): {(ENCODED.value - encoded) / elapsed:5.1f} stills/s sustained, "
+                  f"captured {captured}, dropped {dropped} (pool full), "
+                  f"encode p50 {ENCODE.quantile(0.5) * 1e3:.0f} ms")
+
+
+if __name__ == "__main__":
+    import sys
+    if "--bench" in sys.argv:
+        args = [a for a in sys.argv[1:] if not a.startswith("--")]
+        _benchmark(int(args[0]) if args else 60)
@@ -7,11 +7,14 @@ import time
 from picamera2 import Picamera2
 from gpiozero import LED
 
+from media_store import MediaStore
+
 PC_IP = '192.168.106.186'    # PC端IP（用于白名单）
 PI_IP = '192.168.106.245'    # 树莓派IP
 TCP_PORT = 8080              # 指令端口
 LED_GPIO = 26                # 灯带控制引脚
 PHOTO_RES = (4608, 2592)     # 摄像头分辨率
+STORAGE_DIR = "/home/Documents"  # 照片及索引 (见 media_store.py), 超出配额自动删除最旧的
 
 
 class HardwareController:
@@ -19,6 +22,7 @@ class HardwareController:
 
         self.light = LED(LED_GPIO)
         self.camera = Picamera2()
+        self.store = MediaStore(STORAGE_DIR)
         self._setup_camera()
         print("inital")
 
@@ -35,9 +39,9 @@ class HardwareController:
       
     def take_photo(self):
 
-        filename = f"photo_{time.strftime('%Y%m%d_%H%M%S')}.jpg"
-        self.camera.capture_file(filename)
-        print(f"camera save: {filename}")
+        with self.store.capture("photo", "jpg") as item:
+            self.camera.capture_file(item.tmp)
+        print(f"camera save: {item.path}")
         return True
 
     def control_hdmi(self, port, on):
@@ -51,6 +55,7 @@ class HardwareController:
     def cleanup(self):
         self.light.off()
         self.camera.close()
+        self.store.close()
 
 
 # ========== TCP ==========
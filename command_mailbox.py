@@ -0,0 +1,81 @@
+# command_mailbox.py
+# Latest-wins command slot between the paho network thread and the motor
+# engine. Only the newest command is kept; commands older than the last one
+# posted or applied are discarded. Every applied command records its
+# MQTT-receive -> serial-write latency.
+
+import threading
+import time
+from collections import deque, namedtuple
+
+SEQ_RESET_WINDOW = 1000  # a sequence jump back this large means the sender restarted
+
+Command = namedtuple("Command", "seq speeds active received")
+
+
+class CommandMailbox:
+    def __init__(self, latency_samples=1000):
+        self._lock = threading.Lock()
+        self._slot = None
+        self._last_seq = 0            # newest sequence number accepted
+        self.last_applied = None      # last Command handed to the serial port
+
+        self.posted = 0
+        self.overwritten = 0          # replaced by a newer command before applied
+        self.stale = 0                # rejected as out of order or too old
+        self.applied = 0
+        self.latencies = deque(maxlen=latency_samples)  # receive -> write (s)
+
+    def post(self, speeds, active=True, seq=None, received=None):
+        """Offer a command (any thread); returns the Command or None if stale
+
+        seq is the sender's sequence number if it has one, otherwise the
+        mailbox numbers commands in arrival order.
+        """
+        received = time.monotonic() if received is None else received
+        with self._lock:
+            self.posted += 1
+            if seq is None:
+                seq = self._last_seq + 1
+            elif seq <= self._last_seq and self._last_seq - seq < SEQ_RESET_WINDOW:
+                self.stale += 1
+                return None
+            if self._slot is not None:
+                self.overwritten += 1
+            self._last_seq = seq
+            self._slot = Command(seq, list(speeds), active, received)
+            return self._slot
+
+    def take(self, max_age=None, now=None):
+        """Remove and return the newest command, or None
+
+        A command that waited longer than max_age seconds is dropped.
+        """
+        with self._lock:
+            command, self._slot = self._slot, None
+        if command is None:
+            return None
+        now = time.monotonic() if now is None else now
+        if max_age is not None and now - command.received > max_age:
+            self.stale += 1
+            return None
+        return command
+
+    def mark_applied(self, command, written=None):
+        """Record that command reached the serial port"""
+        written = time.monotonic() if written is None else written
+        self.last_applied = command
+        self.applied += 1
+        self.latencies.append(written - command.received)
+
+    def stats(self):
+        latencies = sorted(self.latencies)
+        pick = lambda q: latencies[min(len(latencies) - 1, int(q * len(latencies)))] if latencies else None
+        return {
+            "posted": self.posted,
+            "applied": self.applied,
+            "overwritten": self.overwritten,
+            "stale": self.stale,
+            "latency_p50": pick(0.5),
+            "latency_p99": pick(0.99),
+        }
@@ -0,0 +1,81 @@
+# command_writer.py
+# Serial command writer for the motor board.
+# Motor frames are only sent when the target changes, plus a keepalive so
+# the board keeps seeing traffic; configuration frames are queued and
+# written together in a single port.write().
+
+import time
+
+KEEPALIVE_INTERVAL = 0.5  # resend an unchanged motor frame this often (s)
+
+
+class CommandWriter:
+    def __init__(self, port, keepalive_interval=KEEPALIVE_INTERVAL):
+        self.port = port
+        self.keepalive_interval = keepalive_interval
+        self._queued = []
+        self._last_frame = None
+        self._last_sent = 0.0
+
+        self.writes = 0          # port.write() calls
+        self.frames_sent = 0
+        self.bytes_sent = 0
+        self.frames_saved = 0    # unchanged motor frames not sent
+        self.bytes_saved = 0
+        self.writes_saved = 0    # write calls avoided by batching
+
+    # ----- configuration frames -----
+    def queue(self, frame):
+        """Queue a frame to go out with the next flush()"""
+        self._queued.append(frame.encode() if isinstance(frame, str) else frame)
+
+    def flush(self):
+        """Write every queued frame in one port.write()"""
+        if not self._queued:
+            return 0
+        data = b"".join(self._queued)
+        self.writes_saved += len(self._queued) - 1
+        self.frames_sent += len(self._queued)
+        self._queued.clear()
+        self._write(data)
+        return len(data)
+
+    # ----- motor frames -----
+    def send_motor(self, frame, force=False, now=None):
+        """Send a motor frame if it changed or the keepalive is due
+
+        Returns True if the frame was written.
+        """
+        now = time.monotonic() if now is None else now
+        data = frame.encode() if isinstance(frame, str) else frame
+        if (not force and data == self._last_frame
+                and now - self._last_sent < self.keepalive_interval):
+            self.frames_saved += 1
+            self.bytes_saved += len(data)
+            return False
+        self._queued.append(data)
+        self.flush()
+        self._last_frame = data
+        self._last_sent = now
+        return True
+
+    def next_keepalive(self):
+        """monotonic time at which the current motor frame must be repeated"""
+        if self._last_frame is None:
+            return float("inf")
+        return self._last_sent + self.keepalive_interval
+
+    def _write(self, data):
+        self.port.write(data)
+        self.writes += 1
+        self.bytes_sent += len(data)
+
+    def stats(self):
+        return {
+            "writes": self.writes,
+            "frames_sent": self.frames_sent,
+            "bytes_sent": self.bytes_sent,
+            "frames_saved": self.frames_saved,
+            "bytes_saved": self.bytes_saved,
+            "writes_saved": self.writes_saved,
+        }
@@ -1,8 +1,14 @@
-import serial
+import sys
 import time
-import json
 import paho.mqtt.client as mqtt
-import threading
+import binary_protocol
+import metrics
+from command_writer import CommandWriter
+from frame_parser import FrameParser
+from motor_engine import MotorEngine, parameter_frames
+from payload_decoder import PayloadDecoder
+from telemetry import TelemetryStore
+from transport import open_transport
 
 # ????
 UPLOAD_DATA = 1
@@ -10,102 +16,94 @@ MOTOR_TYPE = 1
 MQTT_BROKER = "21.tcp.vip.cpolar.cn"
 MQTT_PORT = 13234
 MQTT_TOPIC = "unity_car_tracking/controller"
-
-# ?????
-ser = serial.Serial(
-    port='/dev/ttyUSB0',
-    baudrate=115200,
-    parity=serial.PARITY_NONE,
-    stopbits=serial.STOPBITS_ONE,
-    bytesize=serial.EIGHTBITS,
-    timeout=1
-)
+KEEPALIVE_INTERVAL = 0.5  # resend unchanged speeds this often (s)
+SERIAL_PORT = '/dev/ttyUSB0'  # or "sim" for the pty board emulator
+VERBOSE_COMMANDS = False  # print every joystick message (costly at 50-100 Hz)
+BINARY_PROTOCOL = False   # offer binary framing at startup, ASCII if the board declines
+                          # (an ASCII-only board costs NEGOTIATE_TIMEOUT at every start)
+METRICS_PORT = 9101       # Prometheus text on http://127.0.0.1:9101/metrics
+METRICS_LOG_INTERVAL = 30 # seconds between [metrics] log lines
 
 # ????
-recv_buffer = ""
-current_speeds = [0, 0, 0, 0]  # ?????? [M1, M2, M3, M4]
+ser = None       # transport to the motor board, opened by init_serial()
+writer = None    # CommandWriter on ser
+emulator = None  # BoardEmulator when running against the simulated board
+frame_parser = FrameParser()
+telemetry = TelemetryStore()  # numeric $MAll/$MTEP/$MSPD history
+decoder = PayloadDecoder()  # JSON (orjson if installed) or packed binary payloads
 mqtt_client = None
-last_command_time = 0
-command_active = False
+engine = None  # MotorEngine, created in control_loop
+
+MQTT_MESSAGES = metrics.counter("mqtt_messages_total", "MQTT controller messages received")
+MQTT_REJECTED = metrics.counter("mqtt_rejected_total", "MQTT payloads rejected by the decoder")
+MQTT_DECODE = metrics.histogram("mqtt_decode_seconds", "MQTT receive -> payload decoded")
+
+# serial link (real board or emulator)
+def init_serial(port=SERIAL_PORT):
+    global ser, writer, emulator
+    if port == "sim":
+        from board_emulator import serve_pty
+        ser, emulator = serve_pty()
+        print(f"Using the simulated motor board on {ser.name}")
+    else:
+        ser = open_transport(port)
+    writer = CommandWriter(ser, KEEPALIVE_INTERVAL)
 
 # ??????
 def send_data(data):
-    ser.write(data.encode())
-    time.sleep(0.01)
+    writer.queue(data)
+    writer.flush()
+
+def queue_data(data):
+    # goes out with the next flush, batched into one write
+    writer.queue(data)
 
 def receive_data():
-    global recv_buffer
+    """Return every complete frame received so far (may be empty)"""
     if ser.in_waiting > 0:
-        recv_buffer += ser.read(ser.in_waiting).decode()
-        messages = recv_buffer.split("#")
-        recv_buffer = messages[-1]
-        if len(messages) > 1:
-            return messages[0] + "#"
-    return None
+        frames = frame_parser.feed(ser.read(ser.in_waiting))
+        return [frame.decode(errors="replace") for frame in frames]
+    return []
 
 # ??????
 def control_speed(m1, m2, m3, m4):
-    send_data("$spd:{},{},{},{}#".format(m1, m2, m3, m4))
+    writer.send_motor("$spd:{},{},{},{}#".format(m1, m2, m3, m4))
 
 def control_pwm(m1, m2, m3, m4):
-    send_data("$pwm:{},{},{},{}#".format(m1, m2, m3, m4))
+    writer.send_motor("$pwm:{},{},{},{}#".format(m1, m2, m3, m4))
 
 def send_upload_command(mode):
     if mode == 0:
-        send_data("$upload:0,0,0#")
+        queue_data("$upload:0,0,0#")
     elif mode == 1:
-        send_data("$upload:1,0,0#")
+        queue_data("$upload:1,0,0#")
     elif mode == 2:
-        send_data("$upload:0,1,0#")
+        queue_data("$upload:0,1,0#")
     elif mode == 3:
-        send_data("$upload:0,0,1#")
+        queue_data("$upload:0,0,1#")
 
 # ??????
 def set_motor_type(data):
-    send_data("$mtype:{}#".format(data))
+    queue_data("$mtype:{}#".format(data))
 
 def set_motor_deadzone(data):
-    send_data("$deadzone:{}#".format(data))
+    queue_data("$deadzone:{}#".format(data))
 
 def set_pluse_line(data):
-    send_data("$mline:{}#".format(data))
+    queue_data("$mline:{}#".format(data))
 
 def set_pluse_phase(data):
-    send_data("$mphase:{}#".format(data))
+    queue_data("$mphase:{}#".format(data))
 
 def set_wheel_dis(data):
-    send_data("$wdiameter:{}#".format(data))
+    queue_data("$wdiameter:{}#".format(data))
 
 def set_motor_parameter():
-    if MOTOR_TYPE == 1:
-        set_motor_type(1)
-        set_pluse_phase(30)
-        set_pluse_line(11)
-        set_wheel_dis(67.00)
-        set_motor_deadzone(1600)
-    elif MOTOR_TYPE == 2:
-        set_motor_type(2)
-        set_pluse_phase(20)
-        set_pluse_line(13)
-        set_wheel_dis(48.00)
-        set_motor_deadzone(1300)
-    elif MOTOR_TYPE == 3:
-        set_motor_type(3)
-        set_pluse_phase(45)
-        set_pluse_line(13)
-        set_wheel_dis(68.00)
-        set_motor_deadzone(1250)
-    elif MOTOR_TYPE == 4:
-        set_motor_type(4)
-        set_pluse_phase(48)
-        set_motor_deadzone(1000)
-    elif MOTOR_TYPE == 5:
-        set_motor_type(1)
-        set_pluse_phase(40)
-        set_pluse_line(11)
-        set_wheel_dis(67.00)
-        set_motor_deadzone(1600)
-    time.sleep(0.5)
+    # per motor type table in motor_engine.MOTOR_PARAMETERS (shared with fleet.py)
+    for frame in parameter_frames(MOTOR_TYPE):
+        queue_data(frame)
+    # one write for the upload mode and all parameters, no settle sleeps
+    writer.flush()
 
 # ??????
 def parse_data(data):
@@ -134,34 +132,35 @@ def on_connect(client, userdata, flags, rc):
         print(f"????,????: {rc}")
 
 def on_message(client, userdata, msg):
-    global current_speeds, last_command_time, command_active
-    
+    received = time.monotonic()
     try:
-        payload = msg.payload.decode('utf-8')
-        data = json.loads(payload)
-        
-        power = int(data.get('power', 0))  # ????
-        move_speed = float(data.get('movespeed', 0))  # ????0
-        move_x = float(data.get('movex', 1.0))  # ????
+        MQTT_MESSAGES.inc()
+        command = decoder.decode(msg.payload)
+        if command is None:
+            MQTT_REJECTED.inc()
+            return  # rejected, counted by the decoder
+        MQTT_DECODE.observe(time.monotonic() - received)
+        power, move_speed, move_x, seq = command
         
-        print(f"?????? - ??: {power}, ??: {move_speed}, ??: {move_x}")
+        if VERBOSE_COMMANDS:
+            print(f"?????? - ??: {power}, ??: {move_speed}, ??: {move_x}")
         
         if power == 1:  # ???power=1????
             # ???? (movespeed*200 ???movex???)
             speed = int(move_speed * 200) * (1 if move_x >= 0 else -1)
+            speeds = [speed, speed, speed, speed]
             
-            # ??????????
-            current_speeds = [speed, speed, speed, speed]
+            # hand the command to the engine, it goes out on the wire immediately
+            if engine and not engine.submit(speeds, seq=seq, received=received):
+                print(f"Discarded out-of-order command seq={seq}")
+                return
             
-            # ?????????
-            last_command_time = time.time()
-            command_active = True
-            
-            print(f"????,??: {current_speeds}")
+            if VERBOSE_COMMANDS:
+                print(f"????,??: {speeds}")
         else:
             # power?1?????
-            current_speeds = [0, 0, 0, 0]
-            command_active = False
+            if engine:
+                engine.submit([0, 0, 0, 0], active=False, seq=seq, received=received)
             print("????")
             
     except Exception as e:
@@ -184,47 +183,58 @@ def init_mqtt():
         return False
 
 # ?????
-def control_loop():
-    global current_speeds, command_active, last_command_time
+def handle_frame(frame):
+    telemetry.add_frame(frame)
+    parsed = parse_data(frame)
+    if parsed:
+        print(parsed)
+
+def setup_engine():
+    """Configure the board and create the engine; engine.run() starts it"""
+    global engine
     
     print("?????...")
     send_upload_command(UPLOAD_DATA)
     set_motor_parameter()
+    binary = BINARY_PROTOCOL and binary_protocol.negotiate(ser)
+    print(f"Serial protocol: {'binary' if binary else 'ASCII'}")
     
+    # event driven: the engine sleeps until a command, a board frame or a timer is due
+    engine = MotorEngine(ser, MOTOR_TYPE, on_receive=handle_frame, writer=writer,
+                         on_telemetry=telemetry.add, binary=binary)
+    return engine
+
+def close_engine():
+    # engine.run() has already sent the stop frame on its way out
+    engine.close()
+    print(f"serial writer: {writer.stats()}")
+    print(f"commands: {engine.mailbox.stats()}")
+    print(f"payloads: {decoder.stats()}")
+    print("???????")
+
+def cleanup():
+    """Disconnect MQTT and release the serial link"""
+    if mqtt_client:
+        mqtt_client.loop_stop()
+        mqtt_client.disconnect()
+    if emulator:
+        emulator.stop()
+    ser.close()
+
+def control_loop():
+    setup_engine()
     try:
-        while True:
-            # ??????
-            received_message = receive_data()
-            if received_message:
-                parsed = parse_data(received_message)
-                if parsed:
-                    print(parsed)
-            
-            # ??????1?????
-            if command_active and (time.time() - last_command_time) >= 1.0:
-                current_speeds = [0, 0, 0, 0]
-                command_active = False
-                print("1????,????")
-            
-            # ??????
-            if MOTOR_TYPE == 4:
-                control_pwm(*[s*2 for s in current_speeds])
-            else:
-                control_speed(*current_speeds)
-            
-            time.sleep(0.1)
-            
+        engine.run()
     except KeyboardInterrupt:
         print("\n????...")
     finally:
-        # ??????
-        if MOTOR_TYPE == 4:
-            control_pwm(0, 0, 0, 0)
-        else:
-            control_speed(0, 0, 0, 0)
-        print("???????")
+        close_engine()
 
 if __name__ == "__main__":
+    init_serial(sys.argv[1] if len(sys.argv) > 1 else SERIAL_PORT)
+    metrics.serve_http(METRICS_PORT)
+    metrics.start_log_reporter(METRICS_LOG_INTERVAL)
+    
     # ??MQTT???
     if not init_mqtt():
         print("MQTT?????,????")
@@ -234,8 +244,5 @@ if __name__ == "__main__":
     control_loop()
     
     # ??
-    if mqtt_client:
-        mqtt_client.loop_stop()
-        mqtt_client.disconnect()
-    ser.close()
+    cleanup()
     print("?????")
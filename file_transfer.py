@@ -0,0 +1,239 @@
+# file_transfer.py
+# Streaming file transfer from the Pi to the PC with constant memory use.
+# The file goes out with socket.sendfile() (os.sendfile, zero-copy) or, where
+# that is unavailable, in fixed-size chunks read into one reused buffer.
+#
+# Protocol 1 (legacy, what the PC app speaks today):
+#   Pi -> PC  [type:1][size:4]  file bytes
+#
+# Protocol 2 (resumable):
+#   Pi -> PC  [magic "PIF2"][version:1][type:1][size:8][crc32:4][name_len:2][name]
+#   PC -> Pi  [offset:8]        bytes the PC already holds (0 = fresh)
+#   Pi -> PC  file bytes [offset, size)
+#   PC -> Pi  [status:1]        0x00 checksum ok, 0x01 mismatch
+# After a dropped connection the Pi reconnects and the PC answers with the
+# length of its partial file, so only the rest is sent.
+#
+#   python file_transfer.py --bench [MB]   # throughput, RSS and a resumed transfer
+
+import os
+import socket
+import struct
+import threading
+import time
+import zlib
+
+CHUNK_SIZE = 256 * 1024   # chunked fallback and checksum read size
+TIMEOUT = 10.0            # s without progress before a connection is given up
+RETRIES = 3               # reconnects after a dropped protocol 2 transfer
+PREVIEW_SUFFIX = "_preview.jpg"   # progressive photo previews, type 0x04
+
+MAGIC = b"PIF2"
+VERSION = 2
+_LEGACY_HEADER = struct.Struct("!BI")
+_HEADER = struct.Struct("!4sBBQIH")
+_OFFSET = struct.Struct("!Q")
+STATUS_OK = 0x00
+STATUS_BAD_CHECKSUM = 0x01
+
+
+class TransferError(Exception):
+    pass
+
+
+def file_type(path):
+    """Type byte of the header: 0x01 jpg, 0x02 mp4, 0x03 wav, 0x04 preview jpg, 0x00 other"""
+    return 0x04 if path.endswith(PREVIEW_SUFFIX) else \
+           0x01 if path.endswith('.jpg') else \
+           0x02 if path.endswith('.mp4') else \
+           0x03 if path.endswith('.wav') else 0x00
+
+
+def file_crc32(path, buffer=None):
+    """CRC-32 of a file, read in CHUNK_SIZE pieces"""
+    buffer = buffer or bytearray(CHUNK_SIZE)
+    view = memoryview(buffer)
+    crc = 0
+    with open(path, 'rb', buffering=0) as f:
+        while True:
+            n = f.readinto(buffer)
+            if not n:
+                return crc
+            crc = zlib.crc32(view[:n], crc)
+
+
+def recv_exact(sock, size):
+    data = bytearray()
+    while len(data) < size:
+        chunk = sock.recv(size - len(data))
+        if not chunk:
+            raise ConnectionError("connection closed")
+        data += chunk
+    return bytes(data)
+
+
+def stream(sock, f, offset, count, use_sendfile=True, buffer=None):
+    """Send count bytes of f from offset; returns the bytes sent"""
+    if use_sendfile and hasattr(os, "sendfile"):
+        return sock.sendfile(f, offset, count)
+    buffer = buffer or bytearray(CHUNK_SIZE)
+    view = memoryview(buffer)
+    f.seek(offset)
+    sent = 0
+    while sent < count:
+        n = f.readinto(view[:min(CHUNK_SIZE, count - sent)])
+        if not n:
+            break
+        sock.sendall(view[:n])
+        sent += n
+    return sent
+
+
+def send_file(path, address, protocol=2, use_sendfile=True, retries=RETRIES, timeout=TIMEOUT):
+    """Send one file to the PC; returns the bytes sent, raises on failure"""
+    size = os.path.getsize(path)
+    if protocol == 1:
+        if size > 0xFFFFFFFF:
+            raise TransferError(f"{path} is {size} bytes, too large for protocol 1")
+        with socket.create_connection(address, timeout) as sock, open(path, 'rb') as f:
+            sock.sendall(_LEGACY_HEADER.pack(file_type(path), size))
+            return stream(sock, f, 0, size, use_sendfile)
+
+    buffer = bytearray(CHUNK_SIZE)
+    crc = file_crc32(path, buffer)
+    name = os.path.basename(path).encode()
+    header = _HEADER.pack(MAGIC, VERSION, file_type(path), size, crc, len(name)) + name
+    total = 0
+    for attempt in range(retries + 1):
+        try:
+            with socket.create_connection(address, timeout) as sock, open(path, 'rb') as f:
+                # the file tail and the small header must not wait for a delayed ACK
+                sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+                sock.sendall(header)
+                offset = _OFFSET.unpack(recv_exact(sock, _OFFSET.size))[0]
+                if offset > size:
+                    raise TransferError(f"PC asked for offset {offset} of a {size} byte file")
+                total += stream(sock, f, offset, size - offset, use_sendfile, buffer)
+                status = recv_exact(sock, 1)[0]
+                if status != STATUS_OK:
+                    raise TransferError(f"PC reported status {status:#04x} for {path}")
+                return total
+        except (ConnectionError, socket.timeout) as e:
+            if attempt == retries:
+                raise
+            print(f"Transfer of {path} interrupted ({e}), resuming")
+            time.sleep(min(0.1 * 2 ** attempt, 2.0))
+
+
+# ===== PC side (reference receiver, used by the benchmark) =====
+def receive_file(conn, directory, drop_after=None):
+    """Receive one protocol 2 file into directory; returns its path
+
+    A partial file is kept as <name>.<crc>.part so a reconnect resumes it.
+    drop_after closes the connection after that many bytes (for testing).
+    """
+    conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)   # offset/status replies
+    magic, version, _, size, crc, name_len = _HEADER.unpack(recv_exact(conn, _HEADER.size))
+    if magic != MAGIC or version != VERSION:
+        raise TransferError("not a protocol 2 transfer")
+    name = os.path.basename(recv_exact(conn, name_len).decode())
+    path = os.path.join(directory, name)
+    part = f"{path}.{crc:08x}.part"
+    offset = os.path.getsize(part) if os.path.exists(part) else 0
+    if offset > size:
+        offset = 0
+    conn.sendall(_OFFSET.pack(offset))
+
+    buffer = bytearray(CHUNK_SIZE)
+    view = memoryview(buffer)
+    with open(part, 'r+b' if offset else 'wb') as f:
+        f.truncate(offset)
+        f.seek(offset)
+        received = offset
+        while received < size:
+            limit = min(CHUNK_SIZE, size - received)
+            if drop_after is not None:
+                limit = min(limit, max(0, drop_after - (received - offset)))
+                if limit == 0:
+                    conn.close()
+                    raise ConnectionError("dropped for testing")
+            n = conn.recv_into(view[:limit])
+            if not n:
+                raise ConnectionError("sender went away")
+            f.write(view[:n])
+            received += n
+    if file_crc32(part, buffer) != crc:
+        os.remove(part)
+        conn.sendall(bytes([STATUS_BAD_CHECKSUM]))
+        raise TransferError(f"checksum mismatch for {name}")
+    os.replace(part, path)
+    conn.sendall(bytes([STATUS_OK]))
+    return path
+
+
+def serve_receiver(directory, host="127.0.0.1", port=0, drop_first_after=None):
+    """Accept transfers on a daemon thread; returns (listening socket, received paths)"""
+    server = socket.create_server((host, port))
+    received = []
+    drop = [drop_first_after]
+
+    def run():
+        while True:
+            try:
+                conn, _ = server.accept()
+            except OSError:
+                return
+            with conn:
+                try:
+                    received.append(receive_file(conn, directory, drop[0]))
+                except (ConnectionError, TransferError):
+                    pass
+                drop[0] = None
+
+    threading.Thread(target=run, daemon=True).start()
+    return server, received
+
+
+def _benchmark(megabytes=256):
+    import resource
+    import tempfile
+
+    def peak_rss_mb():
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+    with tempfile.TemporaryDirectory() as tmp:
+        src = os.path.join(tmp, "video.mp4")
+        with open(src, 'wb') as f:
+            block = os.urandom(1 << 20)
+            for _ in range(megabytes):
+                f.write(block)
+        os.makedirs(os.path.join(tmp, "pc"))
+        size = os.path.getsize(src)
+        print(f"{megabytes} MB file, peak RSS before: {peak_rss_mb():.1f} MB")
+
+        for label, kwargs, drop in (("sendfile", {}, None),
+                                    ("chunked", {"use_sendfile": False}, None),
+                                    ("resumed", {}, size // 3)):
+            server, received = serve_receiver(os.path.join(tmp, "pc"), drop_first_after=drop)
+            start = time.perf_counter()
+            sent = send_file(src, server.getsockname(), **kwargs)
+            elapsed = time.perf_counter() - start
+            while not received:
+                time.sleep(0.01)   # the receiver acks before it records the file
+            server.close()
+            ok = bool(received) and file_crc32(received[-1]) == file_crc32(src)
+            print(f"{label:>8}: {sent / elapsed / 1e6:7.0f} MB/s, {sent / 1e6:.0f} MB sent "
+                  f"for a {size / 1e6:.0f} MB file, verified={ok}, peak RSS {peak_rss_mb():.1f} MB")
+            os.remove(received.pop())
+
+        # the old way for comparison: the whole file in memory
+        with open(src, 'rb') as f:
+            data = f.read()
+        print(f"  f.read(): peak RSS {peak_rss_mb():.1f} MB after reading {len(data) / 1e6:.0f} MB")
+
+
+if __name__ == "__main__":
+    import sys
+    if "--bench" in sys.argv:
+        args = [a for a in sys.argv[1:] if not a.startswith("--")]
+        _benchmark(int(args[0]) if args else 256)
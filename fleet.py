@@ -0,0 +1,195 @@
+# fleet.py
+# Fleet mode: one process drives many cars.
+# Subscribes to unity_car_tracking/+/controller and routes each car's
+# commands to its own serial board. All boards share one MotorEngine thread
+# (one selector, no thread per car); each car keeps its own watchdog
+# (safety stop), command mailbox and telemetry store. Every board gets the
+# upload mode and its motor parameters whenever its port (re)opens; a car
+# whose port fails is reopened without stopping the others.
+#
+#   python fleet.py car1=/dev/ttyUSB0 car2=/dev/ttyUSB1
+#   python fleet.py --bench [cars] [commands/s per car]
+
+import sys
+import threading
+import time
+
+from board_emulator import serve_pty
+from motor_engine import MotorEngine, parameter_frames
+from payload_decoder import PayloadDecoder
+from telemetry import TelemetryStore
+from transport import open_transport
+
+MQTT_BROKER = "21.tcp.vip.cpolar.cn"
+MQTT_PORT = 13234
+FLEET_TOPIC = "unity_car_tracking/+/controller"
+MOTOR_TYPE = 1
+UPLOAD_COMMAND = "$upload:1,0,0#"
+
+
+class Car:
+    def __init__(self, car_id, channel):
+        self.car_id = car_id
+        self.channel = channel
+        self.telemetry = TelemetryStore()
+        self.commands = 0
+
+
+class FleetController:
+    def __init__(self, motor_type=MOTOR_TYPE, verbose=False):
+        self.motor_type = motor_type
+        self.verbose = verbose
+        self.engine = MotorEngine()
+        self.decoder = PayloadDecoder()
+        self.cars = {}
+        self.unknown_car = 0
+        self.mqtt_client = None
+        self._thread = None
+
+    def add_car(self, car_id, port, reopen=None):
+        """Attach a car to its board transport (before or after start)
+
+        reopen() returns a fresh transport after the port failed.
+        """
+        car = Car(car_id, None)
+        car.channel = self.engine.add_channel(
+            port, name=car_id, motor_type=self.motor_type,
+            on_receive=lambda frame: self._on_frame(car, frame),
+            setup=[UPLOAD_COMMAND] + parameter_frames(self.motor_type), reopen=reopen)
+        self.cars[car_id] = car
+        return car
+
+    # ----- lifecycle -----
+    def start(self):
+        self._thread = threading.Thread(target=self.engine.run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self.mqtt_client:
+            self.mqtt_client.loop_stop()
+            self.mqtt_client.disconnect()
+        self.engine.stop()
+        if self._thread:
+            self._thread.join()
+        self.engine.close()
+
+    def connect_mqtt(self, broker=MQTT_BROKER, port=MQTT_PORT):
+        import paho.mqtt.client as mqtt
+
+        self.mqtt_client = mqtt.Client()
+        self.mqtt_client.on_connect = lambda client, userdata, flags, rc: (
+            client.subscribe(FLEET_TOPIC) if rc == 0 else print(f"MQTT connect failed: {rc}"))
+        self.mqtt_client.on_message = lambda client, userdata, msg: self.handle_message(
+            msg.topic, msg.payload)
+        self.mqtt_client.connect(broker, port, 60)
+        self.mqtt_client.loop_start()
+        print(f"Fleet of {len(self.cars)} cars listening on {FLEET_TOPIC}")
+
+    # ----- routing -----
+    def handle_message(self, topic, payload, received=None):
+        """Route one controller message to its car (paho thread)"""
+        received = time.monotonic() if received is None else received
+        parts = topic.split("/")
+        car = self.cars.get(parts[1]) if len(parts) == 3 else None
+        if car is None:
+            self.unknown_car += 1
+            return False
+        command = self.decoder.decode(payload)
+        if command is None:
+            return False
+        car.commands += 1
+        power, move_speed, move_x, seq = command
+        if power == 1:
+            speed = int(move_speed * 200) * (1 if move_x >= 0 else -1)
+            speeds = [speed, speed, speed, speed]
+        else:
+            speeds = [0, 0, 0, 0]
+        if self.verbose:
+            print(f"{car.car_id}: {speeds}")
+        return self.engine.submit(speeds, active=(power == 1), seq=seq,
+                                  received=received, channel=car.channel)
+
+    def _on_frame(self, car, frame):
+        car.telemetry.add_frame(frame)
+
+    def stats(self):
+        return {
+            car_id: {
+                "commands": car.commands,
+                "safety_stops": car.channel.safety_stops,
+                **car.channel.mailbox.stats(),
+                **car.channel.writer.stats(),
+            }
+            for car_id, car in self.cars.items()
+        }
+
+
+def _benchmark(cars=20, command_rate=50.0, duration=5.0):
+    """How many emulated cars one engine thread sustains at command_rate each"""
+    fleet = FleetController()
+    boards = []
+    for i in range(cars):
+        transport, board = serve_pty(telemetry_rate=10.0)
+        boards.append((transport, board))
+        fleet.add_car(f"car{i}", transport)
+
+    cpu = {}
+    def run_engine():
+        start = time.thread_time()
+        fleet.engine.run()
+        cpu["engine"] = time.thread_time() - start
+    fleet._thread = threading.Thread(target=run_engine, daemon=True)
+    fleet._thread.start()
+
+    interval = 1.0 / command_rate
+    start = time.monotonic()
+    tick = 0
+    while time.monotonic() - start < duration:
+        tick += 1
+        for i in range(cars):
+            payload = '{{"power": 1, "movespeed": {:.2f}, "movex": 1}}'.format((tick % 100) / 100)
+            fleet.handle_message(f"unity_car_tracking/car{i}/controller", payload.encode())
+        time.sleep(max(0.0, start + tick * interval - time.monotonic()))
+    elapsed = time.monotonic() - start
+    fleet.stop()
+
+    stats = fleet.stats()
+    sent = sum(s["commands"] for s in stats.values())
+    applied = sum(s["applied"] for s in stats.values())
+    p99 = max(s["latency_p99"] or 0 for s in stats.values())
+    load = cpu["engine"] / elapsed
+    print(f"{cars} cars x {command_rate:.0f} cmd/s: {sent / elapsed:,.0f} cmd/s offered, "
+          f"{applied / elapsed:,.0f} applied, worst p99 {p99 * 1e3:.2f} ms")
+    print(f"engine thread CPU {load:.1%} of one core -> ~{int(cars / load) if load else 0} "
+          f"cars per core at this rate")
+    for transport, board in boards:
+        board.stop()
+        transport.close()
+
+
+if __name__ == "__main__":
+    if "--bench" in sys.argv:
+        args = [a for a in sys.argv[1:] if a != "--bench"]
+        cars = int(args[0]) if args else 20
+        rate = float(args[1]) if len(args) > 1 else 50.0
+        _benchmark(cars, rate)
+        sys.exit(0)
+
+    fleet = FleetController()
+    for spec in sys.argv[1:]:
+        car_id, _, device = spec.partition("=")
+        fleet.add_car(car_id, open_transport(device), reopen=lambda device=device: open_transport(device))
+    if not fleet.cars:
+        print("usage: python fleet.py car_id=/dev/ttyUSBx [...]")
+        sys.exit(1)
+    fleet.start()
+    try:
+        fleet.connect_mqtt()
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        print("\nStopping fleet...")
+    finally:
+        fleet.stop()
+        for car_id, stats in fleet.stats().items():
+            print(f"{car_id}: {stats}")
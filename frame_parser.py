@@ -0,0 +1,117 @@
+# frame_parser.py
+# Incremental "$...#" frame extractor for the motor board's serial stream.
+# Works on one reusable bytearray, returns every complete frame in order,
+# resynchronises on the next '$' after garbage and counts what it drops.
+
+import time
+
+MAX_FRAME_LEN = 128  # longest frame the board sends, anything longer is junk
+
+
+class FrameParser:
+    def __init__(self, max_frame_len=MAX_FRAME_LEN):
+        self.max_frame_len = max_frame_len
+        self.buffer = bytearray()
+        self.frames = 0          # complete frames returned
+        self.dropped_bytes = 0   # bytes discarded while resynchronising
+        self.malformed = 0       # frames cut short by a new '$' or too long
+        self._scan = 0           # buffer offset already searched for '#'
+
+    def feed(self, data):
+        """Append received bytes and return the list of complete frames"""
+        buf = self.buffer
+        buf += data
+        size = len(buf)
+        frames = []
+        pos = 0
+        while pos < size:
+            start = buf.find(b"$", pos)
+            if start < 0:
+                self.dropped_bytes += size - pos
+                pos = size
+                break
+            self.dropped_bytes += start - pos
+
+            end = buf.find(b"#", max(start + 1, self._scan))
+            self._scan = 0
+            restart = buf.find(b"$", start + 1, size if end < 0 else end)
+            if restart >= 0:
+                # a new frame began before this one was terminated
+                self.malformed += 1
+                self.dropped_bytes += restart - start
+                pos = restart
+                continue
+            if end < 0:
+                if size - start > self.max_frame_len:
+                    self.malformed += 1
+                    self.dropped_bytes += size - start
+                    pos = size
+                else:
+                    pos = start
+                    self._scan = size - start  # resume the '#' search here
+                break
+            if end - start + 1 > self.max_frame_len:
+                self.malformed += 1
+                self.dropped_bytes += end - start + 1
+            else:
+                frames.append(bytes(buf[start:end + 1]))
+            pos = end + 1
+
+        del buf[:pos]
+        self.frames += len(frames)
+        return frames
+
+    def reset(self):
+        """Drop any partial frame (e.g. after reopening the port)"""
+        self.dropped_bytes += len(self.buffer)
+        self.buffer.clear()
+        self._scan = 0
+
+    def stats(self):
+        return {
+            "frames": self.frames,
+            "dropped_bytes": self.dropped_bytes,
+            "malformed": self.malformed,
+            "buffered": len(self.buffer),
+        }
+
+
+def _legacy_receive(chunks):
+    """The old receive_data logic, for comparison"""
+    recv_buffer = ""
+    frames = 0
+    for chunk in chunks:
+        recv_buffer += chunk.decode()
+        messages = recv_buffer.split("#")
+        recv_buffer = messages[-1]
+        if len(messages) > 1:
+            frames += 1  # only messages[0] was ever returned
+    return frames
+
+
+def _benchmark(total_frames=200000, chunk_size=64):
+    sample = (b"$MAll:1520,-1533,1498,-1502#"
+              b"$MTEP:12,-11,13,-12#"
+              b"$MSPD:105.5,-104.2,106.0,-105.1#"
+              b"\x00junk")
+    stream = sample * (total_frames // 3)
+    chunks = [stream[i:i + chunk_size] for i in range(0, len(stream), chunk_size)]
+    expected = stream.count(b"#")
+
+    parser = FrameParser()
+    start = time.perf_counter()
+    count = 0
+    for chunk in chunks:
+        count += len(parser.feed(chunk))
+    elapsed = time.perf_counter() - start
+    print(f"FrameParser : {count}/{expected} frames, {count / elapsed:,.0f} frames/s, "
+          f"{parser.dropped_bytes} bytes dropped, {parser.malformed} malformed")
+
+    start = time.perf_counter()
+    count = _legacy_receive(chunks)
+    elapsed = time.perf_counter() - start
+    print(f"legacy split: {count}/{expected} frames, {count / elapsed:,.0f} frames/s")
+
+
+if __name__ == "__main__":
+    _benchmark()
@@ -0,0 +1,83 @@
+# framing.py
+# Record framing for the PC -> Pi command channel (TCP_control).
+# TCP is a byte stream: one recv() can hold several commands or half of
+# one. These incremental decoders cut the stream back into commands.
+#
+#   fixed:  every record is RECORD_SIZE bytes ([cmd][param1][param2])
+#   length: [len:2, big endian][payload:len]
+
+import struct
+
+RECORD_SIZE = 3
+MAX_RECORD = 1024
+_LENGTH = struct.Struct("!H")
+
+
+class FramingError(ValueError):
+    """The peer sent something that cannot be a valid record"""
+
+
+class FixedRecordDecoder:
+    def __init__(self, size=RECORD_SIZE):
+        self.size = size
+        self.buffer = bytearray()
+
+    def feed(self, data):
+        """Append received bytes and return the list of complete records"""
+        buf = self.buffer
+        buf += data
+        end = len(buf) - len(buf) % self.size
+        records = [bytes(buf[i:i + self.size]) for i in range(0, end, self.size)]
+        del buf[:end]
+        return records
+
+
+class LengthPrefixDecoder:
+    def __init__(self, max_record=MAX_RECORD):
+        self.max_record = max_record
+        self.buffer = bytearray()
+
+    def feed(self, data):
+        """Append received bytes and return the list of complete records"""
+        buf = self.buffer
+        buf += data
+        records = []
+        pos = 0
+        while len(buf) - pos >= _LENGTH.size:
+            (length,) = _LENGTH.unpack_from(buf, pos)
+            if length == 0 or length > self.max_record:
+                raise FramingError(f"bad record length {length}")
+            end = pos + _LENGTH.size + length
+            if end > len(buf):
+                break
+            records.append(bytes(buf[pos + _LENGTH.size:end]))
+            pos = end
+        del buf[:pos]
+        return records
+
+
+def encode_length_prefixed(payload):
+    return _LENGTH.pack(len(payload)) + payload
+
+
+def new_decoder(framing):
+    """Decoder for a framing name; None means one recv() is one command"""
+    if framing == "raw":
+        return None
+    if framing == "fixed":
+        return FixedRecordDecoder()
+    if framing == "length":
+        return LengthPrefixDecoder()
+    raise ValueError(f"unknown framing {framing!r}")
+
+
+def encode_response(framing, payload):
+    """One record as it goes on the wire; length framing prefixes it"""
+    if framing == "length":
+        return encode_length_prefixed(payload)
+    return payload
+
+
+def encode_batch(framing, payloads):
+    """Join records for one send; length framing prefixes each of them"""
+    return b"".join(encode_response(framing, p) for p in payloads)
@@ -0,0 +1,133 @@
+# ingest_queue.py
+# Bounded queue between the TCP command handlers and whatever stores or
+# forwards the received commands. A consumer thread drains it in batches;
+# when it is full the overflow policy decides what gives:
+#
+#   drop_oldest  keep the newest maxsize items (default)
+#   drop_newest  refuse the new item
+#   block        make the sender wait (TCP backpressure); dropped after
+#                block_timeout seconds if one is set (required without a
+#                consumer, nothing else would make room)
+#
+#   q = IngestQueue(1024, "drop_oldest", consumer=log_consumer)
+#   q.start(); q.put(b"\x01\x01\x01"); q.stop()
+
+import threading
+from collections import deque
+
+import metrics
+
+POLICIES = ("drop_oldest", "drop_newest", "block")
+BATCH_SIZE = 64   # items handed to the consumer per call
+
+
+def log_consumer(items):
+    """Print every drained item"""
+    for item in items:
+        print(f"Ingested: {item.hex() if isinstance(item, bytes) else item}")
+
+
+class IngestQueue:
+    def __init__(self, maxsize=1024, policy="drop_oldest", consumer=None,
+                 name="ingest", block_timeout=None):
+        if policy not in POLICIES:
+            raise ValueError(f"unknown overflow policy {policy!r}")
+        if maxsize < 1:
+            raise ValueError("maxsize must be at least 1")
+        if policy == "block" and consumer is None and block_timeout is None:
+            # nothing would ever make room: the first put() on a full queue hangs forever
+            raise ValueError("policy 'block' needs a consumer or a block_timeout")
+        self.maxsize = maxsize
+        self.policy = policy
+        self.consumer = consumer            # callable(list of items)
+        self.block_timeout = block_timeout
+        self.items = deque()
+        self.closed = False                 # set by stop(), wakes blocked callers
+        self._cond = threading.Condition()
+        self._thread = None
+
+        labels = {"queue": name}
+        self.depth = metrics.gauge("ingest_queue_depth", "Items waiting in the ingest queue", labels)
+        self.depth.fn = lambda: len(self.items)   # a re-created queue takes over its name
+        self.accepted = metrics.counter("ingest_queue_accepted_total", "Items put into the queue", labels)
+        self.dropped = metrics.counter("ingest_queue_dropped_total", "Items lost to the overflow policy",
+                                       dict(labels, policy=policy))
+        self.consumed = metrics.counter("ingest_queue_consumed_total", "Items handed to the consumer", labels)
+        self.errors = metrics.counter("ingest_queue_consumer_errors_total", "Consumer calls that raised", labels)
+
+    def __len__(self):
+        return len(self.items)
+
+    # ----- producer side -----
+    def put(self, item):
+        """Add an item; False if the overflow policy dropped it"""
+        with self._cond:
+            if len(self.items) >= self.maxsize:
+                if self.policy == "drop_newest":
+                    self.dropped.inc()
+                    return False
+                if self.policy == "drop_oldest":
+                    self.items.popleft()
+                    self.dropped.inc()
+                elif not self._cond.wait_for(lambda: len(self.items) < self.maxsize or self.closed,
+                                             self.block_timeout) or self.closed:
+                    self.dropped.inc()
+                    return False
+            self.items.append(item)
+            self.accepted.inc()
+            self._cond.notify_all()
+        return True
+
+    # ----- consumer side -----
+    def get_batch(self, max_items=BATCH_SIZE, timeout=None):
+        """Take up to max_items, waiting up to timeout for the first one"""
+        with self._cond:
+            if not self._cond.wait_for(lambda: self.items or self.closed, timeout):
+                return []
+            n = min(max_items, len(self.items))
+            batch = [self.items.popleft() for _ in range(n)]
+            self._cond.notify_all()
+        return batch
+
+    def get(self, timeout=None):
+        """Take one item, None if nothing arrived within timeout"""
+        batch = self.get_batch(1, timeout)
+        return batch[0] if batch else None
+
+    def start(self):
+        """Run the consumer on a daemon thread (no-op without a consumer)"""
+        self.closed = False
+        if self.consumer and not self._thread:
+            self._thread = threading.Thread(target=self._drain, daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self, drain=True):
+        """Stop the consumer; by default it first gets what is still queued"""
+        with self._cond:
+            self.closed = True
+            self._cond.notify_all()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+        while drain and self.consumer and self.items:
+            self._consume(self.get_batch())
+
+    def _drain(self):
+        while not self.closed:
+            batch = self.get_batch()
+            if batch:
+                self._consume(batch)
+
+    def _consume(self, batch):
+        try:
+            self.consumer(batch)
+        except Exception as e:
+            self.errors.inc()
+            print(f"Ingest consumer failed: {str(e)}")
+        self.consumed.inc(len(batch))
+
+    def stats(self):
+        return {"depth": len(self.items), "accepted": self.accepted.value,
+                "dropped": self.dropped.value, "consumed": self.consumed.value,
+                "consumer_errors": self.errors.value}
@@ -0,0 +1,227 @@
+# job_engine.py
+# Background jobs for the long-running media commands (video, audio
+# recording). submit() returns a Job with a 16-bit ID straight away. A job
+# names the devices it needs ("camera", "audio") and starts on its own
+# thread as soon as all of them are free, oldest first, so two recordings
+# never fight over the camera while jobs on other devices still run
+# alongside. The devices bound those jobs; only jobs that need no device
+# (media fetch) share a limit of `workers`, so they can never hold up a
+# camera job behind a full pool. Jobs can be polled by ID,
+# cancelled (queued jobs never start; running jobs get their cancel hooks
+# called, e.g. terminating arecord) and report completion through on_done.
+#
+#   engine = JobEngine(workers=2, on_done=print).start()
+#   job = engine.submit("audio", record, ("audio",), 30)
+#   engine.get(job.id).state; engine.cancel(job.id); engine.stop()
+
+import itertools
+import threading
+import time
+from collections import OrderedDict
+
+import metrics
+
+QUEUED, RUNNING, DONE, FAILED, CANCELLED = range(5)
+STATE_NAMES = {QUEUED: "queued", RUNNING: "running", DONE: "done",
+               FAILED: "failed", CANCELLED: "cancelled"}
+WORKERS = 2          # jobs without a device (e.g. media fetch) running at once
+KEEP_FINISHED = 64   # finished jobs kept for status queries
+
+JOBS_WAITING = metrics.gauge("jobs_waiting", "Jobs queued for a worker or a device")
+JOBS_RUNNING = metrics.gauge("jobs_running", "Jobs running on a worker")
+
+
+class Job:
+    def __init__(self, job_id, kind, func, resources, args):
+        self.id = job_id
+        self.kind = kind
+        self.func = func
+        self.resources = tuple(resources)
+        self.args = args
+        self.state = QUEUED
+        self.result = None
+        self.error = None
+        self.submitted = time.perf_counter()
+        self.finished = None
+        self.cancelled = threading.Event()   # polled / waited on by the job function
+        self._cancel_hooks = []
+        self._done = threading.Event()
+
+    @property
+    def state_name(self):
+        return STATE_NAMES[self.state]
+
+    def on_cancel(self, hook):
+        """Call hook() if the job is cancelled while running (e.g. proc.terminate)"""
+        self._cancel_hooks.append(hook)
+        if self.cancelled.is_set():
+            hook()
+
+    def wait(self, timeout=None):
+        """Block until the job has finished; True if it did"""
+        return self._done.wait(timeout)
+
+    def __repr__(self):
+        return f"<Job {self.id} {self.kind} {self.state_name}>"
+
+
+class JobEngine:
+    def __init__(self, workers=WORKERS, on_done=None):
+        self.workers = workers
+        self.on_done = on_done          # callable(job), called on its own thread
+        self.jobs = OrderedDict()       # id -> Job, queued/running first then finished
+        self.queue = []                 # queued jobs in submit order
+        self.busy = set()               # resources held by running jobs
+        self.free_running = 0           # running jobs that need no device
+        self.running = False
+        self._ids = itertools.cycle(range(1, 0x10000))   # 0 means "no job" on the wire
+        self._cond = threading.Condition()
+        self._threads = set()           # one per running job
+        JOBS_WAITING.fn = lambda: len(self.queue)
+        JOBS_RUNNING.fn = lambda: sum(job.state == RUNNING for job in list(self.jobs.values()))
+
+    def start(self):
+        self.running = True
+        return self
+
+    def stop(self, cancel=True):
+        """Stop the workers; running jobs are cancelled unless cancel=False"""
+        with self._cond:
+            self.running = False
+            for job in list(self.queue):
+                self._cancel_locked(job)
+            running = [job for job in self.jobs.values() if job.state == RUNNING]
+            if cancel:
+                for job in running:
+                    job.cancelled.set()
+            threads = list(self._threads)
+            self._cond.notify_all()
+        if cancel:
+            for job in running:
+                self._fire_cancel(job)
+        for thread in threads:
+            thread.join()
+
+    # ----- API -----
+    def submit(self, kind, func, resources=(), *args):
+        """Queue func(job, *args); returns the Job at once"""
+        with self._cond:
+            if not self.running:
+                raise RuntimeError("job engine is not running")
+            job_id = next(self._ids)
+            while job_id in self.jobs and self.jobs[job_id].state in (QUEUED, RUNNING):
+                job_id = next(self._ids)
+            self.jobs.pop(job_id, None)
+            job = Job(job_id, kind, func, resources, args)
+            self.jobs[job_id] = job
+            self.queue.append(job)
+            self._dispatch_locked()   # a job whose devices are free is RUNNING on return
+        metrics.counter("jobs_submitted_total", "Jobs submitted", {"kind": kind}).inc()
+        return job
+
+    def get(self, job_id):
+        return self.jobs.get(job_id)
+
+    def cancel(self, job_id):
+        """Cancel a queued or running job; False if unknown or already finished"""
+        with self._cond:
+            job = self.jobs.get(job_id)
+            if job is None or job.state not in (QUEUED, RUNNING):
+                return False
+            if job.state == QUEUED:
+                self._cancel_locked(job)
+                return True
+            job.cancelled.set()
+        self._fire_cancel(job)
+        return True
+
+    def busy_with(self, resource, kinds=None):
+        """True while a running job (of one of kinds, if given) holds resource"""
+        if kinds is None:
+            return resource in self.busy
+        with self._cond:
+            return any(job.state == RUNNING and job.kind in kinds and resource in job.resources
+                       for job in self.jobs.values())
+
+    # ----- workers -----
+    def _cancel_locked(self, job):
+        self.queue.remove(job)
+        job.cancelled.set()
+        self._finish_locked(job, CANCELLED)
+
+    def _fire_cancel(self, job):
+        for hook in list(job._cancel_hooks):
+            try:
+                hook()
+            except Exception as e:
+                print(f"Cancel hook of job {job.id} failed: {e}")
+
+    def _finish_locked(self, job, state):
+        job.state = state
+        job.finished = time.perf_counter()
+        job._done.set()
+        # finished jobs move to the end; only the newest KEEP_FINISHED stay
+        self.jobs.move_to_end(job.id)
+        finished = [j for j in self.jobs.values() if j.state not in (QUEUED, RUNNING)]
+        for old in finished[:max(0, len(finished) - KEEP_FINISHED)]:
+            del self.jobs[old.id]
+        metrics.counter("jobs_finished_total", "Jobs by final state",
+                        {"kind": job.kind, "state": STATE_NAMES[state]}).inc()
+        if self.on_done:
+            threading.Thread(target=self._notify, args=(job,), daemon=True).start()
+
+    def _notify(self, job):
+        try:
+            self.on_done(job)
+        except Exception as e:
+            print(f"Completion callback for job {job.id} failed: {e}")
+
+    def _next_job(self):
+        """Oldest queued job whose resources are all free (and a slot, without any)"""
+        for job in self.queue:
+            if job.resources:
+                if not self.busy.intersection(job.resources):
+                    return job
+            elif self.free_running < self.workers:
+                return job
+        return None
+
+    def _dispatch_locked(self):
+        while self.running:
+            job = self._next_job()
+            if job is None:
+                return
+            self.queue.remove(job)
+            self.busy.update(job.resources)
+            if not job.resources:
+                self.free_running += 1
+            job.state = RUNNING
+            thread = threading.Thread(target=self._run, args=(job,), name=f"job-{job.id}", daemon=True)
+            self._threads.add(thread)
+            thread.start()
+
+    def _run(self, job):
+        metrics.histogram("job_wait_seconds", "Submit -> start of a job",
+                          {"kind": job.kind}).since(job.submitted)
+        start = time.perf_counter()
+        state = DONE
+        try:
+            job.result = job.func(job, *job.args)
+            if job.cancelled.is_set():
+                state = CANCELLED
+            elif job.result is False:   # controller methods report failure as False
+                state = FAILED
+        except Exception as e:
+            job.error = e
+            state = CANCELLED if job.cancelled.is_set() else FAILED
+            if state == FAILED:
+                print(f"Job {job.id} ({job.kind}) failed: {e}")
+        metrics.histogram("job_run_seconds", "Start -> end of a job",
+                          {"kind": job.kind}).since(start)
+        with self._cond:
+            self.busy.difference_update(job.resources)
+            if not job.resources:
+                self.free_running -= 1
+            self._threads.discard(threading.current_thread())
+            self._finish_locked(job, state)
+            self._dispatch_locked()
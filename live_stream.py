@@ -0,0 +1,372 @@
+# live_stream.py
+# Live video to the PC instead of record-then-send. The Picamera2 encoder
+# (H.264 or MJPEG) hands every encoded frame to a LiveStream output, which
+# queues it for a sender thread that writes it straight onto a TCP
+# connection to the PC. The queue is bounded in bytes and in age: when the
+# link falls behind, the backlog is dropped and non-key frames are skipped
+# until the next keyframe, so the PC's decoder never sees a broken
+# reference chain and the delay does not build up. The kernel send buffer is kept
+# small so the backlog stays in that queue, where the policy can see it.
+# A RecordingTap output next to it writes every frame to a local file on
+# its own thread, independent of the link.
+#
+#   connection: HELLO [codec:4][width:2][height:2][fps:1]
+#               then per frame [flags:1][number:4][timestamp us:8][length:4][data]
+#
+#   stream = LiveStream((PC_IP, STREAM_PORT), "h264", (1920, 1080))
+#   start_camera(picam2, stream, RecordingTap("/home/Documents/video/live.h264"))
+#   ...; picam2.stop_recording()
+#
+#   python live_stream.py --bench       # glass-to-glass latency, synthetic frame counter source
+
+import socket
+import struct
+import threading
+import time
+from collections import deque
+
+import metrics
+from ingest_queue import IngestQueue
+
+try:
+    from picamera2.outputs import Output
+except ImportError:        # synthetic source and benchmark run without Picamera2
+    Output = object
+
+FPS = 30
+BITRATE = 4_000_000        # bit/s for the encoder
+KEY_INTERVAL = 15          # H.264 frames between keyframes: how long a drop takes to recover
+MAX_QUEUED = 128 * 1024    # bytes of encoded frames waiting for the link
+MAX_LAG = 0.25             # s the oldest queued frame may wait before the backlog is dropped
+SEND_BUFFER = 32 * 1024    # kernel send buffer
+TAP_QUEUE = 256            # frames the recording tap may fall behind the encoder
+TIMEOUT = 5.0
+MAX_BACKOFF = 5.0          # s between reconnect attempts, at most
+
+CODECS = {"h264": b"H264", "mjpeg": b"MJPG"}
+KEYFRAME = 0x01
+HELLO = struct.Struct("!4sHHB")
+FRAME = struct.Struct("!BIQI")
+_MSG_MORE = getattr(socket, "MSG_MORE", 0)
+
+SENT = metrics.counter("live_frames_sent_total", "Encoded frames written to the PC connection")
+SENT_BYTES = metrics.counter("live_bytes_sent_total", "Encoded bytes written to the PC connection")
+CONNECTS = metrics.counter("live_connects_total", "Live stream connections established")
+QUEUE_BYTES = metrics.gauge("live_queue_bytes", "Encoded bytes waiting for the link")
+QUEUE_WAIT = metrics.histogram("live_queue_wait_seconds", "Frame encoded -> handed to the socket")
+TAP_FRAMES = metrics.counter("live_tap_frames_total", "Frames written by the recording tap")
+
+
+def _dropped(reason):
+    return metrics.counter("live_frames_dropped_total", "Encoded frames not sent to the PC",
+                           {"reason": reason})
+
+
+class LiveStream(Output):
+    """Encoder output sending each frame to the PC as soon as it is produced"""
+
+    def __init__(self, address, codec="h264", size=(1920, 1080), fps=FPS,
+                 max_bytes=MAX_QUEUED, max_lag=MAX_LAG, timeout=TIMEOUT):
+        if codec not in CODECS:
+            raise ValueError(f"unknown codec {codec!r}")
+        super().__init__()
+        self.address = address
+        self.codec = codec
+        self.size = size
+        self.fps = fps
+        self.max_bytes = max_bytes
+        self.max_lag = max_lag
+        self.timeout = timeout
+        self.frames = deque()          # (flags, number, timestamp us, data, queued at), oldest first
+        self.queued_bytes = 0
+        self.need_key = True           # the PC's decoder can only start at a keyframe
+        self.count = 0
+        self.sock = None
+        self.running = False
+        self._cond = threading.Condition()
+        self._thread = None
+        QUEUE_BYTES.fn = lambda: self.queued_bytes
+
+    # Picamera2 calls start() / stop() when the encoder starts and stops
+    def start(self):
+        if self.running:
+            return self
+        self.running = True
+        self.recording = True
+        self._thread = threading.Thread(target=self._run, name="live-stream", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        with self._cond:
+            self.running = False
+            self.recording = False
+            self._flush_locked("stopped")
+            self._cond.notify_all()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+
+    # ----- encoder side -----
+    def outputframe(self, frame, keyframe=True, timestamp=None, packet=None, audio=False):
+        if audio:
+            return
+        number = self.count
+        self.count += 1
+        data = bytes(frame)
+        now = time.perf_counter()
+        with self._cond:
+            if self.frames and (self.queued_bytes + len(data) > self.max_bytes
+                                or now - self.frames[0][4] > self.max_lag):
+                # behind: drop the backlog, the PC decodes on from the next keyframe
+                self._flush_locked("behind")
+                self.need_key = True
+            if keyframe:
+                self.need_key = False
+            elif self.need_key:
+                _dropped("awaiting_key").inc()
+                return
+            self.frames.append((KEYFRAME if keyframe else 0, number, timestamp or 0, data, now))
+            self.queued_bytes += len(data)
+            self._cond.notify_all()
+
+    def _flush_locked(self, reason):
+        if self.frames:
+            _dropped(reason).inc(len(self.frames))
+        self.frames.clear()
+        self.queued_bytes = 0
+
+    def _skip_to_key_locked(self):
+        """A new connection starts at the first queued keyframe"""
+        while self.frames and not self.frames[0][0] & KEYFRAME:
+            self.queued_bytes -= len(self.frames.popleft()[3])
+            _dropped("reconnect").inc()
+        if not self.frames:
+            self.need_key = True
+
+    # ----- sender side -----
+    def _run(self):
+        backoff = 0.1
+        while self.running:
+            if self.sock is None:
+                try:
+                    self._connect()
+                    backoff = 0.1
+                except OSError as e:
+                    print(f"Live stream to {self.address[0]}:{self.address[1]} failed: {e}")
+                    with self._cond:
+                        self._cond.wait(backoff)
+                    backoff = min(backoff * 2, MAX_BACKOFF)
+                    continue
+            with self._cond:
+                self._cond.wait_for(lambda: self.frames or not self.running)
+                if not self.running:
+                    break
+                flags, number, timestamp, data, queued = self.frames.popleft()
+                self.queued_bytes -= len(data)
+            QUEUE_WAIT.since(queued)
+            try:
+                self.sock.sendall(FRAME.pack(flags, number, timestamp, len(data)), _MSG_MORE)
+                self.sock.sendall(data)
+            except OSError as e:
+                print(f"Live stream connection lost: {e}")
+                self.sock.close()
+                self.sock = None
+                with self._cond:
+                    self._skip_to_key_locked()
+                continue
+            SENT.inc()
+            SENT_BYTES.inc(len(data))
+        if self.sock:
+            self.sock.close()
+            self.sock = None
+
+    def _connect(self):
+        sock = socket.create_connection(self.address, self.timeout)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, SEND_BUFFER)
+        sock.sendall(HELLO.pack(CODECS[self.codec], self.size[0], self.size[1], int(self.fps)))
+        with self._cond:
+            self._skip_to_key_locked()
+        self.sock = sock
+        CONNECTS.inc()
+
+
+class RecordingTap(Output):
+    """Encoder output writing every frame to path, from the first keyframe on"""
+
+    def __init__(self, path):
+        super().__init__()
+        self.path = path
+        self.file = None
+        self.started = False       # first keyframe seen
+        # file writes (SD card stalls) happen on the queue's thread, not the encoder's
+        self.queue = IngestQueue(TAP_QUEUE, "block", consumer=self._write, name="live_tap")
+
+    def start(self):
+        self.file = open(self.path, 'wb')
+        self.started = False
+        self.queue.start()
+        self.recording = True
+        return self
+
+    def stop(self):
+        self.recording = False
+        self.queue.stop()
+        if self.file:
+            self.file.close()
+            self.file = None
+
+    def outputframe(self, frame, keyframe=True, timestamp=None, packet=None, audio=False):
+        if audio or self.file is None or not (keyframe or self.started):
+            return
+        self.started = True
+        self.queue.put(bytes(frame))
+
+    def _write(self, frames):
+        for data in frames:
+            self.file.write(data)
+        TAP_FRAMES.inc(len(frames))
+
+
+def start_camera(camera, stream, tap=None, bitrate=BITRATE):
+    """Configure camera for stream and start encoding into it (and tap)"""
+    from picamera2.encoders import H264Encoder, MJPEGEncoder
+    config = camera.create_video_configuration(main={"size": stream.size},
+                                               controls={"FrameRate": stream.fps})
+    camera.configure(config)
+    if stream.codec == "h264":
+        # repeat: SPS/PPS with every keyframe, so a (re)connected PC can start there
+        encoder = H264Encoder(bitrate, repeat=True, iperiod=KEY_INTERVAL)
+    else:
+        encoder = MJPEGEncoder(bitrate)
+    camera.start_recording(encoder, [stream, tap] if tap else stream)
+    return encoder
+
+
+# ----- synthetic source and PC side, for the benchmark -----
+_COUNTER = struct.Struct("!IQ")   # frame counter + exposure time, "drawn" into every frame
+
+
+class SyntheticSource:
+    """Encoder stand-in: frame n, due at n / fps, carries n and its exposure
+    time in its content (the frame-counter overlay); keyframes are larger"""
+
+    def __init__(self, outputs, fps=FPS, key_interval=KEY_INTERVAL, key_bytes=60000, delta_bytes=12000):
+        self.outputs = outputs
+        self.fps = fps
+        self.key_interval = key_interval
+        self.key_bytes = key_bytes
+        self.delta_bytes = delta_bytes
+
+    def run(self, seconds):
+        start = time.monotonic_ns()
+        for n in range(int(seconds * self.fps)):
+            due = start + n * 10**9 // self.fps
+            time.sleep(max(0, due - time.monotonic_ns()) / 1e9)
+            keyframe = n % self.key_interval == 0
+            frame = _COUNTER.pack(n, due).ljust(self.key_bytes if keyframe else self.delta_bytes, b"\x5a")
+            for output in self.outputs:
+                output.outputframe(frame, keyframe, due // 1000)
+
+
+class StreamReceiver:
+    """PC side: reads the live stream, measures glass-to-glass latency from
+    the frame counter and checks every delta frame follows its reference"""
+
+    def __init__(self, host="127.0.0.1", port=0, rate=None):
+        self.server = socket.socket()
+        if rate:
+            # small receive window: the sender sees the emulated link speed
+            self.server.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 64 * 1024)
+        self.server.bind((host, port))
+        self.server.listen()
+        self.address = self.server.getsockname()
+        self.rate = rate             # bytes/s read from the connection (slow link emulation)
+        self.latencies = []          # s from exposure to the whole frame received
+        self.frames = 0
+        self.broken = 0              # delta frames whose reference never arrived
+        threading.Thread(target=self._accept, daemon=True).start()
+
+    def close(self):
+        self.server.close()
+
+    def _accept(self):
+        while True:
+            try:
+                conn, _ = self.server.accept()
+            except OSError:
+                return
+            threading.Thread(target=self._serve, args=(conn,), daemon=True).start()
+
+    def _recv(self, conn, n):
+        buf = bytearray()
+        while len(buf) < n:
+            chunk = conn.recv(min(n - len(buf), self.rate or n))
+            if not chunk:
+                raise ConnectionError("live stream closed")
+            buf += chunk
+            if self.rate:
+                time.sleep(len(chunk) / self.rate)
+        return bytes(buf)
+
+    def _serve(self, conn):
+        with conn:
+            try:
+                self._recv(conn, HELLO.size)
+                last = None            # counter of the last decodable frame
+                while True:
+                    flags, _, _, length = FRAME.unpack(self._recv(conn, FRAME.size))
+                    counter, exposed = _COUNTER.unpack_from(self._recv(conn, length))
+                    self.latencies.append((time.monotonic_ns() - exposed) / 1e9)
+                    self.frames += 1
+                    if flags & KEYFRAME or last == counter - 1:
+                        last = counter
+                    else:
+                        self.broken += 1
+                        last = None
+            except (OSError, ConnectionError):
+                pass
+
+
+def _benchmark(seconds=6.0):
+    import os
+    import tempfile
+
+    def quantile(values, q):
+        values = sorted(values)
+        return values[min(len(values) - 1, int(q * len(values)))] if values else float("nan")
+
+    source = SyntheticSource([])
+    per_gop = source.key_bytes + (source.key_interval - 1) * source.delta_bytes
+    stream_rate = per_gop * source.fps / source.key_interval
+    print(f"{seconds:.0f} s at {source.fps} fps, keyframe every {source.key_interval} frames, "
+          f"stream {stream_rate / 1e3:.0f} KB/s; record-then-send shows the first frame after "
+          f">= {seconds * 1e3:.0f} ms")
+    runs = [("fast link", 2 << 20, MAX_QUEUED, MAX_LAG),
+            ("slow link, unbounded buffer", int(stream_rate * 0.7), 1 << 40, float("inf")),
+            ("slow link, drop to keyframe", int(stream_rate * 0.7), MAX_QUEUED, MAX_LAG)]
+    with tempfile.TemporaryDirectory() as tmp:
+        for label, rate, max_bytes, max_lag in runs:
+            receiver = StreamReceiver(rate=rate)
+            stream = LiveStream(receiver.address, max_bytes=max_bytes, max_lag=max_lag).start()
+            tap = RecordingTap(os.path.join(tmp, "live.h264")).start()
+            source.outputs = [stream, tap]
+            dropped = {r: _dropped(r).value for r in ("behind", "awaiting_key")}
+            source.run(seconds)
+            time.sleep(0.2)
+            stream.stop()
+            tap.stop()
+            receiver.close()
+            dropped = sum(_dropped(r).value - v for r, v in dropped.items())
+            lat = receiver.latencies
+            print(f"  {label:28s} link {rate / 1e3:5.0f} KB/s: glass-to-glass p50 {quantile(lat, 0.5) * 1e3:6.1f} ms"
+                  f"  p95 {quantile(lat, 0.95) * 1e3:6.1f} ms  max {max(lat) * 1e3:6.1f} ms | "
+                  f"received {receiver.frames}, dropped {dropped:.0f}, undecodable {receiver.broken}, "
+                  f"tap {os.path.getsize(tap.path) // 1000} KB")
+
+
+if __name__ == "__main__":
+    import sys
+    if "--bench" in sys.argv:
+        _benchmark()
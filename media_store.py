@@ -0,0 +1,237 @@
+# media_store.py
+# Every capture kept on the Pi, indexed in SQLite instead of overwriting
+# latest.* or scattering timestamped files into the working directory.
+# Files live in <root>/<kind>/; the index (<root>/media.db) holds one row per
+# file keyed by capture time, kind and the command (job) ID that made it, so
+# listing a time range or fetching by ID never scans a directory.
+#
+# Writers get a .part path, the file is renamed into place and indexed only
+# when complete, so a reader (or the PC) never sees half a file. After
+# every commit the retention policy evicts the oldest rows until the quota,
+# item limit and maximum age hold again; rows are in capture order, so the
+# victim is always the first row of the primary key (O(1) per eviction).
+#
+#   store = MediaStore("/home/Documents")
+#   with store.capture("photo", "jpg", command_id=12) as item:
+#       camera.capture_file(item.tmp)
+#   store.list("photo", since_ns, until_ns); store.get(item.id)
+
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+import metrics
+
+QUOTA_BYTES = 8 << 30          # total size of all stored captures
+MAX_ITEMS = 20000              # captures kept at most
+MAX_AGE = 30 * 24 * 3600       # s a capture is kept at most (None: forever)
+KINDS = {"photo": 1, "video": 2, "audio": 3}   # kind -> type byte on the wire
+
+STORED = metrics.counter("media_store_added_total", "Captures indexed by the media store")
+EVICTED = metrics.counter("media_store_evicted_total", "Captures removed by the retention policy")
+DISCARDED = metrics.counter("media_store_discarded_total", "Captures abandoned before commit")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS media (
+    id         INTEGER PRIMARY KEY AUTOINCREMENT,
+    ts_ns      INTEGER NOT NULL,
+    kind       TEXT    NOT NULL,
+    command_id INTEGER NOT NULL,
+    path       TEXT    NOT NULL,
+    size       INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS media_ts ON media (ts_ns);
+CREATE INDEX IF NOT EXISTS media_kind_ts ON media (kind, ts_ns);
+"""
+
+
+class MediaItem:
+    def __init__(self, kind, path, command_id=0, ts_ns=None, id=None, size=0):
+        self.id = id
+        self.kind = kind
+        self.path = path
+        self.command_id = command_id
+        self.ts_ns = ts_ns or time.time_ns()
+        self.size = size
+
+    @property
+    def tmp(self):
+        """Where the writer puts the file; keeps the extension for ffmpeg & co."""
+        base, ext = os.path.splitext(self.path)
+        return f"{base}.part{ext}"
+
+    def __repr__(self):
+        return f"<MediaItem {self.id} {self.kind} {os.path.basename(self.path)} {self.size} B>"
+
+
+class MediaStore:
+    def __init__(self, root, quota_bytes=QUOTA_BYTES, max_items=MAX_ITEMS, max_age=MAX_AGE):
+        self.root = root
+        self.quota_bytes = quota_bytes
+        self.max_items = max_items
+        self.max_age = max_age
+        self._lock = threading.Lock()
+        self._seq = 0
+        for kind in KINDS:
+            os.makedirs(os.path.join(root, kind), exist_ok=True)
+        self.db = sqlite3.connect(os.path.join(root, "media.db"), check_same_thread=False,
+                                  isolation_level=None)   # autocommit, one row per statement
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.executescript(_SCHEMA)
+        # running totals: the quota check never needs a full-table SUM
+        self.count, self.total_bytes = self.db.execute(
+            "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM media").fetchone()
+        metrics.gauge("media_store_bytes", "Bytes held by the media store").fn = lambda: self.total_bytes
+        metrics.gauge("media_store_items", "Captures held by the media store").fn = lambda: self.count
+
+    def close(self):
+        with self._lock:
+            self.db.close()
+
+    # ----- writing -----
+    def reserve(self, kind, ext, command_id=0):
+        """A new item for kind; write to item.tmp, then commit() or discard()"""
+        if kind not in KINDS:
+            raise ValueError(f"unknown media kind {kind!r}")
+        with self._lock:
+            self._seq = (self._seq + 1) % 1000
+            seq = self._seq
+        ts_ns = time.time_ns()
+        stamp = time.strftime('%Y%m%d_%H%M%S', time.localtime(ts_ns / 1e9))
+        name = f"{kind}_{stamp}_{ts_ns // 1000000 % 1000:03d}{seq:03d}_c{command_id}.{ext}"
+        return MediaItem(kind, os.path.join(self.root, kind, name), command_id, ts_ns)
+
+    def commit(self, item):
+        """Move item.tmp into place and index it; returns the item"""
+        os.replace(item.tmp, item.path)
+        return self.add(item)
+
+    def discard(self, item):
+        try:
+            os.remove(item.tmp)
+        except FileNotFoundError:
+            pass
+        DISCARDED.inc()
+
+    def add(self, item):
+        """Index a file that is already complete at item.path"""
+        item.size = os.path.getsize(item.path)
+        with self._lock:
+            item.id = self.db.execute(
+                "INSERT INTO media (ts_ns, kind, command_id, path, size) VALUES (?, ?, ?, ?, ?)",
+                (item.ts_ns, item.kind, item.command_id, item.path, item.size)).lastrowid
+            self.count += 1
+            self.total_bytes += item.size
+            self._enforce_locked(keep=item.id)
+        STORED.inc()
+        return item
+
+    @contextmanager
+    def capture(self, kind, ext, command_id=0):
+        """Reserve, yield the item for writing to item.tmp, commit on success"""
+        item = self.reserve(kind, ext, command_id)
+        try:
+            yield item
+        except BaseException:
+            self.discard(item)
+            raise
+        self.commit(item)
+
+    # ----- retention -----
+    def _over_limit_locked(self):
+        if self.total_bytes > self.quota_bytes or self.count > self.max_items:
+            return True
+        if self.max_age is None:
+            return False
+        oldest = self.db.execute("SELECT ts_ns FROM media ORDER BY id LIMIT 1").fetchone()
+        return oldest is not None and oldest[0] < time.time_ns() - self.max_age * 1e9
+
+    def _enforce_locked(self, keep=None):
+        while self.count and self._over_limit_locked():
+            row = self.db.execute("SELECT id, path, size FROM media ORDER BY id LIMIT 1").fetchone()
+            if row[0] == keep:
+                break   # never evict what was just stored, even if it alone is over quota
+            self.db.execute("DELETE FROM media WHERE id = ?", (row[0],))
+            self.count -= 1
+            self.total_bytes -= row[2]
+            try:
+                os.remove(row[1])
+            except FileNotFoundError:
+                pass
+            EVICTED.inc()
+
+    def enforce(self):
+        """Apply the retention policy now (age limits also expire while idle)"""
+        with self._lock:
+            self._enforce_locked()
+
+    # ----- reading -----
+    def _items(self, rows):
+        return [MediaItem(kind, path, command_id, ts_ns, id, size)
+                for id, ts_ns, kind, command_id, path, size in rows]
+
+    def get(self, item_id):
+        with self._lock:
+            rows = self.db.execute("SELECT id, ts_ns, kind, command_id, path, size FROM media "
+                                   "WHERE id = ?", (item_id,)).fetchall()
+        return self._items(rows)[0] if rows else None
+
+    def list(self, kind=None, since_ns=0, until_ns=None, limit=100):
+        """Captures with since_ns <= ts < until_ns, oldest first"""
+        query = "SELECT id, ts_ns, kind, command_id, path, size FROM media WHERE ts_ns >= ?"
+        args = [since_ns]
+        if until_ns is not None:
+            query += " AND ts_ns < ?"
+            args.append(until_ns)
+        if kind:
+            query += " AND kind = ?"
+            args.append(kind)
+        query += " ORDER BY ts_ns, id LIMIT ?"
+        args.append(limit)
+        with self._lock:
+            return self._items(self.db.execute(query, args).fetchall())
+
+    def range(self, first_id, last_id, limit=100):
+        """Captures with first_id <= id <= last_id"""
+        with self._lock:
+            rows = self.db.execute("SELECT id, ts_ns, kind, command_id, path, size FROM media "
+                                   "WHERE id BETWEEN ? AND ? ORDER BY id LIMIT ?",
+                                   (first_id, last_id, limit)).fetchall()
+        return self._items(rows)
+
+    def latest(self, kind):
+        with self._lock:
+            rows = self.db.execute("SELECT id, ts_ns, kind, command_id, path, size FROM media "
+                                   "WHERE kind = ? ORDER BY id DESC LIMIT 1", (kind,)).fetchall()
+        return self._items(rows)[0] if rows else None
+
+
+def _benchmark(items=20000):
+    import tempfile
+    with tempfile.TemporaryDirectory() as tmp:
+        store = MediaStore(tmp, quota_bytes=items // 2 * 1024, max_items=items, max_age=None)
+        start = time.perf_counter()
+        for i in range(items):
+            with store.capture("photo", "jpg", command_id=i & 0xFFFF) as item:
+                with open(item.tmp, 'wb') as f:
+                    f.write(bytes(1024))
+        elapsed = time.perf_counter() - start
+        print(f"{items} captures stored in {elapsed:.2f} s ({elapsed / items * 1e6:.0f} us each incl. "
+              f"file write), {EVICTED.value} evicted, {store.count} kept, {store.total_bytes} bytes")
+        newest = store.latest("photo")
+        start = time.perf_counter()
+        for _ in range(1000):
+            listed = store.list("photo", newest.ts_ns - 10**9, limit=100)
+        print(f"list of a 1 s range ({len(listed)} items): {(time.perf_counter() - start) * 1e3:.0f} us "
+              f"per query; files on disk {len(os.listdir(os.path.join(tmp, 'photo')))}")
+        store.close()
+
+
+if __name__ == "__main__":
+    import sys
+    if "--bench" in sys.argv:
+        args = [a for a in sys.argv[1:] if not a.startswith("--")]
+        _benchmark(int(args[0]) if args else 20000)
@@ -0,0 +1,374 @@
+# media_workers.py
+# Long-lived helper processes for the audio commands of tcpfin_test, instead
+# of a shell + arecord/aplay per command. Each helper is supervised: when it
+# exits it is started again with backoff, and launch time, failures and
+# restarts are recorded per helper.
+#
+#   AudioCapture  one arecord streams raw CD-format PCM into a pipe for as
+#                 long as the daemon runs; record() just starts copying that
+#                 stream into a WAV file, so a recording starts with the
+#                 next period of audio instead of after a process launch.
+#   AudioPlayer   one aplay reads raw CD-format PCM from a pipe; play()
+#                 parses the WAV in-process and feeds its samples. Files in
+#                 another format return False and the caller spawns aplay.
+#   spawn / run   one-off commands (ffmpeg, xrandr) without a shell, timed.
+#
+# The helpers can be replaced by this file itself, which fakes arecord and
+# aplay (real-time PCM, configurable start-up delay and crashes) so all of
+# it runs without audio hardware:
+#
+#   python media_workers.py --fake arecord --startup 0.2 --crash-after 3
+#   python media_workers.py --bench       # per-command spawn vs warm helpers
+
+import os
+import subprocess
+import sys
+import threading
+import time
+import wave
+from contextlib import contextmanager
+
+import metrics
+
+RATE, CHANNELS, WIDTH = 44100, 2, 2       # arecord/aplay "-f cd"
+CHUNK = 4096                              # bytes per pipe read/write (~23 ms of audio)
+START_TIMEOUT = 2.0                       # s to wait for a (re)starting helper
+BACKOFF_MAX = 5.0                         # s between restarts at most
+STABLE_AFTER = 10.0                       # s of uptime that resets the backoff
+
+RECORD_START = metrics.histogram("audio_record_start_seconds", "record() -> first samples in the file")
+PLAY_START = metrics.histogram("audio_play_start_seconds", "play() -> first samples handed to aplay")
+
+
+def _launch(name):
+    return metrics.histogram("media_worker_launch_seconds", "Process start -> ready", {"worker": name})
+
+
+def _failures(name):
+    return metrics.counter("media_worker_failures_total", "Helper exits and failed launches", {"worker": name})
+
+
+def _restarts(name):
+    return metrics.counter("media_worker_restarts_total", "Helper restarts by the supervisor", {"worker": name})
+
+
+def fake_binary(name, startup=0.0, crash_after=None):
+    """argv running this file as a stand-in for arecord/aplay"""
+    argv = [sys.executable, os.path.abspath(__file__), "--fake", name, "--startup", str(startup)]
+    if crash_after is not None:
+        argv += ["--crash-after", str(crash_after)]
+    return argv
+
+
+def spawn(argv, name, **kwargs):
+    """Popen without a shell; the launch is timed and failures counted"""
+    start = time.perf_counter()
+    try:
+        proc = subprocess.Popen(argv, **kwargs)
+    except OSError:
+        _failures(name).inc()
+        raise
+    _launch(name).since(start)
+    return proc
+
+
+def run(argv, name, timeout=None):
+    """Run a short command to completion; True if it exited with 0"""
+    try:
+        proc = spawn(argv, name, stdout=subprocess.DEVNULL)
+        ok = proc.wait(timeout) == 0
+    except (OSError, subprocess.TimeoutExpired):
+        ok = False
+    if not ok:
+        _failures(name).inc()
+    return ok
+
+
+class Helper:
+    """A supervised long-lived process with pipes to it"""
+    name = "helper"
+
+    def __init__(self, argv):
+        self.argv = argv
+        self.proc = None
+        self.running = False
+        self.ready = threading.Event()     # set while a live process can take work
+        self._thread = None
+
+    def start(self):
+        self.running = True
+        self._thread = threading.Thread(target=self._supervise, name=self.name, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.running = False
+        self.ready.clear()
+        proc = self.proc
+        if proc and proc.poll() is None:
+            proc.terminate()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+
+    @contextmanager
+    def paused(self):
+        """Release the device (e.g. for ffmpeg) and start again afterwards"""
+        self.stop()
+        try:
+            yield
+        finally:
+            self.start()
+
+    def wait_ready(self, timeout=START_TIMEOUT):
+        return self.ready.wait(timeout)
+
+    def _supervise(self):
+        failures = 0
+        while self.running:
+            launched = time.perf_counter()
+            try:
+                self.proc = subprocess.Popen(self.argv, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                             stderr=subprocess.DEVNULL)
+            except OSError as e:
+                print(f"[{self.name}] launch failed: {e}")
+                self.proc = None
+            else:
+                self._serve(self.proc, launched)
+                self.ready.clear()
+                if self.proc.poll() is None:
+                    self.proc.terminate()
+                self.proc.wait()
+            if not self.running:
+                return
+            _failures(self.name).inc()
+            failures = 0 if time.perf_counter() - launched > STABLE_AFTER else failures + 1
+            delay = min(0.1 * 2 ** failures, BACKOFF_MAX)
+            print(f"[{self.name}] exited, restarting in {delay:.1f} s")
+            time.sleep(delay)
+            _restarts(self.name).inc()
+
+    def _serve(self, proc, launched):
+        """Mark ready and return once proc has exited or the helper is stopped"""
+        raise NotImplementedError
+
+
+class _Recording:
+    def __init__(self, out, size):
+        self.out = out
+        self.remaining = size        # bytes of PCM still wanted
+        self.started = time.perf_counter()
+        self.first = True
+        self.ok = False
+        self.done = threading.Event()
+
+
+class AudioCapture(Helper):
+    name = "arecord"
+
+    def __init__(self, device, argv=None):
+        super().__init__(argv or ["arecord", "-D", device, "-f", "cd", "-t", "raw", "-q"])
+        self._lock = threading.Lock()
+        self._recording = None
+
+    def _serve(self, proc, launched):
+        first = True
+        while self.running:
+            data = proc.stdout.read1(CHUNK)
+            if not data:
+                break
+            if first:
+                _launch(self.name).since(launched)
+                self.ready.set()
+                first = False
+            with self._lock:
+                if self._recording:
+                    self._write_locked(self._recording, data)
+        self._finish(False)   # a recording in progress fails with its helper
+
+    def _write_locked(self, rec, data):
+        data = data[:rec.remaining]
+        rec.out.writeframesraw(data)
+        if rec.first:
+            RECORD_START.since(rec.started)
+            rec.first = False
+        rec.remaining -= len(data)
+        if not rec.remaining:
+            self._recording = None
+            rec.out.close()
+            rec.ok = True
+            rec.done.set()
+
+    def _finish(self, ok):
+        with self._lock:
+            rec, self._recording = self._recording, None
+        if rec:
+            rec.out.close()
+            rec.ok = ok
+            rec.done.set()
+
+    def record(self, path, duration, job=None):
+        """Write the next duration seconds of the stream to path as WAV; True on success"""
+        if not self.wait_ready():
+            print(f"[{self.name}] not running, cannot record")
+            return False
+        out = wave.open(path, 'wb')
+        out.setnchannels(CHANNELS)
+        out.setsampwidth(WIDTH)
+        out.setframerate(RATE)
+        rec = _Recording(out, int(duration * RATE) * CHANNELS * WIDTH)
+        with self._lock:
+            busy = self._recording is not None
+            if not busy:
+                self._recording = rec
+        if busy:
+            out.close()
+            return False   # one recording at a time (the job engine's "audio" lock)
+        if job:
+            job.on_cancel(lambda: self._finish(False))
+        rec.done.wait()
+        return rec.ok
+
+
+class AudioPlayer(Helper):
+    name = "aplay"
+
+    def __init__(self, device, argv=None):
+        super().__init__(argv or ["aplay", "-D", device, "-f", "cd", "-t", "raw", "-q"])
+        self._feeder = None
+        self._stop = threading.Event()
+
+    def _serve(self, proc, launched):
+        _launch(self.name).since(launched)
+        self.ready.set()
+        while self.running and proc.poll() is None:
+            time.sleep(0.2)
+
+    def play(self, path):
+        """Start playing a CD-format WAV; False if the file needs a separate aplay"""
+        started = time.perf_counter()
+        try:
+            src = wave.open(path, 'rb')
+        except (OSError, EOFError, wave.Error):
+            return False
+        if (src.getnchannels(), src.getsampwidth(), src.getframerate()) != (CHANNELS, WIDTH, RATE) \
+                or not self.wait_ready():
+            src.close()
+            return False
+        self.stop_playing()
+        self._stop.clear()
+        self._feeder = threading.Thread(target=self._feed, args=(src, started), daemon=True)
+        self._feeder.start()
+        return True
+
+    def _feed(self, src, started):
+        frames = CHUNK // (CHANNELS * WIDTH)
+        first = True
+        with src:
+            while not self._stop.is_set():
+                data = src.readframes(frames)
+                if not data:
+                    break
+                try:
+                    self.proc.stdin.write(data)   # blocks at playback speed once the pipe is full
+                    self.proc.stdin.flush()
+                except (OSError, ValueError, AttributeError):
+                    break   # aplay died; the supervisor restarts it
+                if first:
+                    PLAY_START.since(started)
+                    first = False
+
+    @property
+    def playing(self):
+        return bool(self._feeder and self._feeder.is_alive())
+
+    def stop_playing(self):
+        """Stop feeding samples; True if something was playing"""
+        was_playing = self.playing
+        self._stop.set()
+        if self._feeder:
+            self._feeder.join()
+            self._feeder = None
+        return was_playing
+
+
+# ----- fake arecord / aplay -----
+def _fake(name, startup, crash_after):
+    time.sleep(startup)   # process + ALSA start-up of the real binaries
+    begin = time.perf_counter()
+    period = CHUNK / (RATE * CHANNELS * WIDTH)
+    sent = 0
+    try:
+        while crash_after is None or time.perf_counter() - begin < crash_after:
+            if name == "arecord":
+                sys.stdout.buffer.write(bytes(CHUNK))
+                sys.stdout.buffer.flush()
+            elif not sys.stdin.buffer.read(CHUNK):
+                return 0
+            sent += 1
+            time.sleep(max(0.0, begin + sent * period - time.perf_counter()))   # real-time pacing
+    except (BrokenPipeError, KeyboardInterrupt):
+        return 0
+    return 1   # simulated crash
+
+
+def _benchmark(startup=0.15, rounds=10):
+    import tempfile
+    with tempfile.TemporaryDirectory() as tmp:
+        clip = os.path.join(tmp, "clip.wav")
+        with wave.open(clip, 'wb') as w:
+            w.setnchannels(CHANNELS)
+            w.setsampwidth(WIDTH)
+            w.setframerate(RATE)
+            w.writeframes(bytes(RATE * CHANNELS * WIDTH // 2))
+        print(f"fake arecord/aplay with {startup * 1e3:.0f} ms start-up, {rounds} rounds")
+
+        # the old way: one process per command, latency until it produces/accepts audio
+        spawned = []
+        for _ in range(rounds):
+            start = time.perf_counter()
+            proc = spawn(fake_binary("arecord", startup), "arecord-once", stdout=subprocess.PIPE)
+            proc.stdout.read(1)
+            spawned.append(time.perf_counter() - start)
+            proc.terminate()
+            proc.wait()
+        spawned.sort()
+
+        capture = AudioCapture(None, fake_binary("arecord", startup)).start()
+        player = AudioPlayer(None, fake_binary("aplay", startup)).start()
+        capture.wait_ready()
+        player.wait_ready()
+        for i in range(rounds):
+            assert capture.record(os.path.join(tmp, f"rec{i}.wav"), 0.1)
+            assert player.play(clip)
+            time.sleep(0.05)
+            player.stop_playing()
+        print(f"  spawn per command:  p50 {spawned[len(spawned) // 2] * 1e3:6.1f} ms until audio flows")
+        print(f"  warm arecord:       p50 {RECORD_START.quantile(0.5) * 1e3:6.1f} ms record() -> first samples")
+        print(f"  warm aplay:         p50 {PLAY_START.quantile(0.5) * 1e3:6.1f} ms play() -> first samples")
+        with wave.open(os.path.join(tmp, "rec0.wav")) as w:
+            print(f"  recorded 0.1 s -> {w.getnframes()} frames")
+        capture.stop()
+        player.stop()
+
+        # supervision: a helper that crashes every 0.5 s
+        crashing = AudioCapture(None, fake_binary("arecord", startup, crash_after=0.5)).start()
+        time.sleep(3)
+        ok = crashing.record(os.path.join(tmp, "after_crash.wav"), 0.2)
+        crashing.stop()
+        print(f"  crashing helper: {_failures('arecord').value} failures, "
+              f"{_restarts('arecord').value} restarts, recording afterwards ok={ok}")
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Media helper processes")
+    parser.add_argument("--fake", choices=("arecord", "aplay"), help="behave like arecord/aplay -t raw")
+    parser.add_argument("--startup", type=float, default=0.0)
+    parser.add_argument("--crash-after", type=float)
+    parser.add_argument("--bench", action="store_true")
+    args = parser.parse_args()
+    if args.fake:
+        sys.exit(_fake(args.fake, args.startup, args.crash_after))
+    if args.bench:
+        _benchmark()
@@ -0,0 +1,256 @@
+# metrics.py
+# Lightweight in-process metrics shared by the control, TCP and media scripts.
+# Counters, gauges and HDR-style (log-linear bucket) latency histograms,
+# exported as Prometheus text on a local HTTP endpoint and as a periodic
+# one-line log summary. Recording a sample is a lock plus a few integer ops.
+#
+#   import metrics
+#   RX = metrics.counter("mqtt_messages_total", "MQTT messages received")
+#   LAT = metrics.histogram("mqtt_to_serial_seconds", "MQTT receive -> serial write")
+#   RX.inc(); LAT.observe(0.00042)
+#   metrics.serve_http(9101); metrics.start_log_reporter(30)
+
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+SUB_BUCKETS = 16        # linear sub-buckets per power of two (~6 % resolution)
+MAX_EXPONENT = 40       # histograms cover 1 us .. ~12 days
+
+
+def _label_text(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in labels) + "}"
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name, help="", labels=()):
+        self.name, self.help, self.labels = name, help, labels
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, n=1):
+        with self._lock:
+            self.value += n
+
+    def samples(self):
+        yield self.name, self.labels, self.value
+
+
+class Gauge:
+    kind = "gauge"
+
+    def __init__(self, name, help="", labels=(), fn=None):
+        self.name, self.help, self.labels = name, help, labels
+        self.fn = fn            # if set, read at export time (no hot-path cost)
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def set(self, value):
+        self.value = value
+
+    def inc(self, n=1):
+        with self._lock:
+            self.value += n
+
+    def dec(self, n=1):
+        with self._lock:
+            self.value -= n
+
+    def get(self):
+        return self.fn() if self.fn else self.value
+
+    def samples(self):
+        yield self.name, self.labels, self.get()
+
+
+class Histogram:
+    """Latency histogram in microseconds with log-linear buckets
+
+    Bucket i covers values with the same power of two and the same top
+    log2(SUB_BUCKETS) bits, like HdrHistogram with ~1.2 significant digits.
+    """
+    kind = "histogram"
+
+    def __init__(self, name, help="", labels=()):
+        self.name, self.help, self.labels = name, help, labels
+        self.counts = [0] * (SUB_BUCKETS * (MAX_EXPONENT + 1))
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _index(us):
+        if us < SUB_BUCKETS:
+            return us
+        exponent = us.bit_length() - SUB_BUCKETS.bit_length()
+        return min(exponent * SUB_BUCKETS + (us >> exponent), SUB_BUCKETS * (MAX_EXPONENT + 1) - 1)
+
+    @staticmethod
+    def _upper(index):
+        """Largest microsecond value that falls in bucket index"""
+        if index < 2 * SUB_BUCKETS:
+            return index
+        exponent = index // SUB_BUCKETS - 1
+        return ((index - exponent * SUB_BUCKETS) + 1 << exponent) - 1
+
+    def observe(self, seconds):
+        us = int(seconds * 1e6)
+        if us < 0:
+            us = 0
+        i = self._index(us)
+        with self._lock:
+            self.counts[i] += 1
+            self.count += 1
+            self.total += seconds
+            if seconds > self.max:
+                self.max = seconds
+
+    def since(self, start):
+        """Observe time.perf_counter() - start"""
+        self.observe(time.perf_counter() - start)
+
+    def quantile(self, q):
+        """Approximate q-quantile in seconds (bucket upper bound), None if empty"""
+        with self._lock:
+            if not self.count:
+                return None
+            rank = q * self.count
+            seen = 0
+            for i, n in enumerate(self.counts):
+                seen += n
+                if n and seen >= rank:
+                    return min(self._upper(i) / 1e6, self.max)
+        return self.max
+
+    def samples(self):
+        # cumulative buckets at power-of-two microsecond bounds
+        with self._lock:
+            counts = list(self.counts)
+            count, total = self.count, self.total
+        cumulative = 0
+        bound = 1
+        for i, n in enumerate(counts):
+            while self._upper(i) > bound:
+                if cumulative == count:
+                    break
+                yield self.name + "_bucket", self.labels + (("le", f"{bound / 1e6:g}"),), cumulative
+                bound *= 2
+            cumulative += n
+        yield self.name + "_bucket", self.labels + (("le", "+Inf"),), count
+        yield self.name + "_sum", self.labels, total
+        yield self.name + "_count", self.labels, count
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = {}
+        self._lock = threading.Lock()
+
+    def _get(self, cls, name, help, labels, **kwargs):
+        labels = tuple(sorted((labels or {}).items()))
+        key = (name, labels)
+        with self._lock:
+            metric = self.metrics.get(key)
+            if metric is None:
+                metric = self.metrics[key] = cls(name, help, labels, **kwargs)
+            elif not isinstance(metric, cls):
+                raise ValueError(f"metric {name} already registered as {metric.kind}")
+        return metric
+
+    def counter(self, name, help="", labels=None):
+        return self._get(Counter, name, help, labels)
+
+    def gauge(self, name, help="", labels=None, fn=None):
+        return self._get(Gauge, name, help, labels, fn=fn)
+
+    def histogram(self, name, help="", labels=None):
+        return self._get(Histogram, name, help, labels)
+
+    def prometheus_text(self):
+        lines = []
+        described = set()
+        with self._lock:
+            metrics = sorted(self.metrics.values(), key=lambda m: (m.name, m.labels))
+        for metric in metrics:
+            if metric.name not in described:
+                described.add(metric.name)
+                if metric.help:
+                    lines.append(f"# HELP {metric.name} {metric.help}")
+                lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for name, labels, value in metric.samples():
+                lines.append(f"{name}{_label_text(labels)} {value}")
+        return "\n".join(lines) + "\n"
+
+    def summary_line(self):
+        """Compact one-line summary: counters, gauges and p50/p99 of histograms"""
+        parts = []
+        with self._lock:
+            metrics = sorted(self.metrics.values(), key=lambda m: (m.name, m.labels))
+        for metric in metrics:
+            name = metric.name + _label_text(metric.labels)
+            if isinstance(metric, Histogram):
+                if metric.count:
+                    parts.append(f"{name} n={metric.count} p50={metric.quantile(0.5) * 1e3:.2f}ms "
+                                 f"p99={metric.quantile(0.99) * 1e3:.2f}ms")
+            else:
+                value = metric.get() if isinstance(metric, Gauge) else metric.value
+                parts.append(f"{name}={value:g}" if isinstance(value, float) else f"{name}={value}")
+        return " | ".join(parts)
+
+
+REGISTRY = Registry()
+
+
+def counter(name, help="", labels=None):
+    return REGISTRY.counter(name, help, labels)
+
+
+def gauge(name, help="", labels=None, fn=None):
+    return REGISTRY.gauge(name, help, labels, fn)
+
+
+def histogram(name, help="", labels=None):
+    return REGISTRY.histogram(name, help, labels)
+
+
+def serve_http(port, host="127.0.0.1", registry=REGISTRY):
+    """Serve /metrics in Prometheus text format from a daemon thread"""
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = registry.prometheus_text().encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def start_log_reporter(interval=30.0, registry=REGISTRY, log=print):
+    """Print registry.summary_line() every interval seconds; returns a stop Event"""
+    stop = threading.Event()
+
+    def report():
+        while not stop.wait(interval):
+            line = registry.summary_line()
+            if line:
+                log(f"[metrics] {line}")
+
+    threading.Thread(target=report, daemon=True).start()
+    return stop
@@ -0,0 +1,377 @@
+# motor_engine.py
+# Event-driven control engine for the serial motor board.
+# A selector waits on the serial fd and on a wakeup pipe that the MQTT
+# callback writes to after posting into the command mailbox, so the newest
+# command goes out as soon as it arrives.
+# Timers (selector timeouts) handle the keepalive resend and the 1 s
+# safety stop; unchanged speeds are not resent in between.
+# One engine thread can serve many boards (MotorChannel per serial port).
+# Each channel speaks ASCII "$spd:...#" or, if negotiated, binary_protocol.
+# A board whose port fails (USB unplugged, EIO, EOF) is taken out of the
+# selector and, if the channel knows how, reopened with backoff; the other
+# boards keep running.
+
+import heapq
+import os
+import selectors
+import threading
+import time
+
+import binary_protocol
+import metrics
+from command_mailbox import CommandMailbox
+from command_writer import CommandWriter, KEEPALIVE_INTERVAL
+from frame_parser import FrameParser
+from transport import PtyTransport
+
+STOP_TIMEOUT = 1.0       # stop the motors if no command arrives for this long (s)
+REOPEN_DELAY = 0.5       # s before the first reopen of a failed port
+MAX_REOPEN_DELAY = 5.0   # s between reopen attempts, at most
+
+# board configuration per motor type: ($mtype, $mphase, $mline, $wdiameter, $deadzone)
+MOTOR_PARAMETERS = {
+    1: (1, 30, 11, 67.00, 1600),
+    2: (2, 20, 13, 48.00, 1300),
+    3: (3, 45, 13, 68.00, 1250),
+    4: (4, 48, None, None, 1000),
+    5: (1, 40, 11, 67.00, 1600),
+}
+
+
+def format_motor_frame(speeds, motor_type):
+    """Build the speed (or PWM for motor type 4) frame for the board"""
+    if motor_type == 4:
+        return "$pwm:{},{},{},{}#".format(*[s * 2 for s in speeds])
+    return "$spd:{},{},{},{}#".format(*speeds)
+
+
+def parameter_frames(motor_type):
+    """The configuration frames for a motor type, in the order the board expects"""
+    names = ("mtype", "mphase", "mline", "wdiameter", "deadzone")
+    return ["${}:{}#".format(name, value)
+            for name, value in zip(names, MOTOR_PARAMETERS.get(motor_type, ()))
+            if value is not None]
+
+
+class MotorChannel:
+    """One motor board: its port, writer, parser and command state"""
+
+    def __init__(self, port, motor_type=1, stop_timeout=STOP_TIMEOUT,
+                 keepalive_interval=KEEPALIVE_INTERVAL, on_receive=None, writer=None,
+                 name=None, on_telemetry=None, binary=False, setup=(), reopen=None):
+        self.port = port
+        self.name = name or getattr(port, "name", "motor")
+        self.motor_type = motor_type
+        self.stop_timeout = stop_timeout
+        self.on_receive = on_receive      # called with every ASCII frame from the board
+        self.on_telemetry = on_telemetry  # called with (kind, values) in binary mode
+        self.binary = binary
+        self.binary_parser = binary_protocol.BinaryFrameParser()
+        self.writer = writer or CommandWriter(port, keepalive_interval)
+        self.setup = list(setup)          # configuration frames sent whenever the port (re)opens
+        self.reopen = reopen              # callable() -> new port after a failure, or None
+        self.reopen_at = None             # set while the port is down
+        self.reopen_delay = REOPEN_DELAY
+
+        self.speeds = [0, 0, 0, 0]
+        self.command_active = False
+        self.last_command_time = 0.0
+        self.safety_stops = 0
+        self.mailbox = CommandMailbox()
+        self.parser = FrameParser()
+        self._scheduled = None            # deadline currently on the engine's timer heap
+
+        labels = {"channel": self.name}
+        self._latency = metrics.histogram(
+            "motor_command_latency_seconds", "Command receive -> serial write", labels)
+        self.port_errors = metrics.counter(
+            "motor_port_errors_total", "Motor board ports lost (read/write error or EOF)", labels)
+        # a re-created channel takes over its name
+        metrics.gauge("serial_bytes_sent", "Bytes written to the motor board", labels
+                      ).fn = lambda: self.writer.bytes_sent
+        metrics.gauge("serial_frames_saved", "Unchanged motor frames not resent", labels
+                      ).fn = lambda: self.writer.frames_saved
+        metrics.gauge("serial_dropped_bytes", "Received bytes dropped while resyncing", labels
+                      ).fn = lambda: self.parser.dropped_bytes
+        metrics.gauge("motor_port_up", "1 while the motor board port is open", labels
+                      ).fn = lambda: int(self.port is not None)
+
+    def apply_pending(self):
+        command = self.mailbox.take(max_age=self.stop_timeout)
+        if command is None:
+            return
+        self.speeds = command.speeds if command.active else [0, 0, 0, 0]
+        self.command_active = command.active
+        self.last_command_time = command.received
+        self.write_speeds()
+        written = time.monotonic()
+        self.mailbox.mark_applied(command, written)
+        self._latency.observe(written - command.received)
+
+    def service(self, now):
+        """Run the safety stop / keepalive if due"""
+        if self.command_active and now - self.last_command_time >= self.stop_timeout:
+            self.speeds = [0, 0, 0, 0]
+            self.command_active = False
+            self.safety_stops += 1
+            print(f"{self.name}: no command for {self.stop_timeout:g} s, motors stopped")
+            self.write_speeds(force=True)
+        elif now >= self.writer.next_keepalive():
+            self.write_speeds()
+
+    def next_deadline(self):
+        if self.port is None:
+            return self.reopen_at if self.reopen_at is not None else float("inf")
+        deadline = self.writer.next_keepalive()
+        if self.command_active:
+            deadline = min(deadline, self.last_command_time + self.stop_timeout)
+        return deadline
+
+    def stop_motors(self):
+        self.speeds = [0, 0, 0, 0]
+        self.command_active = False
+        self.write_speeds(force=True)
+
+    def write_speeds(self, force=False):
+        if self.binary:
+            frame = binary_protocol.encode_motor(self.speeds, self.motor_type)
+        else:
+            frame = format_motor_frame(self.speeds, self.motor_type)
+        return self.writer.send_motor(frame, force)
+
+    def read(self):
+        """Handle what the board sent; False at EOF (port gone)"""
+        data = os.read(self.port.fileno(), 4096)
+        if not data:
+            return False
+        if self.binary:
+            for msg_type, values in self.binary_parser.feed(data):
+                telemetry = binary_protocol.decode_telemetry(msg_type, values)
+                if telemetry and self.on_telemetry:
+                    self.on_telemetry(*telemetry)
+            return True
+        frames = self.parser.feed(data)
+        if self.on_receive:
+            for frame in frames:
+                self.on_receive(frame.decode(errors="replace"))
+        return True
+
+    def open(self, port):
+        """Use a (re)opened port; configuration goes out with the first write"""
+        self.port = port
+        self.writer.port = port
+        self.reopen_at = None
+        for frame in self.setup:
+            self.writer.queue(frame)
+
+
+class MotorEngine:
+    """Selector loop driving one or more MotorChannels from a single thread
+
+    MotorEngine(port, ...) builds the usual single-board engine; its
+    writer/mailbox/parser are those of that channel. Further boards are
+    added with add_channel().
+    """
+
+    def __init__(self, port=None, motor_type=1, stop_timeout=STOP_TIMEOUT,
+                 keepalive_interval=KEEPALIVE_INTERVAL, on_receive=None, writer=None,
+                 on_telemetry=None, binary=False):
+        self.channels = {}
+        self.running = False
+        self._lock = threading.Lock()
+        self._ready = []          # channels with a posted command
+        self._added = []          # channels waiting to be registered
+        self._timers = []         # heap of (deadline, seq, channel)
+        self._timer_seq = 0
+        self._selector = selectors.DefaultSelector()
+        self._wake_r, self._wake_w = os.pipe()
+        os.set_blocking(self._wake_r, False)
+        os.set_blocking(self._wake_w, False)
+        self._selector.register(self._wake_r, selectors.EVENT_READ, None)
+
+        self.channel = None
+        if port is not None:
+            self.channel = self.add_channel(port, motor_type=motor_type, stop_timeout=stop_timeout,
+                                            keepalive_interval=keepalive_interval,
+                                            on_receive=on_receive, writer=writer,
+                                            on_telemetry=on_telemetry, binary=binary)
+            self.writer = self.channel.writer
+            self.mailbox = self.channel.mailbox
+            self.parser = self.channel.parser
+
+    def add_channel(self, port, name=None, **kwargs):
+        """Add a board (any thread); it is started by the engine loop"""
+        channel = MotorChannel(port, name=name, **kwargs)
+        with self._lock:
+            if channel.name in self.channels:
+                raise ValueError(f"duplicate motor channel {channel.name}")
+            self.channels[channel.name] = channel
+            self._added.append(channel)
+        self._wake()
+        return channel
+
+    # ----- called from other threads -----
+    def submit(self, speeds, active=True, seq=None, received=None, channel=None):
+        """Post new target speeds to a channel's mailbox and wake the engine
+
+        Returns False if the command was discarded as out of order.
+        """
+        channel = channel or self.channel
+        if channel.mailbox.post(speeds, active, seq, received) is None:
+            return False
+        with self._lock:
+            self._ready.append(channel)
+        self._wake()
+        return True
+
+    def stop(self):
+        """Ask the engine loop to exit (motors are stopped on the way out)"""
+        self.running = False
+        self._wake()
+
+    def _wake(self):
+        try:
+            os.write(self._wake_w, b"\x00")
+        except BlockingIOError:
+            pass  # loop is already due to wake up
+
+    # ----- engine loop -----
+    def run(self):
+        """Run the engine until stop() is called"""
+        sel = self._selector
+        self.running = True
+        try:
+            while self.running:
+                timeout = None
+                if self._timers:
+                    timeout = max(0.0, self._timers[0][0] - time.monotonic())
+                for key, _ in sel.select(timeout):
+                    if key.data is None:
+                        self._drain_wakeups()
+                    elif key.data.port is not None:
+                        self._guard(key.data, lambda channel: channel.read() or self._lost(channel, "EOF"))
+
+                now = time.monotonic()
+                while self._timers and self._timers[0][0] <= now:
+                    deadline, _, channel = heapq.heappop(self._timers)
+                    if deadline == channel._scheduled:
+                        channel._scheduled = None
+                        if channel.port is None:
+                            self._reopen(channel)
+                        else:
+                            self._guard(channel, lambda channel: channel.service(now))
+                        self._schedule(channel)
+        finally:
+            for channel in self.channels.values():
+                if channel.port is not None:
+                    self._guard(channel, MotorChannel.stop_motors)
+
+    def close(self):
+        self._selector.close()
+        os.close(self._wake_r)
+        os.close(self._wake_w)
+
+    def _drain_wakeups(self):
+        try:
+            while os.read(self._wake_r, 512):
+                pass
+        except BlockingIOError:
+            pass
+        with self._lock:
+            added, self._added = self._added, []
+            ready, self._ready = self._ready, []
+        for channel in added:
+            channel.open(channel.port)
+            self._start(channel)
+        for channel in ready:
+            if channel.port is not None:   # else the command waits in the mailbox for the reopen
+                self._guard(channel, MotorChannel.apply_pending)
+            self._schedule(channel)
+
+    def _start(self, channel):
+        self._selector.register(channel.port.fileno(), selectors.EVENT_READ, channel)
+        # start from a known stopped state; queued configuration goes out with it
+        self._guard(channel, lambda channel: channel.write_speeds(force=True))
+        self._schedule(channel)
+
+    def _guard(self, channel, action):
+        """Run action(channel); a port error takes only that channel down"""
+        try:
+            action(channel)
+        except OSError as e:
+            self._lost(channel, e)
+
+    def _lost(self, channel, error):
+        if channel.port is None:
+            return
+        print(f"{channel.name}: port lost ({error})")
+        channel.port_errors.inc()
+        try:
+            self._selector.unregister(channel.port.fileno())
+        except (KeyError, ValueError, OSError):
+            pass
+        try:
+            channel.port.close()
+        except OSError:
+            pass
+        channel.port = None
+        channel.command_active = False
+        channel.reopen_at = time.monotonic() + channel.reopen_delay if channel.reopen else None
+        channel._scheduled = None       # drops its keepalive / safety stop timer
+        self._schedule(channel)
+
+    def _reopen(self, channel):
+        try:
+            port = channel.reopen()
+        except (OSError, RuntimeError) as e:
+            channel.reopen_delay = min(channel.reopen_delay * 2, MAX_REOPEN_DELAY)
+            channel.reopen_at = time.monotonic() + channel.reopen_delay
+            print(f"{channel.name}: reopen failed ({e}), next try in {channel.reopen_delay:g} s")
+            return
+        print(f"{channel.name}: port reopened")
+        channel.reopen_delay = REOPEN_DELAY
+        channel.open(port)
+        self._start(channel)
+
+    def _schedule(self, channel):
+        deadline = channel.next_deadline()
+        if deadline == float("inf") or deadline == channel._scheduled:
+            return
+        channel._scheduled = deadline
+        self._timer_seq += 1
+        heapq.heappush(self._timers, (deadline, self._timer_seq, channel))
+
+
+def _measure_latency(count=500):
+    """Measure submit -> bytes-on-the-pty latency without the car"""
+    port = PtyTransport()
+    engine = MotorEngine(port, keepalive_interval=60.0)
+    thread = threading.Thread(target=engine.run, daemon=True)
+    thread.start()
+    time.sleep(0.05)
+
+    samples = []
+    buffer = b""
+    for i in range(1, count + 1):
+        expected = format_motor_frame([i] * 4, 1).encode()
+        start = time.perf_counter()
+        engine.submit([i] * 4)
+        while expected not in buffer:
+            buffer += os.read(port.board_fd, 4096)
+        samples.append(time.perf_counter() - start)
+        buffer = buffer[buffer.index(expected) + len(expected):]
+        time.sleep(0.001)
+
+    engine.stop()
+    thread.join()
+    engine.close()
+    port.close()
+
+    samples.sort()
+    pick = lambda q: samples[min(len(samples) - 1, int(q * len(samples)))] * 1e6
+    print(f"command -> wire latency over {count} commands: "
+          f"p50 {pick(0.50):.0f} us, p99 {pick(0.99):.0f} us, max {samples[-1] * 1e6:.0f} us")
+
+
+if __name__ == "__main__":
+    _measure_latency()
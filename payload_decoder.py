@@ -0,0 +1,142 @@
+# payload_decoder.py
+# Decoder for the joystick MQTT payload {"power", "movespeed", "movex"[, "seq"]}.
+# Uses orjson when it is installed (parses bytes directly, no UTF-8 decode
+# step) and also accepts a compact packed-struct variant. Counts rejected
+# payloads and samples the time spent decoding.
+
+import json
+import struct
+import time
+from collections import namedtuple
+from math import isfinite
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+BINARY_MAGIC = 0xC7
+# magic, power, movespeed, movex, seq  (14 bytes, little endian)
+BINARY_FORMAT = struct.Struct("<BBffI")
+BINARY_SIZE = BINARY_FORMAT.size
+
+Joystick = namedtuple("Joystick", "power movespeed movex seq")
+_joystick = tuple.__new__       # builds a Joystick without namedtuple's keyword handling
+
+_json = json.JSONDecoder()
+_json_scan = _json.scan_once
+
+
+def _json_loads(text):
+    """json.loads for a bare object: runs the C scanner directly and only falls
+    back to the full decode (whitespace skipping, error messages) when it fails"""
+    try:
+        data, end = _json_scan(text, 0)
+    except StopIteration:
+        return _json.decode(text)
+    if end != len(text):
+        return _json.decode(text)
+    return data
+
+
+# Only every 64th call is timed: two clock reads per message would cost about
+# as much as the rest of the decoder's bookkeeping.
+TIMING_SAMPLE = 63
+
+
+def encode_binary(power, movespeed, movex, seq=0):
+    """Pack a command in the compact binary form (for senders and tests)"""
+    return BINARY_FORMAT.pack(BINARY_MAGIC, power, movespeed, movex, seq)
+
+
+class PayloadDecoder:
+    def __init__(self, use_orjson=True):
+        self.backend = "orjson" if (use_orjson and orjson is not None) else "json"
+        self._loads = orjson.loads if self.backend == "orjson" else _json_loads
+        self._takes_bytes = self.backend == "orjson"
+        self.decoded = 0
+        self.binary = 0
+        self.rejected = 0
+        self.errors = {}            # reject reason -> count
+        self.calls = 0
+        self.timed = 0              # calls that were timed (one in TIMING_SAMPLE + 1)
+        self.decode_ns = 0          # time spent in the timed calls
+
+    def decode(self, payload):
+        """Return a Joystick for a valid payload, None (and count it) otherwise"""
+        self.calls += 1
+        timed = not self.calls & TIMING_SAMPLE
+        if timed:
+            start = time.perf_counter_ns()
+        try:
+            if len(payload) == BINARY_SIZE and payload[0] == BINARY_MAGIC:
+                _, power, movespeed, movex, seq = BINARY_FORMAT.unpack(payload)
+                self.binary += 1
+            else:
+                data = self._loads(payload if self._takes_bytes else payload.decode())
+                if type(data) is not dict:
+                    return self._reject("not an object")
+                get = data.get
+                power = int(get("power", 0))
+                movespeed = float(get("movespeed", 0))
+                movex = float(get("movex", 1.0))
+                seq = get("seq")
+                if seq is not None:
+                    seq = int(seq)
+            if not (isfinite(movespeed) and isfinite(movex)):
+                return self._reject("not finite")
+            self.decoded += 1
+            return _joystick(Joystick, (power, movespeed, movex, seq))
+        except (ValueError, TypeError, OverflowError):   # OverflowError: int(inf)
+            return self._reject("malformed")
+        finally:
+            if timed:
+                self.decode_ns += time.perf_counter_ns() - start
+                self.timed += 1
+
+    def _reject(self, reason):
+        self.rejected += 1
+        self.errors[reason] = self.errors.get(reason, 0) + 1
+        return None
+
+    def stats(self):
+        return {
+            "backend": self.backend,
+            "decoded": self.decoded,
+            "binary": self.binary,
+            "rejected": self.rejected,
+            "errors": dict(self.errors),
+            "avg_decode_us": self.decode_ns / self.timed / 1000 if self.timed else None,
+        }
+
+
+def _legacy_decode(payload):
+    """The original on_message parsing, for comparison"""
+    data = json.loads(payload.decode('utf-8'))
+    return int(data.get('power', 0)), float(data.get('movespeed', 0)), float(data.get('movex', 1.0))
+
+
+def _benchmark(count=400000, rounds=20):
+    json_payload = b'{"power": 1, "movespeed": 0.75, "movex": -0.3, "seq": 12345}'
+    binary_payload = encode_binary(1, 0.75, -0.3, 12345)
+    runs = [("legacy json.loads", _legacy_decode, json_payload),
+            ("decoder (json)", PayloadDecoder(use_orjson=False).decode, json_payload)]
+    if orjson is not None:
+        runs.append(("decoder (orjson)", PayloadDecoder().decode, json_payload))
+    runs.append(("decoder (binary)", PayloadDecoder().decode, binary_payload))
+
+    # interleaved rounds, best of each, so one noisy stretch can't decide the order
+    best = {name: float("inf") for name, _, _ in runs}
+    per_round = count // rounds
+    for _ in range(rounds):
+        for name, func, payload in runs:
+            start = time.perf_counter()
+            for _ in range(per_round):
+                func(payload)
+            best[name] = min(best[name], (time.perf_counter() - start) / per_round)
+    for name, elapsed in best.items():
+        print(f"{name:<22} {elapsed * 1e6:6.2f} us/msg  {1 / elapsed:>12,.0f} msg/s")
+
+
+if __name__ == "__main__":
+    _benchmark()
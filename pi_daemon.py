@@ -0,0 +1,266 @@
+# pi_daemon.py
+# One process for everything the car's Pi runs: MQTT motor control
+# (control.py), the PC command server (TCP_control.py) and the media server
+# (tcpfin_test.py). Services are registered with the daemon and started and
+# stopped on one asyncio event loop; hardware (camera, light strip) is opened
+# once and shared by every service that asks for it. SIGINT/SIGTERM stop
+# the services in reverse start order, then close the hardware; SIGHUP
+# retries services that failed to start. One metrics endpoint covers all.
+#
+#   python pi_daemon.py                              # every service
+#   python pi_daemon.py --serial sim --no-media      # emulated motor board
+#   python pi_daemon.py --command-port 8081 --media-port 8080
+#   python pi_daemon.py --warm-camera                # zero-shutter-lag photos
+
+import argparse
+import asyncio
+import signal
+import threading
+
+import metrics
+
+METRICS_PORT = 9100   # Prometheus text for every service on http://127.0.0.1:9100/metrics
+COMMAND_PORT = 8081   # TCP_control server (its standalone default 8080 is the media port)
+MEDIA_PORT = 8080     # tcpfin_test media server, the port the PC app uses
+MEDIA_HOST = "192.168.106.245"  # Pi address the media server binds to
+SERIAL_PORT = "/dev/ttyUSB0"    # or "sim" for the pty board emulator
+
+
+class Service:
+    """A unit the daemon starts and stops; start()/stop() run on the daemon loop"""
+    name = "service"
+
+    def __init__(self, daemon):
+        self.daemon = daemon
+        self.running = False
+
+    async def start(self):
+        raise NotImplementedError
+
+    async def stop(self):
+        raise NotImplementedError
+
+
+class MotorService(Service):
+    """control.py: MQTT joystick commands -> MotorEngine -> serial board"""
+    name = "motor"
+
+    def __init__(self, daemon, port):
+        super().__init__(daemon)
+        self.port = port
+        self.control = None
+        self._thread = None
+
+    async def start(self):
+        import control
+        self.control = control
+        await self.daemon.run_blocking(control.init_serial, self.port)
+        try:
+            if not await self.daemon.run_blocking(control.init_mqtt):
+                raise RuntimeError("MQTT connection failed")
+            engine = await self.daemon.run_blocking(control.setup_engine)
+        except Exception:
+            control.cleanup()
+            raise
+        # the engine keeps its own selector thread: serial latency does not
+        # depend on how busy the shared loop is
+        self._thread = threading.Thread(target=engine.run, name="motor-engine", daemon=True)
+        self._thread.start()
+
+    async def stop(self):
+        self.control.engine.stop()
+        await self.daemon.run_blocking(self._thread.join)
+        self.control.close_engine()
+        self.control.cleanup()
+
+
+class CommandService(Service):
+    """TCP_control.py: PC display/camera/LED commands, UDP responses"""
+    name = "commands"
+
+    def __init__(self, daemon, port, framing="raw"):
+        super().__init__(daemon)
+        self.port = port
+        self.framing = framing
+        self.system = None
+
+    async def start(self):
+        from TCP_control import AsyncPiCommunicationSystem
+        self.system = AsyncPiCommunicationSystem(recv_port=self.port, framing=self.framing,
+                                                 verbose=self.daemon.verbose)
+        await self.system.serve()
+
+    async def stop(self):
+        await self.system.aclose()
+
+
+class MediaService(Service):
+    """tcpfin_test.py: light, photo, video, audio and HDMI commands"""
+    name = "media"
+
+    def __init__(self, daemon, host, port, warm_camera=False):
+        super().__init__(daemon)
+        self.host = host
+        self.port = port
+        self.warm_camera = warm_camera
+        self.server = None
+
+    async def start(self):
+        import tcpfin_test
+        camera = await self.daemon.resource("camera", open_camera, close_camera)
+        light = await self.daemon.resource("light", open_light, close_light)
+        controller = await self.daemon.run_blocking(tcpfin_test.HardwareController, camera, light,
+                                                    self.warm_camera)
+        try:
+            self.server = tcpfin_test.TCPServer(controller, self.host, self.port)
+            self.server.start()
+        except Exception:
+            # e.g. port in use: release the camera so a SIGHUP retry can set it up again
+            await self.daemon.run_blocking(controller.cleanup)
+            raise
+
+    async def stop(self):
+        await self.daemon.run_blocking(self.server.stop)
+
+
+# ----- shared hardware -----
+def open_camera():
+    from picamera2 import Picamera2
+    return Picamera2()
+
+
+def close_camera(camera):
+    camera.close()
+
+
+def open_light():
+    from gpiozero import LED
+    from tcpfin_test import LED_GPIO
+    return LED(LED_GPIO)
+
+
+def close_light(light):
+    light.off()
+    light.close()
+
+
+class PiDaemon:
+    def __init__(self, verbose=False):
+        self.verbose = verbose
+        self.services = {}    # name -> Service, in start order
+        self.resources = {}   # name -> (object, close), in open order
+        self.loop = None
+        self._stop = None
+
+    def add(self, service):
+        self.services[service.name] = service
+        return service
+
+    async def run_blocking(self, func, *args):
+        """Run a blocking call (hardware init, joins) off the loop"""
+        return await self.loop.run_in_executor(None, func, *args)
+
+    async def resource(self, name, factory, close=None):
+        """Open a hardware resource on first use; later callers get the same one"""
+        if name not in self.resources:
+            self.resources[name] = (await self.run_blocking(factory), close)
+            print(f"[daemon] opened {name}")
+        return self.resources[name][0]
+
+    def _set_up(self, service, up):
+        service.running = up
+        metrics.gauge("daemon_service_up", "1 while the service is running",
+                      {"service": service.name}).set(1 if up else 0)
+
+    async def start_service(self, name):
+        """Start one service; a failure is logged and leaves the others running"""
+        service = self.services[name]
+        if service.running:
+            return True
+        try:
+            await service.start()
+        except Exception as e:
+            print(f"[daemon] {name} failed to start: {e}")
+            return False
+        self._set_up(service, True)
+        print(f"[daemon] {name} started")
+        return True
+
+    async def stop_service(self, name):
+        service = self.services[name]
+        if not service.running:
+            return
+        try:
+            await service.stop()
+        except Exception as e:
+            print(f"[daemon] {name} failed to stop cleanly: {e}")
+        self._set_up(service, False)
+        print(f"[daemon] {name} stopped")
+
+    async def restart_failed(self):
+        for name, service in self.services.items():
+            if not service.running:
+                await self.start_service(name)
+
+    def request_stop(self):
+        self._stop.set()
+
+    async def run(self):
+        """Start every service, wait for SIGINT/SIGTERM, shut everything down"""
+        self.loop = asyncio.get_running_loop()
+        self._stop = asyncio.Event()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            self.loop.add_signal_handler(sig, self.request_stop)
+        self.loop.add_signal_handler(
+            signal.SIGHUP, lambda: self.loop.create_task(self.restart_failed()))
+
+        for name in self.services:
+            await self.start_service(name)
+        await self._stop.wait()
+
+        print("[daemon] shutting down")
+        for name in reversed(list(self.services)):
+            await self.stop_service(name)
+        for name, (obj, close) in reversed(list(self.resources.items())):
+            try:
+                if close:
+                    close(obj)
+            except Exception as e:
+                print(f"[daemon] closing {name} failed: {e}")
+        self.resources.clear()
+        print("[daemon] stopped")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the Pi services in one process")
+    parser.add_argument("--serial", default=SERIAL_PORT, help="motor board port, 'sim' for the emulator")
+    parser.add_argument("--command-port", type=int, default=COMMAND_PORT)
+    parser.add_argument("--framing", default="raw", choices=("raw", "fixed", "length"))
+    parser.add_argument("--media-host", default=MEDIA_HOST, help="media server bind address")
+    parser.add_argument("--media-port", type=int, default=MEDIA_PORT)
+    parser.add_argument("--warm-camera", action="store_true", help="keep the camera streaming for instant photos")
+    parser.add_argument("--metrics-port", type=int, default=METRICS_PORT)
+    parser.add_argument("--no-motor", action="store_true")
+    parser.add_argument("--no-commands", action="store_true")
+    parser.add_argument("--no-media", action="store_true")
+    parser.add_argument("--verbose", action="store_true")
+    args = parser.parse_args()
+
+    if args.command_port == args.media_port and not (args.no_commands or args.no_media):
+        parser.error("the command and media servers need different ports")
+
+    daemon = PiDaemon(verbose=args.verbose)
+    if not args.no_motor:
+        daemon.add(MotorService(daemon, args.serial))
+    if not args.no_commands:
+        daemon.add(CommandService(daemon, args.command_port, args.framing))
+    if not args.no_media:
+        daemon.add(MediaService(daemon, args.media_host, args.media_port, args.warm_camera))
+
+    metrics.serve_http(args.metrics_port)
+    metrics.start_log_reporter()
+    asyncio.run(daemon.run())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,158 @@
+# progressive.py
+# Progressive photo delivery: a downscaled preview JPEG is encoded from the
+# same frame buffer as the full-resolution file, in parallel with it, and
+# goes out as soon as it is written, as file type 0x04 (the name ends in
+# file_transfer.PREVIEW_SUFFIX) so the PC tells it from the photo; on the
+# uplink at PRIORITY_PREVIEW. The full-resolution file follows, or with
+# hold is only offered, so the PC requests or cancels it (uplink OFFER /
+# REQUEST / CANCEL). The PC picks the preview size and quality per photo
+# command:
+#
+#   [0x02][preview width / 32, 0 = no preview][bit 7: hold full file | quality 1-100, 0 = default]
+#
+#   preview = Preview.from_params(param1, param2)
+#   save_request(request, "/.../photo.jpg", preview, on_preview=send)
+#
+#   python progressive.py --bench        # time to first image on an emulated slow link
+
+import os
+import threading
+import time
+
+import metrics
+
+QUALITY = 70          # preview JPEG quality unless the PC asks for another
+HOLD = 0x80           # param2 bit: only offer the full-resolution file
+
+PREVIEW_ENCODE = metrics.histogram("preview_encode_seconds", "Downscale + JPEG encode of a preview")
+
+# simplejpeg colorspace of each Picamera2 main-stream format (Picamera2 names
+# formats by their DRM fourcc, so "RGB888" is B, G, R in memory)
+_COLORSPACES = {"RGB888": "BGR", "BGR888": "RGB", "XBGR8888": "RGBX", "XRGB8888": "BGRX"}
+
+
+class Preview:
+    def __init__(self, width=640, quality=QUALITY, hold=False, path=None):
+        self.width = width
+        self.quality = quality
+        self.hold = hold          # full-resolution file waits for the PC's REQUEST
+        self.path = path          # where the preview JPEG goes
+
+    @classmethod
+    def from_params(cls, param1, param2):
+        """The preview a photo command asks for; None for a plain photo"""
+        if not param1:
+            return None
+        return cls(param1 * 32, (param2 & 0x7F) or QUALITY, bool(param2 & HOLD))
+
+    def __repr__(self):
+        return f"<Preview {self.width}px q{self.quality}{' hold' if self.hold else ''}>"
+
+
+def encode_preview(array, fmt, path, width, quality=QUALITY):
+    """Subsample a main-stream array to about width pixels and write it as JPEG"""
+    import numpy as np
+    import simplejpeg
+    start = time.perf_counter()
+    step = max(1, round(array.shape[1] / width))
+    small = np.ascontiguousarray(array[::step, ::step])
+    data = simplejpeg.encode_jpeg(small, quality=quality, colorspace=_COLORSPACES.get(fmt, "BGR"))
+    with open(path + ".tmp", 'wb') as f:
+        f.write(data)
+    os.replace(path + ".tmp", path)
+    PREVIEW_ENCODE.since(start)
+
+
+def save_request(request, path, preview=None, on_preview=None, fmt="RGB888"):
+    """Save request's main image to path; with a preview, encode that from the
+    same buffer on a second thread and call on_preview(preview.path) at once
+
+    on_preview runs on the preview thread, which this call waits for before
+    the caller can release the buffer: it should only hand the file on.
+    """
+    if preview is None:
+        request.save("main", path)
+        return
+
+    def make_preview():
+        try:
+            encode_preview(request.make_array("main"), fmt, preview.path, preview.width, preview.quality)
+        except Exception as e:
+            print(f"Preview for {path} failed: {e}")
+            return
+        if on_preview:
+            on_preview(preview.path)
+
+    # simplejpeg releases the GIL: both encodes run at the same time
+    thread = threading.Thread(target=make_preview, name="preview", daemon=True)
+    thread.start()
+    try:
+        request.save("main", path)
+    finally:
+        thread.join()   # the buffer is released by the caller only after both are done
+
+
+def _benchmark(full_kb=4096, preview_kb=40, rate=1 << 20, full_encode=0.6, preview_encode=0.02):
+    """Time to first image on the PC: whole file vs preview first, over an
+    uplink whose receiver reads at rate bytes/s. Encoding is simulated with
+    the given times (measure them on the Pi with preview_encode_seconds)."""
+    import tempfile
+
+    from file_transfer import PREVIEW_SUFFIX
+    from uplink import Uplink, UplinkReceiver
+
+    with tempfile.TemporaryDirectory() as tmp:
+        def make(name, kb):
+            path = os.path.join(tmp, name)
+            with open(path, 'wb') as f:
+                f.write(os.urandom(kb << 10))
+            return path
+
+        pc_dir = os.path.join(tmp, "pc")
+        os.makedirs(pc_dir)
+        print(f"{full_kb} KB photo, {preview_kb} KB preview, link {rate / 1e6:.1f} MB/s, "
+              f"encode {full_encode * 1e3:.0f} ms full / {preview_encode * 1e3:.0f} ms preview")
+
+        def first_image(receiver, names):
+            while True:
+                for name, at in receiver.received:
+                    if name in names:
+                        return at
+                time.sleep(0.001)
+
+        for round_ in range(3):
+            full = make(f"photo_{round_}.jpg", full_kb)
+            small = make(f"photo_{round_}{PREVIEW_SUFFIX}", preview_kb)
+            decisions = []
+            receiver = UplinkReceiver(pc_dir, rate=rate, on_offer=lambda name, size: decisions.append(name) or True)
+            uplink = Uplink(receiver.address).start()
+            uplink.send_status(b"hello")   # connection up before timing, as in steady state
+            while not receiver.status:
+                time.sleep(0.001)
+
+            start = time.perf_counter()
+            time.sleep(full_encode)
+            done = uplink.send_file(full)
+            whole = first_image(receiver, {os.path.basename(full)}) - start
+            done.result()
+
+            start = time.perf_counter()
+            time.sleep(preview_encode)
+            preview_done = uplink.send_file(small)   # PRIORITY_PREVIEW by its name
+            time.sleep(full_encode - preview_encode)
+            full_done = uplink.send_file(full, hold=True)
+            progressive = first_image(receiver, {os.path.basename(small)}) - start
+            preview_done.result()
+            full_done.result()
+            complete = time.perf_counter() - start
+            uplink.stop()
+            receiver.close()
+            print(f"  round {round_}: whole file first image {whole * 1e3:7.1f} ms | "
+                  f"preview first image {progressive * 1e3:6.1f} ms, full on request after "
+                  f"{complete * 1e3:7.1f} ms (offers answered {len(decisions)})")
+
+
+if __name__ == "__main__":
+    import sys
+    if "--bench" in sys.argv:
+        _benchmark()
@@ -0,0 +1,420 @@
+# server_bench.py
+# Latency benchmark for the PC -> Pi command servers with fake hardware.
+# Each target server runs in a child process on localhost with
+# FakeHardwareController in place of the camera/light/HDMI controller
+# (picamera2 and gpiozero are stubbed only when they are not installed).
+# N concurrent PC-side clients replay a weighted command mix and the tool
+# reports throughput, p50/p95/p99 latency per command and the response
+# codes, optionally saved as JSON and compared against an earlier run.
+#
+#   targets: tcpfin       tcpfin_test.TCPServer, one 3-byte command per connection
+#            cammon       cammon.TCPServer, 4-byte commands on a kept-open connection
+#            tcp_control  TCP_control.PiCommunicationSystem (threaded), UDP responses
+#            tcp_async    TCP_control.AsyncPiCommunicationSystem
+#
+#   python server_bench.py tcpfin cammon --clients 20 --commands 200 \
+#       --mix light=8,photo=1,hdmi=1 --delay photo=0.02 --fail photo=0.05 \
+#       --json bench.json [--baseline old.json]
+#
+# TCP_control answers over UDP without saying which client a response is
+# for, so its latency is the server's TCP recv -> response queued time.
+
+import argparse
+import asyncio
+import json
+import random
+import signal
+import socket
+import struct
+import subprocess
+import sys
+import threading
+import time
+import types
+
+TCP_PORT = 18180
+UDP_PORT = 18800          # "PC" port for TCP_control responses
+LOCAL_UDP_PORT = 18090
+TARGETS = ("tcpfin", "cammon", "tcp_control", "tcp_async")
+QUANTILES = (0.5, 0.95, 0.99)
+
+# command name -> request bytes, per target
+COMMANDS = {
+    "tcpfin": {
+        "light": lambda: bytes([0x01, random.getrandbits(1), 0]),
+        "photo": lambda: bytes([0x02, 0, 0]),
+        "video": lambda: bytes([0x03, 0, 1]),
+        "audio_rec": lambda: bytes([0x04, 0, 1]),
+        "audio_play": lambda: bytes([0x05, 0, 0]),
+        "audio_stop": lambda: bytes([0x06, 0, 0]),
+        "hdmi": lambda: bytes([0x07, random.getrandbits(1), random.getrandbits(1)]),
+    },
+    "cammon": {
+        "light": lambda: struct.pack('!BBH', 0x01, random.getrandbits(1), 0),
+        "photo": lambda: struct.pack('!BBH', 0x02, 0, 0),
+        "hdmi": lambda: struct.pack('!BBH', 0x03, random.getrandbits(1), random.getrandbits(1)),
+    },
+    "tcp_control": {
+        "light": lambda: bytes([0x03, 0x01, 0x00]),    # LED strip
+        "photo": lambda: bytes([0x02, 0x00, 0x00]),    # camera
+        "hdmi": lambda: bytes([0x01, 0x01, random.getrandbits(1)]),  # display
+    },
+}
+COMMANDS["tcp_async"] = COMMANDS["tcp_control"]
+
+
+# ===== fake hardware (child process) =====
+class FakeHardwareController:
+    """Stands in for HardwareController: optional per-operation delay and failure rate"""
+
+    def __init__(self, delays=None, failures=None):
+        self.delays = delays or {}
+        self.failures = failures or {}
+        self.calls = {}
+        self.recording = False
+        self.light_on = False
+
+    def _op(self, name):
+        self.calls[name] = self.calls.get(name, 0) + 1
+        delay = self.delays.get(name, 0.0)
+        if delay:
+            time.sleep(delay)
+        return random.random() >= self.failures.get(name, 0.0)
+
+    def control_light(self, on):
+        self.light_on = on
+        return self._op("light")
+
+    def control_hdmi(self, port, on):
+        return self._op("hdmi")
+
+    def take_photo(self, at_ns=None, job=None, preview=None):
+        return self._op("photo")
+
+    def start_recording(self, duration, with_audio=False, job=None):
+        return self._op("video")
+
+    def record_audio(self, duration, job=None):
+        return self._op("audio_rec")
+
+    def play_audio(self, filename="test.wav"):
+        return self._op("audio_play")
+
+    def stop_audio(self):
+        return self._op("audio_stop")
+
+    def cleanup(self):
+        pass
+
+
+def _stub_hardware_modules():
+    """Let cammon/tcpfin_test import without a Pi; real modules win if installed"""
+    class _Device:
+        def __init__(self, *args, **kwargs):
+            pass
+
+        def __getattr__(self, name):
+            return lambda *args, **kwargs: None
+
+    for module, attr in (("picamera2", "Picamera2"), ("gpiozero", "LED")):
+        try:
+            __import__(module)
+        except ImportError:
+            stub = sys.modules[module] = types.ModuleType(module)
+            setattr(stub, attr, _Device)
+
+
+def serve(target, delays, failures):
+    """Child process: run one server until SIGTERM, then print its histograms as JSON"""
+    _stub_hardware_modules()
+    import metrics
+    controller = FakeHardwareController(delays, failures)
+    if target == "tcpfin":
+        import tcpfin_test
+        tcpfin_test.PC_IP = "127.0.0.1"
+        server = tcpfin_test.TCPServer(controller, "127.0.0.1", TCP_PORT)
+    elif target == "cammon":
+        import cammon
+        cammon.PC_IP, cammon.PI_IP, cammon.TCP_PORT = "127.0.0.1", "127.0.0.1", TCP_PORT
+        cammon.HardwareController = lambda: controller
+        server = cammon.TCPServer()
+    else:
+        from TCP_control import AsyncPiCommunicationSystem, PiCommunicationSystem
+        cls = AsyncPiCommunicationSystem if target == "tcp_async" else PiCommunicationSystem
+        server = cls(pc_ip="127.0.0.1", recv_port=TCP_PORT, send_port=UDP_PORT,
+                     local_send_port=LOCAL_UDP_PORT, backlog=1024, verbose=False, framing="fixed")
+    signal.signal(signal.SIGTERM, lambda *args: sys.exit(0))
+    server.start()
+    try:
+        signal.pause()
+    finally:
+        server.stop()
+        histograms = {}
+        for metric in list(metrics.REGISTRY.metrics.values()):
+            if isinstance(metric, metrics.Histogram) and metric.count:
+                name = metric.name + metrics._label_text(metric.labels)
+                histograms[name] = dict(count=metric.count, **{
+                    f"p{int(q * 100)}_ms": metric.quantile(q) * 1e3 for q in QUANTILES})
+        print(json.dumps({"server_histograms": histograms, "hardware_calls": controller.calls}),
+              flush=True)
+
+
+# ===== clients (parent process) =====
+def parse_mix(text):
+    """'light=8,photo=1' -> {"light": 8.0, "photo": 1.0}"""
+    mix = {}
+    for part in text.split(","):
+        name, _, weight = part.partition("=")
+        mix[name.strip()] = float(weight or 1)
+    return mix
+
+
+def quantiles(values):
+    values = sorted(values)
+    if not values:
+        return {}
+    pick = lambda q: values[min(len(values) - 1, int(q * len(values)))] * 1e3
+    return dict(count=len(values), **{f"p{int(q * 100)}_ms": pick(q) for q in QUANTILES})
+
+
+class _Run:
+    def __init__(self, target, mix):
+        commands = COMMANDS[target]
+        unknown = set(mix) - set(commands)
+        if unknown:
+            raise SystemExit(f"{target} has no command(s) {', '.join(sorted(unknown))}; "
+                             f"available: {', '.join(commands)}")
+        self.target = target
+        self.names = list(mix)
+        self.weights = [mix[name] for name in self.names]
+        self.commands = commands
+        self.latencies = {name: [] for name in self.names}
+        self.codes = {}       # "name:code" -> count
+        self.errors = {}      # client-side exception -> count
+
+    def pick(self):
+        name = random.choices(self.names, self.weights)[0]
+        return name, self.commands[name]()
+
+    def record(self, name, started, code):
+        self.latencies[name].append(time.perf_counter() - started)
+        key = f"{name}:{code:02X}"
+        self.codes[key] = self.codes.get(key, 0) + 1
+
+    def error(self, e):
+        key = type(e).__name__
+        self.errors[key] = self.errors.get(key, 0) + 1
+
+
+async def _tcpfin_client(run, commands):
+    for _ in range(commands):
+        name, request = run.pick()
+        started = time.perf_counter()
+        try:
+            reader, writer = await asyncio.open_connection("127.0.0.1", TCP_PORT)
+            writer.write(request)
+            response = await reader.read(1)
+            writer.close()
+            if not response:
+                raise ConnectionResetError("no response")
+            run.record(name, started, response[0])
+        except OSError as e:
+            run.error(e)
+
+
+async def _cammon_client(run, commands):
+    reader, writer = await asyncio.open_connection("127.0.0.1", TCP_PORT)
+    try:
+        for _ in range(commands):
+            name, request = run.pick()
+            started = time.perf_counter()
+            writer.write(request)
+            response = await reader.readexactly(4)
+            run.record(name, started, response[0])
+    except (OSError, asyncio.IncompleteReadError) as e:
+        run.error(e)
+    finally:
+        writer.close()
+
+
+async def _tcp_control_client(run, commands, responses):
+    reader, writer = await asyncio.open_connection("127.0.0.1", TCP_PORT)
+    writer.get_extra_info("socket").setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    try:
+        for _ in range(commands):
+            name, request = run.pick()
+            writer.write(request)
+            await writer.drain()
+            run.latencies[name].append(None)    # sent; latency comes from the server
+            await responses.wait_below(50)      # keep the UDP backlog bounded
+    except OSError as e:
+        run.error(e)
+    finally:
+        writer.close()
+
+
+class _UdpResponses:
+    """Collects TCP_control's [cmd][status] responses on a thread"""
+
+    def __init__(self, run):
+        self.run = run
+        self.sent = lambda: sum(len(v) for v in run.latencies.values())
+        self.count = 0
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4 << 20)
+        self.sock.bind(("127.0.0.1", UDP_PORT))
+        self.sock.settimeout(0.1)
+        self.running = True
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while self.running:
+            try:
+                datagram = self.sock.recv(65536)
+            except socket.timeout:
+                continue
+            for i in range(0, len(datagram) - 1, 2):
+                key = f"cmd{datagram[i]:02X}:{datagram[i + 1]:02X}"
+                self.run.codes[key] = self.run.codes.get(key, 0) + 1
+                self.count += 1
+
+    async def wait_below(self, outstanding):
+        while self.sent() - self.count > outstanding:
+            await asyncio.sleep(0.001)
+
+    async def settle(self, timeout=2.0):
+        deadline = time.perf_counter() + timeout
+        while self.count < self.sent() and time.perf_counter() < deadline:
+            await asyncio.sleep(0.01)
+
+    def close(self):
+        self.running = False
+        self._thread.join()
+        self.sock.close()
+
+
+async def _load(run, clients, commands):
+    start = time.perf_counter()
+    if run.target in ("tcp_control", "tcp_async"):
+        responses = _UdpResponses(run)
+        try:
+            await asyncio.gather(*[_tcp_control_client(run, commands, responses) for _ in range(clients)])
+            await responses.settle()
+        finally:
+            responses.close()
+        run.codes["responses_missing"] = responses.sent() - responses.count
+    else:
+        client = _tcpfin_client if run.target == "tcpfin" else _cammon_client
+        await asyncio.gather(*[client(run, commands) for _ in range(clients)])
+    return time.perf_counter() - start
+
+
+def bench(target, clients, commands, mix, delays, failures):
+    spec = json.dumps({"delays": delays, "failures": failures})
+    proc = subprocess.Popen([sys.executable, __file__, "--serve", target, spec],
+                            stdout=subprocess.PIPE, text=True)
+    try:
+        for _ in range(100):
+            try:
+                socket.create_connection(("127.0.0.1", TCP_PORT), timeout=0.1).close()
+                break
+            except OSError:
+                time.sleep(0.05)
+        run = _Run(target, mix)
+        elapsed = asyncio.run(_load(run, clients, commands))
+    finally:
+        proc.terminate()
+        output, _ = proc.communicate(timeout=10)
+    server = {}
+    for line in output.splitlines():
+        if line.startswith("{"):
+            server = json.loads(line)
+
+    done = {name: [v for v in values if v is not None] for name, values in run.latencies.items()}
+    total = sum(len(v) for v in run.latencies.values())
+    result = {
+        "target": target,
+        "commands": total,
+        "elapsed_s": elapsed,
+        "commands_per_s": total / elapsed,
+        "codes": dict(sorted(run.codes.items())),
+        "client_errors": run.errors,
+        "hardware_calls": server.get("hardware_calls", {}),
+        "server_histograms": server.get("server_histograms", {}),
+    }
+    if any(done.values()):
+        result["latency"] = quantiles([v for values in done.values() for v in values])
+        result["latency_by_command"] = {name: quantiles(v) for name, v in done.items()}
+    else:
+        # UDP responses cannot be matched to clients: report the server's view
+        result["latency"] = server.get("server_histograms", {}).get("tcp_to_udp_seconds", {})
+        result["latency_source"] = "server tcp_to_udp_seconds"
+    return result
+
+
+def _print(result):
+    lat = result.get("latency", {})
+    print(f"{result['target']:>11}: {result['commands_per_s']:8,.0f} cmd/s  "
+          f"p50 {lat.get('p50_ms', 0):7.2f} ms  p95 {lat.get('p95_ms', 0):7.2f} ms  "
+          f"p99 {lat.get('p99_ms', 0):7.2f} ms" + (" (server side)" if "latency_source" in result else ""))
+    for name, q in result.get("latency_by_command", {}).items():
+        if q:
+            print(f"{'':>13}{name:<10} n={q['count']:<6} p50 {q['p50_ms']:7.2f}  "
+                  f"p95 {q['p95_ms']:7.2f}  p99 {q['p99_ms']:7.2f} ms")
+    print(f"{'':>13}codes {result['codes']}" +
+          (f"  client errors {result['client_errors']}" if result["client_errors"] else ""))
+
+
+def _compare(results, baseline_path):
+    with open(baseline_path) as f:
+        baseline = {r["target"]: r for r in json.load(f)["results"]}
+    for result in results:
+        old = baseline.get(result["target"])
+        if not old:
+            continue
+        rate = result["commands_per_s"] / old["commands_per_s"] - 1
+        p99 = result["latency"].get("p99_ms", 0) - old["latency"].get("p99_ms", 0)
+        print(f"{result['target']:>11} vs baseline: {rate:+.1%} cmd/s, p99 {p99:+.2f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the Pi command servers")
+    parser.add_argument("targets", nargs="*", default=["tcpfin", "cammon", "tcp_control"],
+                        choices=TARGETS)
+    parser.add_argument("--clients", type=int, default=20)
+    parser.add_argument("--commands", type=int, default=100, help="commands per client")
+    parser.add_argument("--mix", default="light=8,photo=1,hdmi=1")
+    parser.add_argument("--delay", default="", help="fake hardware delays (s), e.g. photo=0.02")
+    parser.add_argument("--fail", default="", help="fake failure rates, e.g. photo=0.05")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", help="save the results to this file")
+    parser.add_argument("--baseline", help="earlier --json output to compare against")
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    mix = parse_mix(args.mix)
+    delays = parse_mix(args.delay) if args.delay else {}
+    failures = parse_mix(args.fail) if args.fail else {}
+    print(f"{args.clients} clients x {args.commands} commands, mix {mix}")
+    results = []
+    for target in args.targets:
+        results.append(bench(target, args.clients, args.commands, mix, delays, failures))
+        _print(results[-1])
+    if args.json:
+        config = dict(vars(args), mix=mix, delays=delays, failures=failures)
+        with open(args.json, "w") as f:
+            json.dump({"time": time.strftime("%Y-%m-%d %H:%M:%S"), "config": config,
+                       "results": results}, f, indent=2)
+        print(f"Saved {args.json}")
+    if args.baseline:
+        _compare(results, args.baseline)
+
+
+if __name__ == "__main__":
+    if "--serve" in sys.argv:
+        i = sys.argv.index("--serve")
+        spec = json.loads(sys.argv[i + 2])
+        serve(sys.argv[i + 1], spec["delays"], spec["failures"])
+    else:
+        main()
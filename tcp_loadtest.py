@@ -0,0 +1,222 @@
+# tcp_loadtest.py
+# Load test for TCP_control.PiCommunicationSystem: threaded vs asyncio server.
+# The server runs in a child process on localhost (responses go to a local
+# UDP port), the PC side is N concurrent asyncio clients. Reports
+# connections/s, commands/s, responses lost and the server's resident memory.
+# With --framing raw, commands the server merged into one recv() show up as
+# missing responses; fixed/length framing decode every command, and with
+# --pipeline N each client writes N commands per segment. --seq turns on
+# response sequence numbers (one per response datagram) and counts the gaps. --window S sets the
+# server's response coalescing window.
+#
+#   python tcp_loadtest.py [connections] [commands per connection]
+#   python tcp_loadtest.py 200 100 --framing length --pipeline 16 --seq
+
+import asyncio
+import signal
+import socket
+import subprocess
+import sys
+import threading
+import time
+import urllib.request
+
+from framing import encode_batch
+from udp_sender import WINDOW
+
+TCP_PORT = 18080
+UDP_PORT = 18800          # "PC" response port
+LOCAL_UDP_PORT = 18090    # server's UDP source port
+METRICS_PORT = 19102      # server's metrics endpoint, read after the run
+COMMAND_INTERVAL = 0.005  # pause between commands on one connection (s)
+COMMANDS = [bytes([0x01, 0x01, 0x01]), bytes([0x02, 0x00, 0x00]), bytes([0x03, 0x01, 0x00])]
+
+
+def serve(mode, framing, seq, window):
+    """Child process: run one server until SIGTERM"""
+    import metrics
+    from TCP_control import AsyncPiCommunicationSystem, PiCommunicationSystem
+
+    cls = AsyncPiCommunicationSystem if mode == "async" else PiCommunicationSystem
+    system = cls(pc_ip="127.0.0.1", recv_port=TCP_PORT, send_port=UDP_PORT,
+                 local_send_port=LOCAL_UDP_PORT, backlog=1024, verbose=False, framing=framing,
+                 response_seq=seq, response_window=window)
+    signal.signal(signal.SIGTERM, lambda *args: sys.exit(0))
+    metrics.serve_http(METRICS_PORT)
+    system.start()
+    try:
+        signal.pause()
+    finally:
+        system.stop()
+
+
+def server_metrics():
+    text = urllib.request.urlopen(f"http://127.0.0.1:{METRICS_PORT}/metrics").read().decode()
+    values = {}
+    for line in text.splitlines():
+        if line and not line.startswith("#"):
+            name, _, value = line.rpartition(" ")
+            values[name] = float(value)
+    return values
+
+
+def rss_kb(pid, field="VmRSS"):
+    with open(f"/proc/{pid}/status") as f:
+        for line in f:
+            if line.startswith(field + ":"):
+                return int(line.split()[1])
+    return 0
+
+
+class _Responses:
+    """Counts UDP responses on its own thread so none are lost to a busy loop"""
+
+    def __init__(self, seq):
+        self.seq = seq
+        self.next_seq = 0
+        self.gaps = 0      # responses the sequence numbers say were lost
+        self.count = 0
+        self.last = None   # perf_counter() of the newest response
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4 << 20)
+        self.sock.bind(("127.0.0.1", UDP_PORT))
+        self.sock.settimeout(0.1)
+        self.running = True
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while self.running:
+            try:
+                datagram = self.sock.recv(65536)
+                if self.seq:
+                    seq = int.from_bytes(datagram[:4], "big")
+                    self.gaps += max(0, seq - self.next_seq)
+                    self.next_seq = seq + 1
+                    datagram = datagram[4:]
+                self.count += 1
+                self.last = time.perf_counter()
+            except socket.timeout:
+                pass
+
+    def close(self):
+        self.running = False
+        self._thread.join()
+        self.sock.close()
+
+
+async def _client(index, commands, connected, go, framing, pipeline):
+    reader, writer = await asyncio.open_connection("127.0.0.1", TCP_PORT)
+    writer.get_extra_info("socket").setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    connected()
+    await go.wait()
+    for i in range(0, commands, pipeline):
+        batch = [COMMANDS[(index + j) % len(COMMANDS)] for j in range(i, min(i + pipeline, commands))]
+        writer.write(encode_batch(framing, batch))
+        await writer.drain()
+        await asyncio.sleep(COMMAND_INTERVAL)
+    return writer
+
+
+async def _load(pid, connections, commands, framing, pipeline, seq):
+    responses = _Responses(seq)
+    go = asyncio.Event()
+    opened = [0]
+    all_open = asyncio.Event()
+
+    def connected():
+        opened[0] += 1
+        if opened[0] == connections:
+            all_open.set()
+
+    start = time.perf_counter()
+    tasks = [asyncio.create_task(_client(i, commands, connected, go, framing, pipeline)) for i in range(connections)]
+    await all_open.wait()
+    connect_time = time.perf_counter() - start
+    rss_connected = rss_kb(pid)
+
+    start = time.perf_counter()
+    go.set()
+    writers = await asyncio.gather(*tasks)
+    expected = connections * commands
+    # wait until the responses stop coming
+    last = -1
+    while responses.count != last and responses.count < expected:
+        last = responses.count
+        await asyncio.sleep(0.3)
+    elapsed = (responses.last or time.perf_counter()) - start
+    for writer in writers:
+        writer.close()
+    responses.close()
+    server = server_metrics()
+    return {
+        "connections_per_s": connections / connect_time,
+        "commands_per_s": server.get("tcp_commands_total", 0) / elapsed,
+        "packets": int(server.get("tcp_packets_total", 0)),
+        "responses": responses.count,
+        "gaps": responses.gaps,
+        "datagrams": int(server.get("udp_responses_total", 0)),
+        "send_calls": int(server.get("udp_send_calls_total", 0)),
+        "wakeups": int(server.get("udp_sender_wakeups_total", 0)),
+        "expected": expected,
+        "rss_kb": rss_connected,
+        "peak_rss_kb": rss_kb(pid, "VmHWM"),
+    }
+
+
+def run(mode, connections, commands, framing="raw", pipeline=1, seq=False, window=None):
+    args = ["--serve", mode, "--framing", framing] + (["--seq"] if seq else [])
+    if window is not None:
+        args += ["--window", str(window)]
+    proc = subprocess.Popen([sys.executable, __file__] + args,
+                            stdout=subprocess.DEVNULL)
+    try:
+        for _ in range(100):
+            try:
+                socket.create_connection(("127.0.0.1", TCP_PORT), timeout=0.1).close()
+                break
+            except OSError:
+                time.sleep(0.05)
+        idle_rss = rss_kb(proc.pid)
+        result = asyncio.run(_load(proc.pid, connections, commands, framing, pipeline, seq))
+        result["idle_rss_kb"] = idle_rss
+        return result
+    finally:
+        proc.terminate()
+        proc.wait()
+
+
+def _option(name, default):
+    return sys.argv[sys.argv.index(name) + 1] if name in sys.argv else default
+
+
+def main():
+    options = {"--framing", "--pipeline", "--window"}
+    args = [a for i, a in enumerate(sys.argv[1:], 1)
+            if not a.startswith("--") and sys.argv[i - 1] not in options]
+    connections = int(args[0]) if args else 200
+    commands = int(args[1]) if len(args) > 1 else 20
+    framing = _option("--framing", "raw")
+    pipeline = int(_option("--pipeline", "1")) if framing != "raw" else 1
+    seq = "--seq" in sys.argv
+    window = _option("--window", None)
+    window = float(window) if window is not None else None
+    print(f"{connections} connections x {commands} commands, {framing} framing, "
+          f"{pipeline} command(s) per write")
+    for mode in ("thread", "async"):
+        r = run(mode, connections, commands, framing, pipeline, seq, window)
+        print(f"{mode:>6}: {r['connections_per_s']:8,.0f} conn/s  {r['commands_per_s']:8,.0f} cmd/s  "
+              f"{r['packets']} recv()s, {r['responses']}/{r['expected']} responses  "
+              f"RSS idle {r['idle_rss_kb'] / 1024:.1f} MB, connected {r['rss_kb'] / 1024:.1f} MB, "
+              f"peak {r['peak_rss_kb'] / 1024:.1f} MB")
+        print(f"        {r['datagrams']} datagrams in {r['send_calls']} send syscalls, "
+              f"{r['wakeups']} sender wakeups" + (f", {r['gaps']} sequence gaps" if seq else ""))
+
+
+if __name__ == "__main__":
+    if "--serve" in sys.argv:
+        window = _option("--window", None)
+        serve(_option("--serve", "thread"), _option("--framing", "raw"), "--seq" in sys.argv,
+              float(window) if window is not None else WINDOW)
+    else:
+        main()
@@ -5,52 +5,121 @@ import struct
 import os
 import time
 import subprocess
+from contextlib import nullcontext
 from picamera2 import Picamera2
 from gpiozero import LED
 
+import file_transfer
+import media_workers
+import metrics
+from burst_capture import BurstCapture
+from job_engine import JobEngine
+from live_stream import LiveStream, RecordingTap, start_camera
+from media_store import KINDS, MediaItem, MediaStore
+from ingest_queue import IngestQueue
+from media_workers import AudioCapture, AudioPlayer
+from progressive import Preview, save_request
+from uplink import Uplink
+from warm_camera import WarmCamera, now_ns
+
 
 PC_IP = '192.168.106.186'    # PC端IP
 PC_PORT = 8800               # PC接收端口
+STREAM_PORT = 8801           # PC端实时视频接收端口 (见 live_stream.py)
 PI_IP = '192.168.106.245'    # 树莓派IP
 TCP_PORT = 8080              # 控制端口
 LED_GPIO = 26                # 灯带控制引脚
 PHOTO_RES = (4608, 2592)     # 拍照分辨率
 VIDEO_RES = (1920, 1080)     # 录像分辨率
 DEFAULT_RECORD_TIME = 30     # 默认录像时长(秒)
+WARM_CAMERA = False          # 摄像头常开, 拍照取最接近指令时刻的缓存帧 (见 warm_camera.py)
 AUDIO_DEVICE = "plughw:CARD=Headphones,DEV=0"
+AUDIO_WORKERS = True         # 常驻 arecord/aplay 进程, 录音/播放无需每次启动 (见 media_workers.py)
 STORAGE_DIR = "/home/Documents"
 PHOTO_DIR = os.path.join(STORAGE_DIR, "photo")
 VIDEO_DIR = os.path.join(STORAGE_DIR, "video")
 AUDIO_DIR = os.path.join(STORAGE_DIR, "audio")
+PREVIEW_DIR = os.path.join(STORAGE_DIR, "preview")   # 预览图, 发送后删除
+PREVIEW_QUEUE = 8            # 非常开模式下等待发送的预览图
+METRICS_PORT = 9103          # Prometheus 指标端口 (http://127.0.0.1:9103/metrics)
+FILE_PROTOCOL = 1            # 1: 原 [类型][大小32位] 文件头, 2: 64位大小+校验+断点续传 (见 file_transfer.py)
+                             # 3: 常驻多路复用上行连接, 照片优先于录像 (见 uplink.py)
+UPLINK_TIMEOUT = 600         # 协议3: 等待PC确认的最长时间(秒)
+ASYNC_JOBS = False           # True: 录像/录音立即返回 [0x00][任务ID 16位], 后台执行 (见 job_engine.py)
+                             # False: 原行为, 完成后才返回1字节结果 (现有PC端)
 
 # ===== 指令定义 (3字节) =====
 CMD_LIGHT      = 0x01  # [0x01][开/关][预留]
-CMD_PHOTO      = 0x02  # [0x02][预留][预留] 
+CMD_PHOTO      = 0x02  # [0x02][预览宽度/32, 0=不要预览][位7: 原图等PC请求 | 预览质量1-100, 0=默认] (见 progressive.py)
 CMD_VIDEO      = 0x03  # [0x03][是否录音][时长(秒)] 
 CMD_AUDIO_REC  = 0x04  # [0x04][预留][时长(秒)]
 CMD_AUDIO_PLAY = 0x05  # [0x05][预留][预留]
 CMD_AUDIO_STOP = 0x06  # [0x06][预留][预留]
 CMD_HDMI       = 0x07  # [0x07][HDMI端口][开/关]
+CMD_JOB_STATUS = 0x08  # [0x08][任务ID高][任务ID低] -> [0x00][状态] 状态见 job_engine (0排队 1运行 2完成 3失败 4取消)
+CMD_JOB_CANCEL = 0x09  # [0x09][任务ID高][任务ID低] -> [0x00]
+CMD_BURST      = 0x0A  # [0x0A][张数, 0=直到取消][间隔(0.1秒), 0=尽快] -> [0x00][任务ID] 连拍/延时摄影, 存于 PHOTO_DIR
+CMD_MEDIA_LIST = 0x0B  # [0x0B][类型 0全部/1照片/2录像/3录音][最多条数] + [起始ns:8][结束ns:8, 0=现在]
+                       # -> [0x00][条数:2] + 每条 [ID:8][时间ns:8][类型:1][任务ID:2][大小:8]
+CMD_MEDIA_FETCH = 0x0C # [0x0C][预留][预留] + [首ID:8][末ID:8] -> [0x00][任务ID], 文件按ID顺序发送
+CMD_STREAM     = 0x0D  # [0x0D][0=停止 1=H.264 2=MJPEG][1=同时本地录制] -> [0x00][任务ID], 实时视频发往 STREAM_PORT
+
+CMD_NAMES = {CMD_LIGHT: "light", CMD_PHOTO: "photo", CMD_VIDEO: "video",
+             CMD_AUDIO_REC: "audio_rec", CMD_AUDIO_PLAY: "audio_play",
+             CMD_AUDIO_STOP: "audio_stop", CMD_HDMI: "hdmi",
+             CMD_JOB_STATUS: "job_status", CMD_JOB_CANCEL: "job_cancel",
+             CMD_BURST: "burst", CMD_MEDIA_LIST: "media_list", CMD_MEDIA_FETCH: "media_fetch",
+             CMD_STREAM: "stream"}
+CMD_ARGS = {CMD_MEDIA_LIST: 16, CMD_MEDIA_FETCH: 16}   # 3字节指令后附带的参数长度
+
+RESP_BUSY = b'\xF7'           # 设备被正在运行的任务占用
+RESP_NO_JOB = b'\xF8'         # 任务不存在或已结束
+JOB_PUSH = struct.Struct('!BHB')  # 完成推送 (协议3上行状态消息): [0x08][任务ID][状态]
+MEDIA_RANGE = struct.Struct('!QQ')
+MEDIA_ENTRY = struct.Struct('!QQBHQ')
+FETCH_LIMIT = 100            # 一次 CMD_MEDIA_FETCH 最多发送的文件数
+STREAM_CODECS = {1: "h264", 2: "mjpeg"}
+LONG_CAMERA_JOBS = ("video", "stream", "burst")   # 拍照遇到这些任务时返回忙, 其他拍照则排队
+
+# ===== 性能指标 =====
+FILE_TRANSFER = metrics.histogram("file_transfer_seconds", "File connect + send time")
+FILE_BYTES = metrics.counter("file_bytes_sent_total", "File bytes sent to the PC")
+FILE_ERRORS = metrics.counter("file_transfer_errors_total", "Failed file transfers")
 
 # ===== 硬件控制类 =====
 class HardwareController:
-    def __init__(self):
-        self.light = LED(LED_GPIO)
-        self.camera = Picamera2()
+    def __init__(self, camera=None, light=None, warm=WARM_CAMERA, audio_workers=AUDIO_WORKERS):
+        # camera/light 可由外部 (pi_daemon) 传入共享, 否则自行打开
+        self.owns_devices = camera is None
+        self.light = light if light is not None else LED(LED_GPIO)
+        self.camera = camera if camera is not None else Picamera2()
         self.audio_process = None
         self.recording = False
+        self.audio_in = AudioCapture(AUDIO_DEVICE).start() if audio_workers else None
+        self.audio_out = AudioPlayer(AUDIO_DEVICE).start() if audio_workers else None
+        self.uplink = None           # 协议3的常驻连接, 首次发送时建立
+        self.warm = None             # 常开模式下的帧缓存
+        self.store = MediaStore(STORAGE_DIR)   # 所有拍摄文件及索引, 按配额自动清理最旧文件
+        # 非常开模式的预览图在此线程发送, 编码线程和摄像头缓冲不等网络 (常开模式用 warm.delivery)
+        self.previews = IngestQueue(PREVIEW_QUEUE, "block", consumer=self._send_previews,
+                                    name="preview_delivery").start()
         self._setup_dirs()
-        self._setup_camera()
+        self._setup_camera(warm)
 
     def _setup_dirs(self):
         os.makedirs(PHOTO_DIR, exist_ok=True)
         os.makedirs(VIDEO_DIR, exist_ok=True)
         os.makedirs(AUDIO_DIR, exist_ok=True)
+        os.makedirs(PREVIEW_DIR, exist_ok=True)
 
-    def _setup_camera(self):
+    def _setup_camera(self, warm=False):
+        controls = {"AwbMode": 0, "ExposureTime": 20000}
+        if warm:
+            self.warm = WarmCamera(self.camera, PHOTO_RES, controls=controls).start()
+            return
         config = self.camera.create_still_configuration(
             main={"size": PHOTO_RES},
-            controls={"AwbMode": 0, "ExposureTime": 20000}
+            controls=controls
         )
         self.camera.configure(config)
 
@@ -59,130 +128,268 @@ class HardwareController:
         self.light.on() if on else self.light.off()
 
     def control_hdmi(self, port, on):
-        cmd = f"xrandr --output HDMI-{port} {'--auto' if on else '--off'}"
-        return os.system(cmd) == 0
+        return media_workers.run(["xrandr", "--output", f"HDMI-{port}", "--auto" if on else "--off"], "xrandr")
 
     # ----- 媒体功能 -----
-    def take_photo(self):
-        filename = os.path.join(PHOTO_DIR, "latest.jpg")
+    def take_photo(self, at_ns=None, job=None, preview=None):
+        item = self.store.reserve("photo", "jpg", job.id if job else 0)
+        hold = bool(preview and preview.hold)
+        if preview:
+            base = os.path.splitext(os.path.basename(item.path))[0]
+            preview.path = os.path.join(PREVIEW_DIR, base + file_transfer.PREVIEW_SUFFIX)   # 文件类型 0x04
+        if self.warm:
+            # 常开模式: 取帧后立即返回, 编码在后台线程, 入库和发送在另一后台线程
+            # 编码失败时删除临时文件 (已回复0x00, 仅记录 warm_camera_save_errors_total)
+            if self.warm.capture(item.tmp, at_ns, on_saved=lambda _: self._store_and_send(item, hold),
+                                 preview=preview, on_preview=self._send_preview,
+                                 on_failed=lambda _: self.store.discard(item)):
+                return True
+            self.store.discard(item)
+            print("拍照失败: 没有可用的缓存帧")
+            return False
         try:
             self.camera.start()
-            self.camera.capture_file(filename)
+            if preview:
+                # 预览图与原图从同一帧缓冲并行编码, 预览图编码完立即交给发送线程
+                request = self.camera.capture_request()
+                try:
+                    save_request(request, item.tmp, preview, self.previews.put,
+                                 self.camera.camera_config["main"]["format"])
+                finally:
+                    request.release()
+            else:
+                self.camera.capture_file(item.tmp)
             self.camera.stop()
-            self._send_file(filename)
+            self._store_and_send(item, hold)
             return True
         except Exception as e:
+            self.store.discard(item)
             print(f"拍照失败: {e}")
             return False
 
-    def start_recording(self, duration, with_audio=False):
+    def _run_process(self, cmd, job=None):
+        # 任务取消时终止子进程 (不经 shell, terminate 直接作用于 ffmpeg/arecord)
+        argv = cmd.split()
+        proc = media_workers.spawn(argv, argv[0])
+        if job: job.on_cancel(proc.terminate)
+        if proc.wait() != 0 and not (job and job.cancelled.is_set()):
+            raise subprocess.CalledProcessError(proc.returncode, cmd)
+
+    def start_recording(self, duration, with_audio=False, job=None):
         if self.recording: return False
         
         ext = "mp4" if with_audio else "mov"
-        filename = os.path.join(VIDEO_DIR, f"latest.{ext}")
+        item = self.store.reserve("video", ext, job.id if job else 0)
+        filename = item.tmp
         try:
             self.recording = True
-            if with_audio:
-                cmd = (
-                    f"ffmpeg -f v4l2 -video_size {VIDEO_RES[0]}x{VIDEO_RES[1]} "
-                    f"-i /dev/video0 -f alsa -i {AUDIO_DEVICE} -t {duration} "
-                    f"-c:v h264 -c:a aac {filename}"
-                )
-                subprocess.run(cmd, shell=True, check=True)
-            else:
-                video_config = self.camera.create_video_configuration(
-                    main={"size": VIDEO_RES}
-                )
-                self.camera.switch_mode_and_capture_file(
-                    video_config, 
-                    filename, 
-                    duration=duration
-                )
-            self._send_file(filename)
-            return True
+            # 常开模式下录像期间暂停帧缓存, 带录音时 ffmpeg 需独占麦克风, 结束后恢复
+            camera_free = self.warm.paused() if self.warm else nullcontext()
+            mic_free = self.audio_in.paused() if with_audio and self.audio_in else nullcontext()
+            with camera_free, mic_free:
+                if with_audio:
+                    cmd = (
+                        f"ffmpeg -f v4l2 -video_size {VIDEO_RES[0]}x{VIDEO_RES[1]} "
+                        f"-i /dev/video0 -f alsa -i {AUDIO_DEVICE} -t {duration} "
+                        f"-c:v h264 -c:a aac {filename}"
+                    )
+                    self._run_process(cmd, job)
+                else:
+                    video_config = self.camera.create_video_configuration(
+                        main={"size": VIDEO_RES}
+                    )
+                    self.camera.switch_mode_and_capture_file(
+                        video_config, 
+                        filename, 
+                        duration=duration
+                    )
+            if job and job.cancelled.is_set():
+                self.store.discard(item)   # 已取消, 不保存不发送
+                return False
+            return self._store_and_send(item)
         except Exception as e:
+            self.store.discard(item)
             print(f"录像失败: {e}")
             return False
         finally:
             self.recording = False
 
-    def record_audio(self, duration):
-        filename = os.path.join(AUDIO_DIR, "latest.wav")
+    def burst(self, count, interval, job=None):
+        # 连拍/延时摄影: 固定节奏取帧, JPEG 编码分摊到多个进程
+        with self.warm.paused() if self.warm else nullcontext():
+            command_id = job.id if job else 0
+            burst = BurstCapture(self.camera, PHOTO_RES, PHOTO_DIR, on_saved=lambda path, ts_ns:
+                                 self.store.add(MediaItem("photo", path, command_id, ts_ns))).start()
+            if job: job.on_cancel(burst.cancel)
+            try:
+                captured, dropped = burst.run(count or None, interval)
+            finally:
+                burst.stop()
+                if not self.warm:
+                    self._setup_camera()   # 恢复拍照配置
+        print(f"连拍完成: {captured} 张, 丢弃 {dropped} 张")
+        return captured > 0
+
+    def stream(self, codec, record, job):
+        # 实时视频: 编码输出边产生边发给PC, 链路跟不上时丢到下一个关键帧; 直到任务取消
+        item = self.store.reserve("video", codec, job.id) if record else None
+        live = LiveStream((PC_IP, STREAM_PORT), codec, VIDEO_RES)
+        tap = RecordingTap(item.tmp) if item else None   # 本地录制不受链路丢帧影响
         try:
-            cmd = f"arecord -D {AUDIO_DEVICE} -d {duration} -f cd {filename}"
-            subprocess.run(cmd, shell=True, check=True)
-            self._send_file(filename)
-            return True
+            with self.warm.paused() if self.warm else nullcontext():
+                start_camera(self.camera, live, tap)
+                try:
+                    job.cancelled.wait()
+                finally:
+                    self.camera.stop_recording()
+                    if not self.warm:
+                        self._setup_camera()   # 恢复拍照配置
+        except Exception as e:
+            if item: self.store.discard(item)
+            print(f"实时视频失败: {e}")
+            return False
+        if item:
+            self.store.commit(item)
+        return True
+
+    def record_audio(self, duration, job=None):
+        item = self.store.reserve("audio", "wav", job.id if job else 0)
+        try:
+            if self.audio_in:
+                # 常驻 arecord 的音频流直接写入文件
+                if not self.audio_in.record(item.tmp, duration, job) and not (job and job.cancelled.is_set()):
+                    raise RuntimeError("arecord 未运行")
+            else:
+                cmd = f"arecord -D {AUDIO_DEVICE} -d {duration} -f cd {item.tmp}"
+                self._run_process(cmd, job)
+            if job and job.cancelled.is_set():
+                self.store.discard(item)
+                return False
+            return self._store_and_send(item)
         except Exception as e:
+            self.store.discard(item)
             print(f"录音失败: {e}")
             return False
 
     def play_audio(self, filename="test.wav"):
         self.stop_audio()
+        # CD格式的 wav 交给常驻 aplay, 其他格式单独启动 aplay
+        if self.audio_out and self.audio_out.play(filename):
+            return True
         try:
-            cmd = f"aplay -D {AUDIO_DEVICE} {filename}"
-            self.audio_process = subprocess.Popen(cmd, shell=True)
+            self.audio_process = media_workers.spawn(["aplay", "-D", AUDIO_DEVICE, filename], "aplay-once")
             return True
         except Exception as e:
             print(f"播放失败: {e}")
             return False
 
     def stop_audio(self):
+        stopped = bool(self.audio_out and self.audio_out.stop_playing())
         if self.audio_process and self.audio_process.poll() is None:
             self.audio_process.terminate()
             self.audio_process.wait()
-            return True
-        return False
+            stopped = True
+        return stopped
 
     # ----- 文件传输 -----
+    def _store_and_send(self, item, hold=False):
+        # 写完的临时文件改名入库, 再发给PC
+        self.store.commit(item)
+        if hold:
+            # 原图只提供给PC (协议3), PC请求后才发送; 其他协议下PC用 CMD_MEDIA_FETCH 取
+            if FILE_PROTOCOL == 3:
+                self.uplink_client().send_file(item.path, hold=True)
+            return True
+        return self._send_file(item.path)
+
+    def _send_preview(self, path):
+        # 预览图文件类型 0x04, PC据此与原图区分; 协议3时以最高文件优先级插队发送, 发完即删
+        if FILE_PROTOCOL == 3:
+            self.uplink_client().send_file(path).add_done_callback(
+                lambda _: os.path.exists(path) and os.remove(path))
+        else:
+            self._send_file(path)
+            os.remove(path)
+
+    def _send_previews(self, paths):
+        for path in paths:
+            self._send_preview(path)
+
+    def send_stored(self, first_id, last_id, job=None):
+        # 按ID范围补发已保存的文件, 返回成功发送的个数
+        sent = 0
+        for item in self.store.range(first_id, last_id, FETCH_LIMIT):
+            if job and job.cancelled.is_set(): break
+            sent += self._send_file(item.path)
+        return sent
+
     def _send_file(self, filepath):
         if not os.path.exists(filepath): return False
         
-        with socket.socket() as sock:
-            try:
-                sock.connect((PC_IP, PC_PORT))
-                with open(filepath, 'rb') as f:
-                    file_data = f.read()
-                
-                # 发送文件头 (类型+大小)
-                file_type = 0x01 if filepath.endswith('.jpg') else \
-                            0x02 if filepath.endswith('.mp4') else \
-                            0x03 if filepath.endswith('.wav') else 0x00
-                
-                sock.sendall(struct.pack('!B I', file_type, len(file_data)))
-                sock.sendall(file_data)
-                return True
-            except Exception as e:
-                print(f"文件发送失败: {e}")
-                return False
+        # 流式发送 (sendfile), 内存占用与文件大小无关
+        start = time.perf_counter()
+        try:
+            if FILE_PROTOCOL == 3:
+                sent = self.uplink_client().send_file(filepath).result(timeout=UPLINK_TIMEOUT)
+            else:
+                sent = file_transfer.send_file(filepath, (PC_IP, PC_PORT), protocol=FILE_PROTOCOL)
+            FILE_BYTES.inc(sent)
+            FILE_TRANSFER.since(start)
+            return True
+        except Exception as e:
+            FILE_ERRORS.inc()
+            print(f"文件发送失败: {e}")
+            return False
+
+    def uplink_client(self):
+        if self.uplink is None:
+            self.uplink = Uplink((PC_IP, PC_PORT)).start()
+        return self.uplink
 
     def cleanup(self):
         self.light.off()
         self.stop_audio()
         if self.recording:
             self.camera.stop_recording()
-        self.camera.close()
+        # 正在编码和排队的照片/预览图先保存发完, 再关闭上行连接
+        if self.warm:
+            self.warm.close()
+        self.previews.stop()
+        if self.uplink:
+            self.uplink.stop()
+        for helper in (self.audio_in, self.audio_out):
+            if helper:
+                helper.stop()
+        if self.owns_devices:
+            self.camera.close()
+        self.store.close()
 
 # ===== TCP服务器 =====
 class TCPServer:
-    def __init__(self):
-        self.controller = HardwareController()
+    def __init__(self, controller=None, host=PI_IP, port=TCP_PORT):
+        self.controller = controller or HardwareController()
+        self.host, self.port = host, port
         self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         self.server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-        self.server_socket.bind((PI_IP, TCP_PORT))
+        self.server_socket.bind((host, port))
         self.server_socket.listen(5)
         self.running = False
+        # 录像/录音等耗时指令在任务线程池中执行, 按摄像头/音频设备加锁
+        self.jobs = JobEngine(on_done=self._job_done)
+        self.stream_job = None       # 正在运行的实时视频任务
 
     def start(self):
         self.running = True
+        self.jobs.start()
         threading.Thread(target=self._accept_connections, daemon=True).start()
-        print(f"服务已启动 {PI_IP}:{TCP_PORT}")
+        print(f"服务已启动 {self.host}:{self.port}")
 
-    # def stop(self):
-    #     self.running = False
-    #     self.server_socket.close()
-    #     self.controller.cleanup()
-    #     print("服务已停止")
+    def stop(self):
+        self.running = False
+        self.server_socket.close()
+        self.jobs.stop()
+        self.controller.cleanup()
+        print("服务已停止")
 
     def _accept_connections(self):
         while self.running:
@@ -205,30 +412,46 @@ class TCPServer:
                 data = conn.recv(3)  # 接收3字节指令
                 if len(data) != 3: return
 
+                received = time.perf_counter()
                 cmd, param1, param2 = struct.unpack('!BBB', data)
-                response = self._process_command(cmd, param1, param2)
+                args = file_transfer.recv_exact(conn, CMD_ARGS[cmd]) if cmd in CMD_ARGS else b''
+                response = self._process_command(cmd, param1, param2, args)
                 conn.sendall(response)
+                # 指令 -> 完成 (含文件传输) 耗时
+                name = CMD_NAMES.get(cmd, "unknown")
+                metrics.histogram("media_command_seconds", "Command -> completion incl. file transfer",
+                                  {"cmd": name}).since(received)
+                metrics.counter("media_commands_total", "Media commands by result",
+                                {"cmd": name, "ok": str(response[:1] == b'\x00').lower()}).inc()
             except Exception as e:
                 print(f"处理指令出错: {e}")
 
-    def _process_command(self, cmd, param1, param2):
+    def _process_command(self, cmd, param1, param2, args=b''):
         if cmd == CMD_LIGHT:
             self.controller.control_light(param1 == 0x01)
             return b'\x00'
         
         elif cmd == CMD_PHOTO:
-            success = self.controller.take_photo()
-            return b'\x00' if success else b'\xF1'
+            # 录像/实时视频/连拍占用摄像头时立即返回忙, 不阻塞连接; 同时的拍照依次执行
+            if self.jobs.busy_with("camera", LONG_CAMERA_JOBS): return RESP_BUSY
+            at = now_ns()   # 常开模式按此时刻选帧
+            preview = Preview.from_params(param1, param2)
+            job = self.jobs.submit("photo", lambda job: self.controller.take_photo(at, job=job, preview=preview),
+                                   ("camera",))
+            job.wait()
+            return b'\x00' if job.result else b'\xF1'
         
         elif cmd == CMD_VIDEO:
             duration = param2 if param2 > 0 else DEFAULT_RECORD_TIME
-            success = self.controller.start_recording(duration, param1 == 0x01)
-            return b'\x00' if success else b'\xF2'
+            with_audio = param1 == 0x01
+            return self._run_job("video", b'\xF2',
+                                 lambda job: self.controller.start_recording(duration, with_audio, job=job),
+                                 ("camera", "audio") if with_audio else ("camera",))
         
         elif cmd == CMD_AUDIO_REC:
             duration = param2 if param2 > 0 else DEFAULT_RECORD_TIME
-            success = self.controller.record_audio(duration)
-            return b'\x00' if success else b'\xF3'
+            return self._run_job("audio_rec", b'\xF3',
+                                 lambda job: self.controller.record_audio(duration, job=job), ("audio",))
         
         elif cmd == CMD_AUDIO_PLAY:
             success = self.controller.play_audio()
@@ -242,11 +465,65 @@ class TCPServer:
             success = self.controller.control_hdmi(param1 + 1, param2 == 0x01)
             return b'\x00' if success else b'\xF6'
         
+        elif cmd == CMD_BURST:
+            # 张数0时运行到取消为止, 不论 ASYNC_JOBS 都立即返回任务ID (供 CMD_JOB_CANCEL)
+            job = self.jobs.submit("burst", lambda job: self.controller.burst(param1, param2 / 10, job=job),
+                                   ("camera",))
+            return b'\x00' + struct.pack('!H', job.id)
+        
+        elif cmd == CMD_MEDIA_LIST:
+            since_ns, until_ns = MEDIA_RANGE.unpack(args)
+            kind = next((k for k, t in KINDS.items() if t == param1), None)
+            items = self.controller.store.list(kind, since_ns, until_ns or None, param2)
+            return b'\x00' + struct.pack('!H', len(items)) + b''.join(
+                MEDIA_ENTRY.pack(i.id, i.ts_ns, KINDS[i.kind], i.command_id & 0xFFFF, i.size) for i in items)
+        
+        elif cmd == CMD_MEDIA_FETCH:
+            first_id, last_id = MEDIA_RANGE.unpack(args)
+            return self._run_job("media_fetch", b'\xF9',
+                                 lambda job: self.controller.send_stored(first_id, last_id, job) > 0, ())
+        
+        elif cmd == CMD_STREAM:
+            if not param1:
+                # 停止实时视频, 同 CMD_JOB_CANCEL 该任务
+                job = self.stream_job
+                return b'\x00' if job and self.jobs.cancel(job.id) else RESP_NO_JOB
+            codec = STREAM_CODECS.get(param1)
+            if codec is None: return b'\xFA'
+            if self.jobs.busy_with("camera"): return RESP_BUSY
+            # 运行到停止为止, 不论 ASYNC_JOBS 都立即返回任务ID
+            self.stream_job = self.jobs.submit("stream", lambda job: self.controller.stream(codec, param2 == 0x01, job),
+                                               ("camera",))
+            return b'\x00' + struct.pack('!H', self.stream_job.id)
+        
+        elif cmd == CMD_JOB_STATUS:
+            job = self.jobs.get(param1 << 8 | param2)
+            return b'\x00' + bytes([job.state]) if job else RESP_NO_JOB
+        
+        elif cmd == CMD_JOB_CANCEL:
+            return b'\x00' if self.jobs.cancel(param1 << 8 | param2) else RESP_NO_JOB
+        
         else:
             return b'\xFE'  # 未知指令
 
+    # ----- 后台任务 -----
+    def _run_job(self, kind, error, func, resources):
+        job = self.jobs.submit(kind, func, resources)
+        if ASYNC_JOBS:
+            return b'\x00' + struct.pack('!H', job.id)
+        job.wait()
+        return b'\x00' if job.result else error
+
+    def _job_done(self, job):
+        print(f"任务 {job.id} ({job.kind}) {job.state_name}")
+        # 协议3时通过常驻上行连接主动推送, 否则PC用 CMD_JOB_STATUS 轮询
+        if ASYNC_JOBS and FILE_PROTOCOL == 3 and job.kind != "photo":
+            self.controller.uplink_client().send_status(JOB_PUSH.pack(CMD_JOB_STATUS, job.id, job.state))
+
 if __name__ == "__main__":
     server = TCPServer()
+    metrics.serve_http(METRICS_PORT)
+    metrics.start_log_reporter()
     try:
         server.start()
         while True: time.sleep(1)
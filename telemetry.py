@@ -0,0 +1,158 @@
+# telemetry.py
+# Numeric telemetry store for the motor board's $MAll / $MTEP / $MSPD frames.
+# Every motor channel of every frame type gets a preallocated, fixed-capacity
+# ring buffer (stdlib array, no per-sample objects), so hours of data fit in
+# bounded memory and statistics never re-parse strings.
+
+import time
+from array import array
+
+MOTORS = 4
+DEFAULT_CAPACITY = 65536  # samples kept per motor and frame type
+
+# frame prefix -> kind name
+FRAME_KINDS = {
+    b"$MAll:": "MAll",   # total encoder count
+    b"$MTEP:": "MTEP",   # encoder count per sampling period
+    b"$MSPD:": "MSPD",   # wheel speed (mm/s)
+}
+
+
+def decode_frame(frame):
+    """Return (kind, values) for a telemetry frame, or None if it is not one"""
+    if isinstance(frame, str):
+        frame = frame.encode()
+    frame = frame.strip()
+    kind = FRAME_KINDS.get(frame[:6])
+    if kind is None or not frame.endswith(b"#"):
+        return None
+    try:
+        values = [float(v) for v in frame[6:-1].split(b",")]
+    except ValueError:
+        return None
+    return kind, values
+
+
+class RingBuffer:
+    """Fixed-capacity (timestamp, value) ring backed by two double arrays"""
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.times = array("d", bytes(8 * capacity))
+        self.values = array("d", bytes(8 * capacity))
+        self.count = 0
+        self._next = 0
+
+    def __len__(self):
+        return self.count
+
+    def append(self, timestamp, value):
+        i = self._next
+        self.times[i] = timestamp
+        self.values[i] = value
+        self._next = (i + 1) % self.capacity
+        if self.count < self.capacity:
+            self.count += 1
+
+    def _slot(self, i):
+        """Array index of the i-th oldest stored sample"""
+        return (self._next - self.count + i) % self.capacity
+
+    def last(self, n):
+        """Up to n newest samples as (timestamp, value), oldest first"""
+        n = min(n, self.count)
+        return [(self.times[s], self.values[s])
+                for s in map(self._slot, range(self.count - n, self.count))]
+
+    def first_since(self, timestamp):
+        """Logical index of the oldest sample taken at or after timestamp"""
+        lo, hi = 0, self.count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.times[self._slot(mid)] < timestamp:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+
+class TelemetryStore:
+    def __init__(self, capacity=DEFAULT_CAPACITY, motors=MOTORS):
+        self.motors = motors
+        self.channels = {
+            kind: [RingBuffer(capacity) for _ in range(motors)]
+            for kind in FRAME_KINDS.values()
+        }
+        self.rejected = 0
+
+    def add_frame(self, frame, timestamp=None):
+        """Decode a board frame and store it; returns False if it was not telemetry"""
+        decoded = decode_frame(frame)
+        if decoded is None:
+            self.rejected += 1
+            return False
+        self.add(*decoded, timestamp=timestamp)
+        return True
+
+    def add(self, kind, values, timestamp=None):
+        if timestamp is None:
+            timestamp = time.monotonic()
+        for ring, value in zip(self.channels[kind], values):
+            ring.append(timestamp, value)
+
+    def _ring(self, kind, motor):
+        """motor is 1-based (M1..M4), like the board's own labels"""
+        return self.channels[kind][motor - 1]
+
+    # ----- queries -----
+    def last(self, kind, motor, n=1):
+        """Newest n samples of one motor as (timestamp, value), oldest first"""
+        return self._ring(kind, motor).last(n)
+
+    def latest(self, kind):
+        """Newest value of every motor, or None before the first frame"""
+        rings = self.channels[kind]
+        if not rings[0].count:
+            return None
+        return [ring.values[ring._slot(ring.count - 1)] for ring in rings]
+
+    def window_average(self, kind, motor, seconds, now=None):
+        """Mean value over the last `seconds`, or None if there is no sample"""
+        ring = self._ring(kind, motor)
+        now = time.monotonic() if now is None else now
+        start = ring.first_since(now - seconds)
+        if start >= ring.count:
+            return None
+        total = 0.0
+        for i in range(start, ring.count):
+            total += ring.values[ring._slot(i)]
+        return total / (ring.count - start)
+
+    def rate(self, kind, motor, seconds, now=None):
+        """Change of the value per second over the last `seconds`
+
+        For MAll (cumulative encoder count) this is the encoder rate in
+        counts/s. Returns None with fewer than two samples in the window.
+        """
+        ring = self._ring(kind, motor)
+        now = time.monotonic() if now is None else now
+        start = ring.first_since(now - seconds)
+        if ring.count - start < 2:
+            return None
+        first, last = ring._slot(start), ring._slot(ring.count - 1)
+        elapsed = ring.times[last] - ring.times[first]
+        if elapsed <= 0:
+            return None
+        return (ring.values[last] - ring.values[first]) / elapsed
+
+    def sample_rate(self, kind, seconds, now=None):
+        """Frames per second received for this kind over the last `seconds`"""
+        ring = self.channels[kind][0]
+        now = time.monotonic() if now is None else now
+        return (ring.count - ring.first_since(now - seconds)) / seconds
+
+    def memory_bytes(self):
+        return sum(
+            ring.times.itemsize * ring.capacity + ring.values.itemsize * ring.capacity
+            for rings in self.channels.values() for ring in rings
+        )
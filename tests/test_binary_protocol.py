@@ -0,0 +1,28 @@
+import pytest
+
+from binary_protocol import (INT16_MAX, INT16_MIN, MSG_PWM, MSG_SPD, BinaryFrameParser,
+                             encode_motor)
+
+
+def _decode(frame):
+    (msg_type, values), = BinaryFrameParser().feed(frame)
+    return msg_type, list(values)
+
+
+def test_speeds_at_the_int16_limits_pass_unchanged():
+    assert _decode(encode_motor([INT16_MAX, INT16_MIN, 0, -1])) == (MSG_SPD, [INT16_MAX, INT16_MIN, 0, -1])
+
+
+@pytest.mark.parametrize("speed, expected", [(INT16_MAX + 1, INT16_MAX), (INT16_MIN - 1, INT16_MIN),
+                                             (10**9, INT16_MAX), (-10**9, INT16_MIN)])
+def test_speeds_beyond_int16_are_clamped(speed, expected):
+    assert _decode(encode_motor([speed] * 4)) == (MSG_SPD, [expected] * 4)
+
+
+def test_pwm_doubling_is_clamped():
+    assert _decode(encode_motor([20000, -20000, 16383, 100], motor_type=4)) == (
+        MSG_PWM, [INT16_MAX, INT16_MIN, 32766, 200])
+
+
+def test_float_speeds_are_truncated_like_ints():
+    assert _decode(encode_motor([100.7, -100.7, 0.0, 5])) == (MSG_SPD, [100, -100, 0, 5])
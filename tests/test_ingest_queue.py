@@ -0,0 +1,28 @@
+import time
+
+import pytest
+
+from ingest_queue import IngestQueue
+
+
+def test_block_without_consumer_or_timeout_is_rejected():
+    with pytest.raises(ValueError):
+        IngestQueue(4, "block")
+
+
+def test_block_with_timeout_drops_after_waiting():
+    queue = IngestQueue(1, "block", block_timeout=0.05)
+    assert queue.put(1)
+    start = time.perf_counter()
+    assert not queue.put(2)
+    assert time.perf_counter() - start >= 0.05
+    assert queue.stats()["dropped"] == 1
+
+
+def test_block_with_consumer_makes_room():
+    seen = []
+    queue = IngestQueue(1, "block", consumer=seen.extend).start()
+    for i in range(50):
+        assert queue.put(i)
+    queue.stop()
+    assert seen == list(range(50))
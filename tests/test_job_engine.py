@@ -0,0 +1,47 @@
+import threading
+
+from job_engine import DONE, QUEUED, RUNNING, JobEngine
+
+
+def _blocking(release):
+    return lambda job: release.wait(5) and True
+
+
+def test_camera_job_starts_while_deviceless_jobs_fill_the_pool():
+    release = threading.Event()
+    engine = JobEngine(workers=2).start()
+    try:
+        fetches = [engine.submit("media_fetch", _blocking(release)) for _ in range(3)]
+        assert [job.state for job in fetches] == [RUNNING, RUNNING, QUEUED]
+
+        photo = engine.submit("photo", lambda job: True, ("camera",))
+        assert photo.wait(2) and photo.state == DONE
+
+        release.set()
+        assert all(job.wait(2) for job in fetches)
+    finally:
+        release.set()
+        engine.stop()
+
+
+def test_device_is_busy_as_soon_as_submit_returns():
+    release = threading.Event()
+    engine = JobEngine().start()
+    try:
+        stream = engine.submit("stream", _blocking(release), ("camera",))
+        assert stream.state == RUNNING and engine.busy_with("camera")
+        assert engine.busy_with("camera", ("stream",)) and not engine.busy_with("camera", ("photo",))
+        video = engine.submit("video", lambda job: True, ("camera",))
+        assert video.state == QUEUED
+        release.set()
+        assert video.wait(2) and video.state == DONE
+    finally:
+        release.set()
+        engine.stop()
+
+
+def test_stop_cancels_running_jobs():
+    engine = JobEngine().start()
+    job = engine.submit("audio", lambda job: job.cancelled.wait(5), ("audio",))
+    engine.stop()
+    assert job.wait(0) and job.state_name == "cancelled"
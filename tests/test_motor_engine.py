@@ -0,0 +1,76 @@
+import os
+import select
+import threading
+import time
+
+import metrics
+from motor_engine import MotorChannel, MotorEngine, format_motor_frame, parameter_frames
+from transport import PtyTransport
+
+
+def _read_until(fd, expected, timeout=2.0):
+    buffer = b""
+    deadline = time.monotonic() + timeout
+    while expected not in buffer:
+        remaining = deadline - time.monotonic()
+        assert remaining > 0, f"{expected!r} not in {buffer!r}"
+        if select.select([fd], [], [], remaining)[0]:
+            buffer += os.read(fd, 4096)
+    return buffer
+
+
+def test_failed_port_is_reopened_without_stopping_other_channels():
+    healthy, failing = PtyTransport(), PtyTransport()
+    reopened = []
+
+    def reopen():
+        reopened.append(PtyTransport())
+        return reopened[-1]
+
+    engine = MotorEngine(keepalive_interval=60.0)
+    car1 = engine.add_channel(healthy, name="car1")
+    car2 = engine.add_channel(failing, name="car2", setup=["$upload:1,0,0#"], reopen=reopen)
+    thread = threading.Thread(target=engine.run, daemon=True)
+    thread.start()
+    try:
+        _read_until(failing.board_fd, b"$upload:1,0,0#")
+        os.close(failing.board_fd)        # board unplugged; the engine closes the host side
+
+        for i in range(1, 20):
+            engine.submit([i] * 4, channel=car1)
+            _read_until(healthy.board_fd, format_motor_frame([i] * 4, 1).encode())
+            time.sleep(0.01)
+        assert thread.is_alive()
+
+        deadline = time.monotonic() + 3.0
+        while not reopened and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert reopened, "failed port was never reopened"
+        # configuration and a stop frame go out again on the new port
+        _read_until(reopened[0].board_fd, b"$upload:1,0,0#" + format_motor_frame([0] * 4, 1).encode())
+        engine.submit([7] * 4, channel=car2)
+        _read_until(reopened[0].board_fd, format_motor_frame([7] * 4, 1).encode())
+        assert car2.port_errors.value == 1
+    finally:
+        engine.stop()
+        thread.join(2.0)
+        engine.close()
+        for port in [healthy] + reopened:
+            port.close()
+
+
+def test_parameter_frames_match_the_board_order():
+    assert parameter_frames(1) == ["$mtype:1#", "$mphase:30#", "$mline:11#", "$wdiameter:67.0#",
+                                   "$deadzone:1600#"]
+    assert parameter_frames(4) == ["$mtype:4#", "$mphase:48#", "$deadzone:1000#"]
+
+
+def test_recreated_channel_takes_over_its_gauges():
+    first = MotorChannel(PtyTransport(), name="gauge-car")
+    second = MotorChannel(PtyTransport(), name="gauge-car")
+    second.writer.bytes_sent = 42
+    first.writer.bytes_sent = 1
+    gauge = metrics.gauge("serial_bytes_sent", labels={"channel": "gauge-car"})
+    assert gauge.fn() == 42
+    for channel in (first, second):
+        channel.port.close()
@@ -0,0 +1,48 @@
+import pytest
+
+from payload_decoder import PayloadDecoder, TIMING_SAMPLE, encode_binary
+
+
+@pytest.fixture(params=[False, True], ids=["json", "orjson"])
+def decoder(request):
+    if request.param:
+        pytest.importorskip("orjson")
+    return PayloadDecoder(use_orjson=request.param)
+
+
+def test_decodes_json_and_binary(decoder):
+    command = decoder.decode(b'{"power": 1, "movespeed": 0.5, "movex": -0.25, "seq": 7}')
+    assert command == (1, 0.5, -0.25, 7)
+    assert command.seq == 7
+    assert decoder.decode(b' {"power": 0} \n') == (0, 0.0, 1.0, None)
+    assert decoder.decode(encode_binary(1, 0.5, -0.25, 9)) == (1, 0.5, -0.25, 9)
+    assert decoder.stats()["decoded"] == 3
+
+
+@pytest.mark.parametrize("payload", [
+    b'{"power": 1e999}',
+    b'{"power": Infinity}',
+    b'{"power": NaN}',
+    b'{"power": 1, "seq": 1e999}',
+    b'{"power": 1} trailing',
+    b'{"power": "x"}',
+    b"\xff\xfe",
+    b"",
+])
+def test_rejects_malformed(decoder, payload):
+    assert decoder.decode(payload) is None
+    assert decoder.errors == {"malformed": 1}
+
+
+def test_rejects_non_finite_and_non_objects(decoder):
+    assert decoder.decode(encode_binary(1, float("inf"), 0.0)) is None
+    assert decoder.decode(b"[1, 2]") is None
+    assert decoder.errors == {"not finite": 1, "not an object": 1}
+
+
+def test_decode_time_is_sampled(decoder):
+    payload = b'{"power": 1, "movespeed": 0.5, "movex": 0.0}'
+    for _ in range(2 * (TIMING_SAMPLE + 1)):
+        decoder.decode(payload)
+    assert decoder.timed == 2
+    assert decoder.stats()["avg_decode_us"] > 0
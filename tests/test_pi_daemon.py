@@ -0,0 +1,39 @@
+import asyncio
+import socket
+
+from pi_daemon import MediaService, PiDaemon
+from server_bench import _stub_hardware_modules
+
+_stub_hardware_modules()   # real picamera2/gpiozero win when installed
+import tcpfin_test  # noqa: E402
+
+
+class Controller:
+    instances = []
+
+    def __init__(self, camera, light, warm):
+        self.cleaned_up = False
+        Controller.instances.append(self)
+
+    def cleanup(self):
+        self.cleaned_up = True
+
+
+def test_media_service_cleans_up_the_controller_when_the_port_is_taken(monkeypatch):
+    monkeypatch.setattr(tcpfin_test, "HardwareController", Controller)
+    taken = socket.socket()
+    taken.bind(("127.0.0.1", 0))
+    taken.listen()
+    daemon = PiDaemon()
+    daemon.resources = {"camera": (object(), None), "light": (object(), None)}
+    daemon.add(MediaService(daemon, "127.0.0.1", taken.getsockname()[1]))
+
+    async def start_twice():
+        daemon.loop = asyncio.get_running_loop()
+        return [await daemon.start_service("media"), await daemon.start_service("media")]
+
+    try:
+        assert asyncio.run(start_twice()) == [False, False]
+    finally:
+        taken.close()
+    assert [c.cleaned_up for c in Controller.instances] == [True, True]
@@ -0,0 +1,48 @@
+import socket
+
+import pytest
+
+from framing import new_decoder
+from TCP_control import AsyncPiCommunicationSystem, PiCommunicationSystem
+
+
+def test_start_raises_when_serving_fails():
+    system = AsyncPiCommunicationSystem(pc_ip="127.0.0.1", recv_port=0, send_port=0,
+                                        local_send_port=0, verbose=False)
+    system.recv_socket.close()   # start_server() on it fails inside the loop thread
+    with pytest.raises(OSError):
+        system.start()
+    system.stop()
+
+
+def test_start_and_stop():
+    system = AsyncPiCommunicationSystem(pc_ip="127.0.0.1", recv_port=0, send_port=0,
+                                        local_send_port=0, verbose=False)
+    system.start()
+    assert system._server is not None
+    system.stop()
+
+
+@pytest.mark.parametrize("framing, records, expected", [
+    ("fixed", b"\x01\x01\x00\x03\x00\x00\x07\x00\x00",
+     [b"\x01\x00", b"\x03\x00", b"\xff\xff"]),
+    ("length", b"\x00\x03\x01\x01\x00\x00\x01\x03",
+     [b"\x00\x02\x01\x00", b"\x00\x02\x03\x00"]),
+])
+def test_one_datagram_per_response(framing, records, expected):
+    pc = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    pc.bind(("127.0.0.1", 0))
+    pc.settimeout(2)
+    system = PiCommunicationSystem(pc_ip="127.0.0.1", recv_port=0,
+                                   send_port=pc.getsockname()[1], local_send_port=0,
+                                   verbose=False, framing=framing, response_seq=True)
+    system.data_queue.start()
+    system.sender.start()
+    try:
+        system._on_packet(records, new_decoder(framing))
+        datagrams = [pc.recv(64) for _ in expected]
+    finally:
+        system.stop()
+        pc.close()
+    assert [d[:4] for d in datagrams] == [i.to_bytes(4, "big") for i in range(len(expected))]
+    assert [d[4:] for d in datagrams] == expected
@@ -0,0 +1,65 @@
+import struct
+import threading
+import time
+
+import pytest
+
+import job_engine
+from server_bench import _stub_hardware_modules
+
+_stub_hardware_modules()   # real picamera2/gpiozero win when installed
+import tcpfin_test  # noqa: E402
+
+
+class Controller:
+    """Just enough HardwareController for the job commands"""
+
+    def take_photo(self, at_ns=None, job=None, preview=None):
+        time.sleep(0.1)
+        return True
+
+    def burst(self, count, interval, job=None):
+        job.cancelled.wait(count * interval if count else None)   # 0: until cancelled
+        return True
+
+    def cleanup(self):
+        pass
+
+
+@pytest.fixture
+def server():
+    server = tcpfin_test.TCPServer(Controller(), "127.0.0.1", 0)
+    server.start()
+    yield server
+    server.stop()
+
+
+def test_timelapse_returns_job_id_and_can_be_cancelled(server):
+    start = time.perf_counter()
+    response = server._process_command(tcpfin_test.CMD_BURST, 0, 10)
+    assert time.perf_counter() - start < 0.5
+    assert response[:1] == b'\x00' and len(response) == 3
+    job_id, = struct.unpack('!H', response[1:])
+    assert server._process_command(tcpfin_test.CMD_JOB_STATUS, job_id >> 8, job_id & 0xFF) == \
+        b'\x00' + bytes([job_engine.RUNNING])
+    assert server._process_command(tcpfin_test.CMD_JOB_CANCEL, job_id >> 8, job_id & 0xFF) == b'\x00'
+    job = server.jobs.get(job_id)
+    assert job.wait(2)
+    assert job.state == job_engine.CANCELLED
+
+
+def test_concurrent_photos_both_succeed(server):
+    responses = []
+    photos = [threading.Thread(target=lambda: responses.append(
+        server._process_command(tcpfin_test.CMD_PHOTO, 0, 0))) for _ in range(2)]
+    for photo in photos:
+        photo.start()
+    for photo in photos:
+        photo.join(5)
+    assert responses == [b'\x00', b'\x00']
+
+
+def test_photo_is_busy_during_a_burst(server):
+    job_id, = struct.unpack('!H', server._process_command(tcpfin_test.CMD_BURST, 0, 10)[1:])
+    assert server._process_command(tcpfin_test.CMD_PHOTO, 0, 0) == tcpfin_test.RESP_BUSY
+    server.jobs.cancel(job_id)
@@ -0,0 +1,34 @@
+import socket
+import time
+
+from udp_sender import ResponseSender
+
+
+class OfflineOnceSocket(socket.socket):
+    """UDP socket whose first connect() fails like an unreachable PC"""
+    attempts = 0
+
+    def connect(self, address):
+        self.attempts += 1
+        if self.attempts == 1:
+            raise OSError(101, "Network is unreachable")
+        super().connect(address)
+
+
+def test_offline_pc_does_not_stop_the_sender():
+    pc = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    pc.bind(("127.0.0.1", 0))
+    pc.settimeout(2)
+    sock = OfflineOnceSocket(socket.AF_INET, socket.SOCK_DGRAM)
+    sender = ResponseSender(sock, pc.getsockname(), window=0, sequence=True).start()
+    try:
+        sender.send(b"\x01\x00")     # dropped: the PC is not reachable yet
+        deadline = time.monotonic() + 2
+        while sock.attempts < 1 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        sender.send(b"\x02\x00")
+        assert pc.recv(64) == b"\x00\x00\x00\x01\x02\x00"   # the gap shows in the sequence
+    finally:
+        sender.stop()
+        sock.close()
+        pc.close()
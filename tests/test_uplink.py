@@ -0,0 +1,45 @@
+import os
+
+import pytest
+
+import uplink
+from file_transfer import TransferError
+from uplink import Uplink, UplinkReceiver
+
+
+def _make(directory, name, size):
+    path = os.path.join(directory, name)
+    with open(path, 'wb') as f:
+        f.write(os.urandom(size))
+    return path
+
+
+@pytest.mark.parametrize("attempt", range(5))
+def test_cancel_mid_transfer_keeps_other_streams(tmp_path, attempt):
+    pi_dir, pc_dir = tmp_path / "pi", tmp_path / "pc"
+    pi_dir.mkdir()
+    pc_dir.mkdir()
+    cancelled = _make(pi_dir, "cancelled.mov", 8 << 20)
+    others = [_make(pi_dir, "other.mov", 4 << 20),
+              _make(pi_dir, "photo_1.jpg", 1 << 20),
+              _make(pi_dir, "photo_2.jpg", 1 << 20)]
+    receiver = UplinkReceiver(str(pc_dir), cancel_after={"cancelled.mov": 3 * uplink.CHUNK_SIZE})
+    link = Uplink(receiver.address).start()
+    restarts = uplink.RESTARTS.value
+    try:
+        futures = [link.send_file(cancelled)] + [link.send_file(path) for path in others]
+        with pytest.raises(TransferError, match="cancelled"):
+            futures[0].result(timeout=30)
+        for path, future in zip(others, futures[1:]):
+            assert future.result(timeout=30) == os.path.getsize(path)
+            with open(path, 'rb') as a, open(pc_dir / os.path.basename(path), 'rb') as b:
+                assert a.read() == b.read()
+    finally:
+        link.stop()
+        receiver.close()
+    # one connection, no stream started over
+    assert receiver.connections == 1
+    assert uplink.RESTARTS.value == restarts
+    assert sorted(name for name, _ in receiver.opened) == sorted(
+        os.path.basename(p) for p in [cancelled] + others)
+    assert not os.path.exists(pc_dir / "cancelled.mov")
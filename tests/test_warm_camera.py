@@ -0,0 +1,69 @@
+import threading
+import time
+
+import warm_camera
+from warm_camera import WarmCamera, now_ns
+
+
+class Request:
+    def __init__(self):
+        self.released = False
+
+    def get_metadata(self):
+        return {"SensorTimestamp": now_ns()}
+
+    def release(self):
+        self.released = True
+
+
+class Camera:
+    """Streams a fake request every 10 ms"""
+
+    def create_still_configuration(self, **kwargs):
+        return kwargs
+
+    def configure(self, config):
+        pass
+
+    def start(self):
+        pass
+
+    def stop(self):
+        pass
+
+    def capture_request(self):
+        time.sleep(0.01)
+        return Request()
+
+
+def fake_save_request(request, path, preview=None, on_preview=None, fmt="RGB888"):
+    # like progressive.save_request: on_preview runs on a thread the save waits for
+    if preview is not None:
+        thread = threading.Thread(target=on_preview, args=(path + ".preview",))
+        thread.start()
+        thread.join()
+
+
+def test_slow_preview_delivery_does_not_hold_up_the_encoder(monkeypatch):
+    monkeypatch.setattr(warm_camera, "save_request", fake_save_request)
+    release = threading.Event()
+    saved, previews = [], []
+    warm = WarmCamera(Camera(), (64, 48)).start()
+    try:
+        def slow_preview(path):
+            previews.append(path)
+            release.wait(5)   # a transfer to a slow PC
+
+        for name in ("a", "b", "c"):
+            assert warm.capture(name, preview=object(), on_preview=slow_preview,
+                                on_saved=saved.append, timeout=1)
+        deadline = time.monotonic() + 2
+        while len(warm.delivery) < 5 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert len(warm.encoder) == 0   # all three encoded while the first preview is stuck
+        release.set()
+    finally:
+        release.set()
+        warm.close()
+    assert previews == ["a.preview", "b.preview", "c.preview"]
+    assert saved == ["a", "b", "c"]
@@ -0,0 +1,109 @@
+# transport.py
+# Byte transports for the motor board link.
+# Everything above this layer (MotorEngine, CommandWriter, control.py) only
+# needs fileno() / read() / write() / in_waiting, so the real USB serial
+# port and a pseudo-terminal stand-in are interchangeable.
+
+import array
+import fcntl
+import os
+import pty
+import termios
+import tty
+
+try:
+    import serial
+except ImportError:  # pyserial is only needed for real hardware
+    serial = None
+
+SERIAL_PORT = '/dev/ttyUSB0'
+BAUDRATE = 115200
+
+
+class FdTransport:
+    """Transport over an already open, raw file descriptor"""
+
+    def __init__(self, fd, name=None):
+        self.fd = fd
+        self.name = name or f"fd:{fd}"
+
+    def fileno(self):
+        return self.fd
+
+    @property
+    def in_waiting(self):
+        count = array.array("i", [0])
+        fcntl.ioctl(self.fd, termios.FIONREAD, count)
+        return count[0]
+
+    def read(self, size=1):
+        return os.read(self.fd, size)
+
+    def write(self, data):
+        view = memoryview(data)
+        while view:
+            n = os.write(self.fd, view)
+            view = view[n:]
+        return len(data)
+
+    def close(self):
+        os.close(self.fd)
+
+
+class PtyTransport(FdTransport):
+    """Serial stand-in backed by a pseudo-terminal
+
+    The host uses this object like the serial port; the other end of the
+    pty (``board_fd``) plays the role of the motor board, e.g. for
+    board_emulator.BoardEmulator.
+    """
+
+    def __init__(self):
+        self.board_fd, fd = pty.openpty()
+        tty.setraw(fd)
+        tty.setraw(self.board_fd)
+        super().__init__(fd, os.ttyname(fd))
+
+    def close(self):
+        super().close()
+        os.close(self.board_fd)
+
+
+class SerialTransport:
+    """The real motor board on a USB serial port (pyserial)"""
+
+    def __init__(self, port=SERIAL_PORT, baudrate=BAUDRATE):
+        if serial is None:
+            raise RuntimeError("pyserial is required for a hardware serial port")
+        self.name = port
+        self.ser = serial.Serial(
+            port=port,
+            baudrate=baudrate,
+            parity=serial.PARITY_NONE,
+            stopbits=serial.STOPBITS_ONE,
+            bytesize=serial.EIGHTBITS,
+            timeout=1
+        )
+
+    def fileno(self):
+        return self.ser.fileno()
+
+    @property
+    def in_waiting(self):
+        return self.ser.in_waiting
+
+    def read(self, size=1):
+        return self.ser.read(size)
+
+    def write(self, data):
+        return self.ser.write(data)
+
+    def close(self):
+        self.ser.close()
+
+
+def open_transport(port=SERIAL_PORT, baudrate=BAUDRATE):
+    """Open a device path, or "pty" for an unattached pseudo-terminal"""
+    if port == "pty":
+        return PtyTransport()
+    return SerialTransport(port, baudrate)
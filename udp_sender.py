@@ -0,0 +1,186 @@
+# udp_sender.py
+# Response sender for TCP_control: one thread owns a connected UDP socket and
+# sends whatever responses were queued within a short coalescing window in
+# one go, using sendmmsg() on Linux (one syscall for the whole batch) and a
+# plain send() loop elsewhere. Every response stays its own datagram.
+# Optionally each datagram is prefixed with a 32-bit sequence number
+# (network order) so the PC can detect lost responses. The socket is
+# connected to the PC on the first send, not in the constructor, so a PC
+# that is offline cannot keep the server from starting; while connecting
+# fails, responses are dropped and counted as send errors.
+#
+#   sender = ResponseSender(sock, ("192.168.106.186", 8800), window=0.001)
+#   sender.start(); sender.send(b"\x01\x00"); sender.stop()
+
+import ctypes
+import ctypes.util
+import os
+import struct
+import threading
+
+import metrics
+
+WINDOW = 0.0005     # s to wait for more responses after the first one
+MAX_BATCH = 64      # datagrams per batch / sendmmsg() call
+_SEQ = struct.Struct("!I")
+
+RESPONSES = metrics.counter("udp_responses_total", "Response datagrams sent to the PC")
+SEND_CALLS = metrics.counter("udp_send_calls_total", "send()/sendmmsg() syscalls for responses")
+WAKEUPS = metrics.counter("udp_sender_wakeups_total", "Times the response sender thread woke up")
+SEND_ERRORS = metrics.counter("udp_send_errors_total", "Failed UDP response sends")
+
+
+class _iovec(ctypes.Structure):
+    _fields_ = [("iov_base", ctypes.c_void_p), ("iov_len", ctypes.c_size_t)]
+
+
+class _msghdr(ctypes.Structure):
+    _fields_ = [("msg_name", ctypes.c_void_p), ("msg_namelen", ctypes.c_uint32),
+                ("msg_iov", ctypes.POINTER(_iovec)), ("msg_iovlen", ctypes.c_size_t),
+                ("msg_control", ctypes.c_void_p), ("msg_controllen", ctypes.c_size_t),
+                ("msg_flags", ctypes.c_int)]
+
+
+class _mmsghdr(ctypes.Structure):
+    _fields_ = [("msg_hdr", _msghdr), ("msg_len", ctypes.c_uint)]
+
+
+def _load_sendmmsg():
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        sendmmsg = libc.sendmmsg
+    except (OSError, AttributeError, TypeError):
+        return None
+    sendmmsg.argtypes = [ctypes.c_int, ctypes.c_void_p, ctypes.c_uint, ctypes.c_int]
+    sendmmsg.restype = ctypes.c_int
+    return sendmmsg
+
+
+_sendmmsg = _load_sendmmsg()
+
+
+class ResponseSender:
+    def __init__(self, sock, address, window=WINDOW, max_batch=MAX_BATCH,
+                 sequence=False, use_sendmmsg=True, verbose=False):
+        self.sock = sock
+        self.address = address
+        self.window = window
+        self.max_batch = max_batch
+        self.sequence = sequence
+        self.verbose = verbose
+        self.next_seq = 0
+        self.pending = []
+        self.running = False
+        self._cond = threading.Condition()
+        self._thread = None
+        self._sendmmsg = _sendmmsg if use_sendmmsg else None
+        # preallocated sendmmsg() arguments, reused for every batch
+        self._iov = (_iovec * max_batch)()
+        self._msgs = (_mmsghdr * max_batch)()
+        for i in range(max_batch):
+            self._msgs[i].msg_hdr.msg_iov = ctypes.pointer(self._iov[i])
+            self._msgs[i].msg_hdr.msg_iovlen = 1
+        self.connected = False   # fixed peer once connected: no address per send, ICMP errors reported
+
+    def start(self):
+        self.running = True
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """Send what is still queued and stop the thread"""
+        with self._cond:
+            self.running = False
+            self._cond.notify()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+
+    def send(self, data):
+        """Queue one response datagram; thread-safe and never blocks on the network"""
+        with self._cond:
+            self.pending.append(data)
+            if len(self.pending) == 1 or len(self.pending) >= self.max_batch:
+                self._cond.notify()
+
+    def send_many(self, datagrams):
+        """Queue several response datagrams at once, in order"""
+        with self._cond:
+            was_empty = not self.pending
+            self.pending.extend(datagrams)
+            if was_empty or len(self.pending) >= self.max_batch:
+                self._cond.notify()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self.pending or not self.running)
+                if self.window and self.running and len(self.pending) < self.max_batch:
+                    # let responses from the same burst of commands catch up
+                    self._cond.wait_for(lambda: len(self.pending) >= self.max_batch
+                                        or not self.running, self.window)
+                batch, self.pending = self.pending, []
+            WAKEUPS.inc()
+            if not batch:
+                return   # stopped and drained
+            for i in range(0, len(batch), self.max_batch):
+                self._send_batch(batch[i:i + self.max_batch])
+
+    def _send_batch(self, batch):
+        if self.sequence:
+            seq = self.next_seq
+            batch = [_SEQ.pack((seq + i) & 0xFFFFFFFF) + data for i, data in enumerate(batch)]
+            self.next_seq = (seq + len(batch)) & 0xFFFFFFFF
+        if not self.connected and not self._connect():
+            SEND_ERRORS.inc(len(batch))   # the PC is unreachable; retried with the next batch
+            return
+        if self._sendmmsg and len(batch) > 1:
+            sent = self._send_mmsg(batch)
+        else:
+            sent = self._send_loop(batch)
+        RESPONSES.inc(sent)
+        if self.verbose and sent:
+            print(f"Sent {sent} response(s) to {self.address[0]}:{self.address[1]}")
+
+    def _connect(self):
+        try:
+            self.sock.connect(self.address)
+        except OSError as e:
+            print(f"Failed to send response: {str(e)}")
+            return False
+        self.connected = True
+        return True
+
+    def _send_mmsg(self, batch):
+        buffers = [ctypes.create_string_buffer(data, len(data)) for data in batch]
+        for i, buf in enumerate(buffers):
+            self._iov[i].iov_base = ctypes.addressof(buf)
+            self._iov[i].iov_len = len(batch[i])
+        fd = self.sock.fileno()
+        msgs = ctypes.addressof(self._msgs)
+        done = failed = 0
+        while done < len(batch):
+            SEND_CALLS.inc()
+            n = self._sendmmsg(fd, msgs + done * ctypes.sizeof(_mmsghdr), len(batch) - done, 0)
+            if n < 0:
+                # the datagram at `done` failed; skip it like a lost packet
+                SEND_ERRORS.inc()
+                print(f"Failed to send response: {os.strerror(ctypes.get_errno())}")
+                done += 1
+                failed += 1
+                continue
+            done += n
+        return done - failed
+
+    def _send_loop(self, batch):
+        sent = 0
+        for data in batch:
+            SEND_CALLS.inc()
+            try:
+                self.sock.send(data)
+                sent += 1
+            except OSError as e:
+                SEND_ERRORS.inc()
+                print(f"Failed to send response: {str(e)}")
+        return sent
@@ -0,0 +1,497 @@
+# uplink.py
+# One long-lived Pi -> PC connection carrying every media file and status
+# message, instead of a new TCP connection (connect + slow start) per file.
+# Files are split into streams of DATA frames; the scheduler always sends
+# the next frame of the most urgent stream (status < preview < photo <
+# audio < video, oldest first within a priority), so a photo overtakes a
+# running video after at most one chunk; TCP_NOTSENT_LOWAT keeps the kernel
+# from queueing far ahead of those decisions. Each stream has a credit
+# window the PC refills as it writes the data (flow control); the
+# connection is re-established automatically and unfinished streams start
+# over on the new one. A held stream is only offered: its data follows when
+# the PC asks for it (progressive photos send the preview, then offer the
+# full-resolution file).
+#
+#   frame: [type:1][stream:4][length:4][payload]
+#   Pi -> PC  OPEN    [file_type:1][priority:1][size:8][crc32:4][name]
+#             OFFER   as OPEN, but DATA waits for a REQUEST
+#             DATA    file bytes
+#             END     -
+#             STATUS  opaque payload (stream 0)
+#   PC -> Pi  WINDOW  [increment:4]   more credit for the stream
+#             ACK     [status:1]      0x00 stored and checksum ok
+#             CANCEL  -               the PC does not want this stream
+#             REQUEST -               send the data of an offered stream
+#
+#   uplink = Uplink((PC_IP, PC_PORT)).start()
+#   uplink.send_file("/home/Documents/photo/latest.jpg").result()
+#   python uplink.py --bench        # photo burst during a video transfer
+
+import os
+import socket
+import struct
+import threading
+import time
+from concurrent.futures import Future
+
+import metrics
+from file_transfer import TransferError, file_crc32, file_type, recv_exact
+
+CHUNK_SIZE = 64 * 1024          # largest DATA frame: bounds how long a photo waits
+INITIAL_WINDOW = 1024 * 1024    # per-stream credit before the PC's first WINDOW
+TIMEOUT = 10.0
+MAX_BACKOFF = 5.0               # s between reconnect attempts, at most
+OFFER_TTL = 600.0               # s an offered file waits for the PC's REQUEST
+NOTSENT_LOWAT = 2 * CHUNK_SIZE  # unsent bytes the kernel may hold beyond the scheduler
+
+OPEN, DATA, END, STATUS, OFFER = 0x01, 0x02, 0x03, 0x04, 0x05
+WINDOW, ACK, CANCEL, REQUEST = 0x81, 0x82, 0x83, 0x84
+_FRAME = struct.Struct("!BII")
+_OPEN = struct.Struct("!BBQI")
+_WINDOW = struct.Struct("!I")
+_MSG_MORE = getattr(socket, "MSG_MORE", 0)
+_NOTSENT_LOWAT = getattr(socket, "TCP_NOTSENT_LOWAT", None)
+
+PRIORITY_STATUS, PRIORITY_PREVIEW, PRIORITY_PHOTO, PRIORITY_AUDIO, PRIORITY_VIDEO = 0, 1, 2, 3, 4
+PRIORITY_NAMES = {PRIORITY_STATUS: "status", PRIORITY_PREVIEW: "preview", PRIORITY_PHOTO: "photo",
+                  PRIORITY_AUDIO: "audio", PRIORITY_VIDEO: "video"}
+OFFERED = metrics.counter("uplink_offers_total", "Files offered to the PC (sent on request)")
+
+CONNECTS = metrics.counter("uplink_connects_total", "Uplink connections established")
+DROPS = metrics.counter("uplink_drops_total", "Uplink connections lost")
+FRAMES = metrics.counter("uplink_frames_total", "Frames sent on the uplink")
+BYTES = metrics.counter("uplink_bytes_total", "Bytes sent on the uplink")
+RESTARTS = metrics.counter("uplink_stream_restarts_total", "Streams restarted after a drop")
+
+
+def default_priority(path):
+    kind = file_type(path)
+    if kind == 0x04:
+        return PRIORITY_PREVIEW
+    if kind == 0x01 or path.endswith(('.jpeg', '.png')):
+        return PRIORITY_PHOTO
+    if kind == 0x03:
+        return PRIORITY_AUDIO
+    return PRIORITY_VIDEO
+
+
+class _Stream:
+    def __init__(self, path, priority, hold=False, ttl=OFFER_TTL):
+        self.id = None          # assigned when queued
+        self.path = path
+        self.name = os.path.basename(path).encode()
+        self.size = os.path.getsize(path)
+        self.crc = file_crc32(path)
+        self.priority = priority
+        self.held = hold        # only offered until the PC sends REQUEST
+        self.expires = time.perf_counter() + ttl if hold else None
+        self.future = Future()
+        self.submitted = time.perf_counter()
+        self.file = None
+        self.reset()
+
+    def reset(self):
+        self.opened = False
+        self.ended = False
+        self.offset = 0
+        self.credit = INITIAL_WINDOW
+
+    def close(self):
+        if self.file:
+            self.file.close()
+            self.file = None
+
+
+class Uplink:
+    def __init__(self, address, chunk_size=CHUNK_SIZE, timeout=TIMEOUT):
+        self.address = address
+        self.chunk_size = chunk_size
+        self.timeout = timeout
+        self.streams = {}       # id -> _Stream until the PC acks it
+        self.status = []        # pending status payloads
+        self.sock = None
+        self.running = False
+        self.closing = []       # finished streams whose file the writer still has to close
+        self._next_id = 1
+        self._cond = threading.Condition()
+        self._thread = None
+
+    # ----- API -----
+    def start(self):
+        self.running = True
+        self._thread = threading.Thread(target=self._run, name="uplink", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        with self._cond:
+            self.running = False
+            self._cond.notify_all()
+        if self._thread:
+            self._thread.join()
+        self._disconnect(self.sock, dropped=False)
+        with self._cond:
+            for stream in list(self.streams.values()):
+                self._finish(stream, TransferError("uplink stopped"))
+            self._close_finished_locked()
+
+    def send_file(self, path, priority=None, hold=False, ttl=OFFER_TTL):
+        """Queue a file; returns a Future resolved with its size once the PC acks it
+
+        hold=True only offers the file: its data is sent when the PC requests
+        it, and the Future fails if the PC cancels or ttl seconds pass.
+        """
+        priority = default_priority(path) if priority is None else priority
+        stream = _Stream(path, priority, hold, ttl)   # reads the file for its CRC: not under the lock
+        with self._cond:
+            stream.id = self._next_id
+            self._next_id += 1
+            self.streams[stream.id] = stream
+            self._cond.notify_all()
+        return stream.future
+
+    def send_status(self, payload):
+        """Queue a small message; it goes out ahead of any file data"""
+        with self._cond:
+            self.status.append(bytes(payload))
+            self._cond.notify_all()
+
+    def pending(self):
+        with self._cond:
+            return len(self.streams) + len(self.status)
+
+    # ----- writer -----
+    def _run(self):
+        backoff = 0.1
+        while self.running:
+            if self.sock is None:
+                try:
+                    self._connect()
+                    backoff = 0.1
+                except OSError as e:
+                    print(f"Uplink to {self.address[0]}:{self.address[1]} failed: {e}")
+                    with self._cond:
+                        self._cond.wait(backoff)
+                    backoff = min(backoff * 2, MAX_BACKOFF)
+                    continue
+            sock = self.sock
+            work = self._next_work(sock)
+            if work is None:
+                continue
+            try:
+                self._send(sock, *work)
+            except OSError as e:
+                print(f"Uplink connection lost: {e}")
+                self._disconnect(sock)
+
+    def _connect(self):
+        sock = socket.create_connection(self.address, self.timeout)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        if _NOTSENT_LOWAT is not None:
+            # a preview must not queue behind megabytes already handed to the kernel
+            sock.setsockopt(socket.IPPROTO_TCP, _NOTSENT_LOWAT, NOTSENT_LOWAT)
+        with self._cond:
+            self.sock = sock
+        CONNECTS.inc()
+        threading.Thread(target=self._read, args=(sock,), name="uplink-reader", daemon=True).start()
+
+    def _disconnect(self, sock, dropped=True):
+        """Drop sock (if still current); unfinished streams start over"""
+        with self._cond:
+            if sock is None or sock is not self.sock:
+                return
+            self.sock = None
+            for stream in self.streams.values():
+                if stream.opened:
+                    RESTARTS.inc()
+                stream.reset()
+            self._cond.notify_all()
+        if dropped:
+            DROPS.inc()
+        try:
+            sock.close()
+        except OSError:
+            pass
+
+    def _next_work(self, sock):
+        """Block until there is a frame to send on sock; None if that changed"""
+        with self._cond:
+            # between frames: nothing of a finished stream is being sent any more
+            self._close_finished_locked()
+            while self.running and self.sock is sock:
+                if self.status:
+                    return STATUS, 0, self.status.pop(0)
+                best = None
+                now = time.perf_counter()
+                expiry = None
+                for stream in list(self.streams.values()):
+                    if stream.held and stream.opened:
+                        if now >= stream.expires:
+                            self._finish(stream, TransferError(f"PC never requested {stream.path}"))
+                        else:
+                            expiry = min(expiry or stream.expires, stream.expires)
+                        continue
+                    ready = (not stream.opened or (stream.offset < stream.size and stream.credit > 0)
+                             or (stream.offset == stream.size and not stream.ended))
+                    # oldest first within a priority: the first photo of a burst
+                    # completes first instead of all of them completing last
+                    if ready and (best is None or (stream.priority, stream.id) < (best.priority, best.id)):
+                        best = stream
+                if best is None:
+                    self._cond.wait(None if expiry is None else expiry - now)
+                    continue
+                if not best.opened:
+                    best.opened = True
+                    if best.held:
+                        OFFERED.inc()
+                        return OFFER, best.id, best
+                    return OPEN, best.id, best
+                if best.offset < best.size:
+                    count = min(self.chunk_size, best.credit, best.size - best.offset)
+                    offset = best.offset
+                    best.offset += count
+                    best.credit -= count
+                    return DATA, best.id, (best, offset, count)
+                best.ended = True
+                return END, best.id, best
+            return None
+
+    def _send(self, sock, kind, stream_id, work):
+        if kind == STATUS:
+            self._frame(sock, STATUS, 0, work)
+        elif kind in (OPEN, OFFER):
+            work.close()
+            work.file = open(work.path, 'rb')
+            payload = _OPEN.pack(file_type(work.path), work.priority, work.size, work.crc) + work.name
+            self._frame(sock, kind, stream_id, payload)
+        elif kind == DATA:
+            stream, offset, count = work
+            # MSG_MORE: the header leaves in the same segment as the data
+            sock.sendall(_FRAME.pack(DATA, stream_id, count), _MSG_MORE)
+            sent = sock.sendfile(stream.file, offset, count)
+            if sent != count:
+                raise ConnectionError(f"{stream.path} shrank while sending")
+            FRAMES.inc()
+            BYTES.inc(_FRAME.size + count)
+        else:
+            self._frame(sock, END, stream_id, b"")
+
+    def _frame(self, sock, kind, stream_id, payload):
+        sock.sendall(_FRAME.pack(kind, stream_id, len(payload)) + payload)
+        FRAMES.inc()
+        BYTES.inc(_FRAME.size + len(payload))
+
+    # ----- reader -----
+    def _read(self, sock):
+        try:
+            while True:
+                kind, stream_id, length = _FRAME.unpack(recv_exact(sock, _FRAME.size))
+                payload = recv_exact(sock, length)
+                with self._cond:
+                    stream = self.streams.get(stream_id)
+                    if stream is None:
+                        continue
+                    if kind == WINDOW:
+                        stream.credit += _WINDOW.unpack(payload)[0]
+                        self._cond.notify_all()
+                    elif kind == ACK:
+                        ok = payload[:1] == b"\x00"
+                        self._finish(stream, None if ok else
+                                     TransferError(f"PC rejected {stream.path} ({payload.hex()})"))
+                    elif kind == CANCEL:
+                        self._finish(stream, TransferError(f"PC cancelled {stream.path}"))
+                    elif kind == REQUEST and stream.held:
+                        stream.held = False
+                        self._cond.notify_all()
+        except (OSError, ConnectionError):
+            self._disconnect(sock)
+
+    def _finish(self, stream, error):
+        """Called with the lock held; the writer closes the file between frames"""
+        self.streams.pop(stream.id, None)
+        self.closing.append(stream)
+        if stream.future.done():
+            return
+        if error:
+            stream.future.set_exception(error)
+        else:
+            metrics.histogram("uplink_file_seconds", "send_file() -> acked by the PC",
+                              {"priority": PRIORITY_NAMES.get(stream.priority, "other")}
+                              ).since(stream.submitted)
+            stream.future.set_result(stream.size)
+
+    def _close_finished_locked(self):
+        while self.closing:
+            self.closing.pop().close()
+
+
+# ===== PC side (reference receiver, used by the benchmark) =====
+class UplinkReceiver:
+    """Accepts uplink connections and stores the files in directory"""
+
+    def __init__(self, directory, host="127.0.0.1", port=0, drop_after=None, rate=None, on_offer=None,
+                 cancel_after=None):
+        self.directory = directory
+        self.server = socket.socket()
+        if rate:
+            # small receive window: the sender sees the emulated link speed
+            self.server.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 64 * 1024)
+        self.server.bind((host, port))
+        self.server.listen()
+        self.address = self.server.getsockname()
+        self.received = []          # (name, perf_counter() when stored)
+        self.status = []
+        self.drop_after = drop_after  # close the first connection after this many bytes
+        self.rate = rate              # bytes/s read from the connection (slow link emulation)
+        self.on_offer = on_offer      # callable(name, size) -> True request, False cancel
+        self.cancel_after = cancel_after or {}   # name -> cancel that file once this many bytes arrived
+        self.opened = []              # (name, connection number) per OPEN/OFFER seen
+        self.connections = 0
+        threading.Thread(target=self._accept, daemon=True).start()
+
+    def close(self):
+        self.server.close()
+
+    def _accept(self):
+        while True:
+            try:
+                conn, _ = self.server.accept()
+            except OSError:
+                return
+            threading.Thread(target=self._serve, args=(conn,), daemon=True).start()
+
+    def _serve(self, conn):
+        # WINDOW/ACK frames are tiny: without NODELAY Nagle holds them for a delayed ACK
+        conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.connections += 1
+        streams = {}    # id -> [file, size, crc, received, path, name]
+        data_bytes = 0
+        view = memoryview(bytearray(CHUNK_SIZE))
+        with conn:
+            try:
+                while True:
+                    kind, stream_id, length = _FRAME.unpack(recv_exact(conn, _FRAME.size))
+                    if kind == DATA:
+                        entry = streams.get(stream_id)   # None: cancelled, the rest of the chunk is dropped
+                        remaining = length
+                        while remaining:
+                            n = conn.recv_into(view[:min(remaining, len(view), self.rate or len(view))])
+                            if not n:
+                                raise ConnectionError("uplink closed")
+                            if entry:
+                                entry[0].write(view[:n])
+                            remaining -= n
+                            if self.rate:
+                                time.sleep(n / self.rate)
+                        data_bytes += length
+                        if entry is None:
+                            continue
+                        entry[3] += length
+                        if entry[3] >= self.cancel_after.get(entry[5], entry[1] + 1):
+                            streams.pop(stream_id)[0].close()
+                            os.remove(entry[4] + ".part")
+                            conn.sendall(_FRAME.pack(CANCEL, stream_id, 0))
+                            continue
+                        conn.sendall(_FRAME.pack(WINDOW, stream_id, _WINDOW.size) + _WINDOW.pack(length))
+                        if self.drop_after is not None and data_bytes >= self.drop_after:
+                            self.drop_after = None
+                            return
+                        continue
+                    payload = recv_exact(conn, length)
+                    if kind == STATUS:
+                        self.status.append(payload)
+                    elif kind in (OPEN, OFFER):
+                        _, _, size, crc, = _OPEN.unpack_from(payload)
+                        name = os.path.basename(payload[_OPEN.size:].decode())
+                        self.opened.append((name, self.connections))
+                        path = os.path.join(self.directory, name)
+                        streams[stream_id] = [open(path + ".part", 'wb'), size, crc, 0, path, name]
+                        if kind == OFFER:
+                            want = self.on_offer(name, size) if self.on_offer else True
+                            if want is not None:
+                                if not want:
+                                    streams.pop(stream_id)[0].close()
+                                    os.remove(path + ".part")
+                                conn.sendall(_FRAME.pack(REQUEST if want else CANCEL, stream_id, 0))
+                    elif kind == END:
+                        f, size, crc, received, path, name = streams.pop(stream_id)
+                        f.close()
+                        ok = received == size and file_crc32(path + ".part") == crc
+                        if ok:
+                            os.replace(path + ".part", path)
+                            self.received.append((name, time.perf_counter()))
+                        conn.sendall(_FRAME.pack(ACK, stream_id, 1) + (b"\x00" if ok else b"\x01"))
+            except (OSError, ConnectionError):
+                pass
+            finally:
+                for entry in streams.values():
+                    entry[0].close()
+
+
+def _benchmark(photos=20, photo_kb=1024, video_mb=200):
+    """Photo-by-photo burst (each sent before the next) with and without a video
+    transfer running, one connection per file vs the uplink"""
+    import tempfile
+
+    import file_transfer
+
+    with tempfile.TemporaryDirectory() as tmp:
+        def make(name, kb):
+            path = os.path.join(tmp, name)
+            with open(path, 'wb') as f:
+                f.write(os.urandom(kb << 10))
+            return path
+
+        video = make("video.mp4", video_mb << 10)
+        photo_paths = [make(f"photo_{i:02d}.jpg", photo_kb) for i in range(photos)]
+        pc_dir = os.path.join(tmp, "pc")
+        os.makedirs(pc_dir)
+
+        def burst(send, with_video, drop=None):
+            video_done = None
+            if with_video:
+                video_done = threading.Thread(target=send, args=(video,))
+                video_done.start()
+                time.sleep(0.05)
+            latencies = []
+            for path in photo_paths:
+                begin = time.perf_counter()
+                send(path)
+                latencies.append(time.perf_counter() - begin)
+            if video_done:
+                video_done.join()
+            latencies.sort()
+            return latencies[len(latencies) // 2] * 1e3, latencies[-1] * 1e3
+
+        for with_video in (False, True):
+            label = "during video" if with_video else "idle link"
+            server, _ = file_transfer.serve_receiver(pc_dir)
+            per_connection = burst(lambda p: file_transfer.send_file(p, server.getsockname()), with_video)
+            server.close()
+            receiver = UplinkReceiver(pc_dir)
+            uplink = Uplink(receiver.address).start()
+            uplink.send_file(photo_paths[0]).result()   # connection already up, as in steady state
+            shared = burst(lambda p: uplink.send_file(p).result(), with_video)
+            uplink.stop()
+            receiver.close()
+            print(f"{photos} x {photo_kb} KB photos, {label:>12}: "
+                  f"per-connection p50 {per_connection[0]:6.1f} ms max {per_connection[1]:6.1f} ms | "
+                  f"uplink p50 {shared[0]:6.1f} ms max {shared[1]:6.1f} ms")
+
+        # connection dropped a quarter into the video: streams restart on a new connection
+        receiver = UplinkReceiver(pc_dir, drop_after=(video_mb << 20) // 4)
+        uplink = Uplink(receiver.address).start()
+        start = time.perf_counter()
+        futures = [uplink.send_file(video)] + [uplink.send_file(p) for p in photo_paths]
+        ok = all(future.result() for future in futures)
+        print(f"with a dropped connection: all {len(futures)} files delivered={ok} in "
+              f"{time.perf_counter() - start:.2f} s; connects {CONNECTS.value}, drops {DROPS.value}, "
+              f"stream restarts {RESTARTS.value}")
+        uplink.stop()
+        receiver.close()
+
+
+if __name__ == "__main__":
+    import sys
+    if "--bench" in sys.argv:
+        _benchmark()
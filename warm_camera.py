@@ -0,0 +1,174 @@
+# warm_camera.py
+# Zero-shutter-lag stills for tcpfin_test. Instead of start() / capture_file()
+# / stop() per photo (sensor start-up, AE/AWB convergence and buffer
+# allocation every time) the camera keeps streaming full-resolution frames
+# and a capture thread holds the newest RING of them as completed libcamera
+# requests, without copying. A photo picks the held frame whose sensor
+# timestamp is nearest the command's and hands it to an encoder thread, so
+# the command itself costs at most one frame time. on_saved and on_preview
+# (storing and sending the files) run on a separate delivery thread, so a
+# slow transfer never holds up the encoder and with it the next photo. Every held frame is a
+# camera buffer: buffer_count = RING + ENCODE_QUEUE + 2 (one frame being
+# encoded, one being filled by the sensor); at 4608x2592 RGB888 that is
+# ~36 MB each, so the CMA pool must allow for it.
+#
+#   warm = WarmCamera(picam2, (4608, 2592)).start()
+#   warm.capture("photo.jpg", now_ns(), on_saved=send, on_failed=discard)
+#   with warm.paused(): picam2.switch_mode_and_capture_file(...)
+#   warm.close()   # at shutdown, before whatever on_saved sends through
+
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+import metrics
+from ingest_queue import IngestQueue
+from progressive import save_request
+
+RING = 2            # recent frames held for zero-shutter-lag capture
+ENCODE_QUEUE = 1    # selected frames waiting for the encoder
+FRAME_WAIT = 0.5    # s to wait for a frame exposed after the command
+DELIVERY_QUEUE = 64 # saved photos and previews waiting for on_saved/on_preview (transfers)
+
+FRAMES = metrics.counter("warm_camera_frames_total", "Frames delivered by the running camera")
+PHOTOS = metrics.counter("warm_camera_photos_total", "Photos taken from the frame ring")
+SELECT = metrics.histogram("warm_camera_select_seconds", "Photo command -> frame picked from the ring")
+OFFSET = metrics.histogram("warm_camera_frame_offset_seconds", "Distance of the picked frame from the command")
+ENCODE = metrics.histogram("warm_camera_encode_seconds", "JPEG encode + save of a picked frame")
+ERRORS = metrics.counter("warm_camera_save_errors_total", "Picked frames whose encode or save failed")
+
+
+def now_ns():
+    """Command timestamp on libcamera's SensorTimestamp clock (CLOCK_BOOTTIME)"""
+    return time.clock_gettime_ns(time.CLOCK_BOOTTIME)
+
+
+class WarmCamera:
+    def __init__(self, camera, size, ring=RING, controls=None):
+        self.camera = camera
+        self.size = size
+        self.ring_size = ring
+        self.controls = controls or {}
+        self.ring = deque()            # (sensor timestamp ns, request), oldest first
+        self.running = False
+        self._cond = threading.Condition()
+        self._thread = None
+        # requests (not copies) go to the encoder, so the queue must stay tiny
+        self.encoder = IngestQueue(ENCODE_QUEUE, "block", consumer=self._encode, name="warm_encode")
+        # on_saved/on_preview callbacks; keeps running across paused()
+        self.delivery = IngestQueue(DELIVERY_QUEUE, "block", consumer=self._deliver, name="warm_delivery")
+
+    def start(self):
+        config = self.camera.create_still_configuration(
+            main={"size": self.size, "format": "RGB888"},
+            buffer_count=self.ring_size + ENCODE_QUEUE + 2,
+            controls=self.controls
+        )
+        self.camera.configure(config)
+        self.camera.start()
+        self.running = True
+        self.encoder.start()
+        self.delivery.start()
+        self._thread = threading.Thread(target=self._run, name="warm-camera", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """Stop streaming; queued photos are still encoded"""
+        with self._cond:
+            self.running = False
+            self._cond.notify_all()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+        with self._cond:
+            held, self.ring = self.ring, deque()
+        for _, request in held:
+            request.release()
+        self.encoder.stop()
+        self.camera.stop()
+
+    def close(self):
+        """Stop for good: stop(), then run what is still queued for delivery"""
+        self.stop()
+        self.delivery.stop()
+
+    @contextmanager
+    def paused(self):
+        """Give the camera to someone else (video recording) and restart afterwards"""
+        self.stop()
+        try:
+            yield self.camera
+        finally:
+            self.start()
+
+    # ----- photo -----
+    def capture(self, path, at_ns=None, on_saved=None, timeout=FRAME_WAIT, preview=None, on_preview=None,
+                on_failed=None):
+        """Queue the frame nearest at_ns for saving to path; False if no frame
+
+        on_saved(path) runs on the delivery thread once the JPEG is written,
+        on_failed(path) on the encoder thread if writing it failed; a
+        progressive.Preview is encoded from the same frame alongside it and
+        on_preview(preview path) runs on the delivery thread too.
+        """
+        start = time.perf_counter()
+        at_ns = at_ns or now_ns()
+        with self._cond:
+            # the frame exposed at the command arrives up to one frame later
+            self._cond.wait_for(lambda: not self.running or (self.ring and self.ring[-1][0] >= at_ns),
+                                timeout)
+            if not self.ring:
+                return False
+            frame = min(self.ring, key=lambda f: abs(f[0] - at_ns))
+            self.ring.remove(frame)
+        SELECT.since(start)
+        OFFSET.observe(abs(frame[0] - at_ns) / 1e9)
+        if not self.encoder.put((frame[1], path, on_saved, on_failed, preview, on_preview)):
+            frame[1].release()
+            return False
+        PHOTOS.inc()
+        return True
+
+    def _run(self):
+        while self.running:
+            try:
+                request = self.camera.capture_request()
+            except Exception as e:
+                print(f"Warm camera stopped delivering frames: {e}")
+                return
+            timestamp = request.get_metadata().get("SensorTimestamp") or now_ns()
+            with self._cond:
+                self.ring.append((timestamp, request))
+                oldest = self.ring.popleft() if len(self.ring) > self.ring_size else None
+                self._cond.notify_all()
+            if oldest:
+                oldest[1].release()
+            FRAMES.inc()
+
+    def _encode(self, items):
+        for request, path, on_saved, on_failed, preview, on_preview in items:
+            start = time.perf_counter()
+            # the preview thread only queues its file: save_request waits for it
+            queue_preview = (lambda p: self.delivery.put((on_preview, p))) if on_preview else None
+            try:
+                save_request(request, path, preview, queue_preview)
+            except Exception as e:
+                ERRORS.inc()
+                print(f"Saving {path} failed: {e}")
+                if on_failed:
+                    on_failed(path)
+                continue
+            finally:
+                request.release()
+            ENCODE.since(start)
+            if on_saved:
+                self.delivery.put((on_saved, path))
+
+    def _deliver(self, items):
+        for callback, path in items:
+            try:
+                callback(path)
+            except Exception as e:
+                print(f"Delivering {path} failed: {e}")